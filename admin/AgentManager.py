@@ -1,24 +1,28 @@
 import logging
 
 from fastapi import APIRouter, Depends, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import Optional
 from uuid import UUID, uuid4
 from datetime import datetime
 import json
 
-from migrations.session import get_db
+from migrations.session import get_async_db
 from migrations.models import Agent
 
 from utils.response import response
-from common.AgentPromptHandler import AgentPromptHandler
+from utils.search import contains_pattern, LIKE_ESCAPE
+from utils.pagination import encode_cursor, decode_cursor, keyset_after, keyset_order, keyset_page, cached_count
+from common.AgentPromptHandler import AgentPromptHandler, get_agent_prompt_handler
 from admin.WorkspaceHelper import check_workspace_agent_manage_access
+from admin.CasebookSearchIndex import casebook_search_index
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-agent_prompt_handler = AgentPromptHandler()
 
 
 class AgentCreate(BaseModel):
@@ -73,10 +77,11 @@ class AgentResponse(BaseModel):
 
 
 @router.post("/add_agent")
-def create_agent(
+async def create_agent(
         agent_data: AgentCreate,
         request: Request,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
+        agent_prompt_handler: AgentPromptHandler = Depends(get_agent_prompt_handler),
 ):
     """
     Create a new agent record in the database.
@@ -109,35 +114,37 @@ def create_agent(
     if not all(k.isnumeric() for k in agent_data.system_prompt.keys()):
         return response(False, message="Prompt keys must be numeric")
 
-    # add each item as a prompt
-    for key, value in agent_data.system_prompt.items():
-        # if value is dict, convert it to json
-        if isinstance(value, dict):
-            value = json.dumps(value)
-        agent_prompt_handler.put_agent_prompt(str(new_agent.agent_id), value, key)
+    # add all items as prompts in one batch, under the prompt version of this update
+    # if value is dict, convert it to json
+    prompts = {key: json.dumps(value) if isinstance(value, dict) else value
+               for key, value in agent_data.system_prompt.items()}
+    prompt_version = agent_prompt_handler.version_of(new_agent.updated_at)
+    await run_in_threadpool(agent_prompt_handler.put_agent_prompts, str(new_agent.agent_id), prompts, prompt_version)
 
     try:
-        db.commit()
-        db.refresh(new_agent)
+        await db.commit()
+        await db.refresh(new_agent)
+        await run_in_threadpool(agent_prompt_handler.activate_version, str(new_agent.agent_id), prompt_version)
+        await run_in_threadpool(casebook_search_index.publish_change, str(new_agent.agent_id))
         logger.info(f"Inserted new agent: {new_agent.agent_id} - {new_agent.agent_name}")
         return response(True, {"agent_id": str(new_agent.agent_id)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to insert new agent: {e}")
         response(False, message=str(e))
 
 
 @router.post("/delete_agent")
-def delete_agent(
+async def delete_agent(
         delete_data: AgentDelete,
         request: Request,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete an existing agent record in the database by marking it as status=2.
     Will not actually delete the record or prompt from the database.
     """
-    agent_to_delete = db.query(Agent).filter(Agent.agent_id == delete_data.agent_id).first()
+    agent_to_delete = await db.scalar(select(Agent).where(Agent.agent_id == delete_data.agent_id))
 
     # check if the user has access to manage agents in the workspace
     user_jwt = request.state.user_jwt_content
@@ -150,25 +157,27 @@ def delete_agent(
     try:
         # mark the agent as deleted by setting the status to 2
         agent_to_delete.status = 2
-        db.commit()
+        await db.commit()
+        await run_in_threadpool(casebook_search_index.publish_change, str(delete_data.agent_id))
         logger.info(f"Deleted agent: {delete_data.agent_id}")
         return response(True, {"agent_id": str(delete_data.agent_id)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to delete agent: {e}")
         response(False, message=str(e))
 
 
 @router.post("/update_agent")
-def edit_agent(
+async def edit_agent(
         update_data: AgentUpdate,
         request: Request,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db),
+        agent_prompt_handler: AgentPromptHandler = Depends(get_agent_prompt_handler)
 ):
     """
     Update an existing agent record in the database.
     """
-    agent_to_update = db.query(Agent).filter(Agent.agent_id == update_data.agent_id).first()
+    agent_to_update = await db.scalar(select(Agent).where(Agent.agent_id == update_data.agent_id))
 
     # check if the user has access to manage agents in the workspace that the agent from,
     # and the workspace that the agent is being moved to, if these are different
@@ -204,52 +213,85 @@ def edit_agent(
         agent_to_update.files = update_data.files
     if update_data.workspace_id is not None:
         agent_to_update.workspace_id = update_data.workspace_id
+    previous_total_steps = agent_to_update.agent_total_steps
     agent_to_update.updated_at = datetime.now()
     agent_to_update.agent_total_steps = len(update_data.system_prompt)
+    prompt_version = agent_prompt_handler.version_of(agent_to_update.updated_at)
 
     if update_data.system_prompt is not None:
         # check if all item keys in the system_prompt are numbers
         if not all(k.isnumeric() for k in update_data.system_prompt.keys()):
             return response(False, message="Prompt keys must be numeric")
 
-        # add each item as a prompt
-        for key, value in update_data.system_prompt.items():
-            # if value is dict, convert it to json
-            if isinstance(value, dict):
-                value = json.dumps(value)
-            agent_prompt_handler.put_agent_prompt(str(agent_to_update.agent_id), value, key)
+        # add all items as prompts in one batch, under the prompt version of this update,
+        # and delete the steps this update removed
+        # if value is dict, convert it to json
+        prompts = {key: json.dumps(value) if isinstance(value, dict) else value
+                   for key, value in update_data.system_prompt.items()}
+        stale_steps = [str(step) for step in range(len(prompts), previous_total_steps)]
+        await run_in_threadpool(agent_prompt_handler.put_agent_prompts, str(agent_to_update.agent_id), prompts,
+                                prompt_version, stale_steps)
 
     try:
-        db.commit()
-        db.refresh(agent_to_update)
+        await db.commit()
+        await db.refresh(agent_to_update)
+        if update_data.system_prompt is not None:
+            await run_in_threadpool(agent_prompt_handler.activate_version, str(agent_to_update.agent_id),
+                                    prompt_version)
+        await run_in_threadpool(casebook_search_index.publish_change, str(agent_to_update.agent_id))
         logger.info(f"Updated agent: {agent_to_update.agent_id}")
         return response(True, {"agent_id": str(agent_to_update.agent_id)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to update agent: {e}")
         response(False, message=str(e))
 
 
 @router.get("/agents")
-def list_agents(
+async def list_agents(
         request: Request,
         search: Optional[str] = None,
         workspace_id: Optional[str] = None,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         page: int = 1,
-        page_size: int = 10
+        page_size: int = 10,
+        cursor: Optional[str] = None,
+        include_total: bool = False
 ):
     """
     List agents with pagination.
+    Pass cursor (an empty string for the first page) to page by next_cursor instead of page number.
+    The total is only counted with include_total in cursor mode, and cached.
+    Searches are served ranked from the in-memory casebook search index once it is built.
     """
     # Define the fields to be returned
     fields = (Agent.agent_name, Agent.agent_cover, Agent.agent_description, Agent.agent_id, Agent.updated_at, Agent.workspace_id)
     # Get the workspaces that the user has access to
     allowed_workspaces = list(request.state.user_jwt_content['workspace_role'].keys())
 
+    if search and casebook_search_index.ready:
+        if workspace_id and workspace_id not in allowed_workspaces:
+            # make sure the user has access to the workspace requested
+            return response(False, message="You do not have access to this casebook")
+        ranked = casebook_search_index.search(search, [workspace_id] if workspace_id else allowed_workspaces)
+        total = len(ranked)
+        next_cursor = None
+        if cursor is not None:
+            # keyset on the ranking order (descending score, then agent id)
+            after = decode_cursor(cursor, (float, str))
+            if after is not None:
+                ranked = [result for result in ranked if (-result[0], result[1]) > (-after[0], after[1])]
+            ranked, next_cursor = keyset_page(ranked[:page_size + 1], page_size,
+                                              lambda result: encode_cursor(result[0], result[1]))
+        else:
+            skip = (page - 1) * page_size
+            ranked = ranked[skip:skip + page_size]
+        return response(True, data={"agents": [fields for _, _, fields in ranked], "total": total,
+                                    "next_cursor": next_cursor})
+
     if (search is None or search == "") and (workspace_id is None or workspace_id == ""):
         # no filter applied, get all agents that the user have access to
-        query = db.query(Agent).with_entities(*fields).filter(Agent.status != 2).filter(Agent.workspace_id.in_(allowed_workspaces))
+        query = select(*fields).where(Agent.status != 2).where(Agent.workspace_id.in_(allowed_workspaces))
 
     elif (search is None or search == "") and (workspace_id is not None and workspace_id != ""):
         # no search, but filter by workspace_id
@@ -258,12 +300,13 @@ def list_agents(
             # make sure the user has access to the workspace requested
             return response(False, message="You do not have access to this casebook")
 
-        query = db.query(Agent).with_entities(*fields).filter(Agent.status != 2).filter(Agent.workspace_id == workspace_id)
+        query = select(*fields).where(Agent.status != 2).where(Agent.workspace_id == workspace_id)
 
     elif (search is not None and search != "") and (workspace_id is None or workspace_id == ""):
         # search by name or description, but no filter by workspace_id
-        query = (db.query(Agent).with_entities(*fields).filter(Agent.status != 2).filter(Agent.workspace_id.in_(allowed_workspaces))
-                 .filter((Agent.agent_name.ilike(f"%{search}%")) | (Agent.agent_description.ilike(f"%{search}%"))))
+        query = (select(*fields).where(Agent.status != 2).where(Agent.workspace_id.in_(allowed_workspaces))
+                 .where((Agent.agent_name.ilike(contains_pattern(search), escape=LIKE_ESCAPE)) |
+                        (Agent.agent_description.ilike(contains_pattern(search), escape=LIKE_ESCAPE))))
 
     elif (search is not None and search != "") and (workspace_id is not None and workspace_id != ""):
         # search by name or description, and filter by workspace_id
@@ -272,31 +315,44 @@ def list_agents(
             # make sure the user has access to the workspace requested
             return response(False, message="You do not have access to this casebook")
 
-        query = (db.query(Agent).with_entities(*fields).filter(Agent.status != 2).filter(Agent.workspace_id == workspace_id)
-                 .filter((Agent.agent_name.ilike(f"%{search}%")) | (Agent.agent_description.ilike(f"%{search}%"))))
+        query = (select(*fields).where(Agent.status != 2).where(Agent.workspace_id == workspace_id)
+                 .where((Agent.agent_name.ilike(contains_pattern(search), escape=LIKE_ESCAPE)) |
+                        (Agent.agent_description.ilike(contains_pattern(search), escape=LIKE_ESCAPE))))
 
     else:
         return response(False, message="Invalid search parameters")
-    total = query.count()
-    query = query.order_by(Agent.updated_at.desc())
-    skip = (page - 1) * page_size
-    agents = query.offset(skip).limit(page_size).all()
+    next_cursor = None
+    if cursor is not None:
+        count_key = ("agents", tuple(sorted(allowed_workspaces)), workspace_id, search)
+        total = await cached_count(db, query, count_key) if include_total else None
+        after = keyset_after(Agent.updated_at, Agent.agent_id, decode_cursor(cursor, (datetime, UUID)))
+        if after is not None:
+            query = query.where(after)
+        query = query.order_by(*keyset_order(Agent.updated_at, Agent.agent_id))
+        agents = (await db.execute(query.limit(page_size + 1))).all()
+        agents, next_cursor = keyset_page(agents, page_size, lambda agent: encode_cursor(agent[4], agent[3]))
+    else:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+        query = query.order_by(Agent.updated_at.desc())
+        skip = (page - 1) * page_size
+        agents = (await db.execute(query.offset(skip).limit(page_size))).all()
     # Convert each tuple into a dictionary
     agents = [dict(agent_name=agent[0], agent_cover=agent[1], agent_description=agent[2], agent_id=agent[3],
                    updated_at=agent[4], workspace_id=agent[5]) for agent in agents]
-    return response(True, data={"agents": agents, "total": total})
+    return response(True, data={"agents": agents, "total": total, "next_cursor": next_cursor})
 
 
 @router.get("/agent/{agent_id}")
-def get_agent_by_id(
+async def get_agent_by_id(
         agent_id: UUID,
         request: Request,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db),
+        agent_prompt_handler: AgentPromptHandler = Depends(get_agent_prompt_handler)
 ):
     """
     Fetch an agent by its UUID.
     """
-    agent = db.query(Agent).filter(Agent.agent_id == agent_id, Agent.status != 2).first()  # exclude deleted agents
+    agent = await db.scalar(select(Agent).where(Agent.agent_id == agent_id, Agent.status != 2))  # exclude deleted agents
 
     # check if the user has access to manage agents in the workspace
     user_jwt = request.state.user_jwt_content
@@ -305,11 +361,10 @@ def get_agent_by_id(
 
     if agent is None:
         response(False, status_code=404, message="Agent not found")
-    # get the prompt for the agent
-    system_prompt = {}
-    for step in range(0, agent.agent_total_steps):
-        system_prompt[step] = agent_prompt_handler.get_agent_prompt(str(agent_id), str(step))
-    agent.system_prompt = system_prompt
+    # get all the prompts of the agent in one batch
+    prompts = await run_in_threadpool(agent_prompt_handler.get_agent_prompts, str(agent_id),
+                                      [str(step) for step in range(agent.agent_total_steps)])
+    agent.system_prompt = {int(step): prompt for step, prompt in prompts.items()}
     if not agent.files:
         agent.files = {}
     return response(True, data=agent)
@@ -0,0 +1,243 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: CasebookSearchIndex.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 16:40
+"""
+import re
+import math
+import bisect
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+from migrations.session import SessionLocal
+from migrations.models import Agent
+from common.CacheInvalidationBus import cache_invalidation_bus
+
+logger = logging.getLogger(__name__)
+
+
+class CasebookSearchIndex:
+    """
+    CasebookSearchIndex: a per-worker inverted index over the names and descriptions of the cases (agents),
+    serving the list_agents search with TF-IDF ranked results without a database round trip.
+    A query word matches index terms exactly, by prefix (so results show up while typing) or within one typo,
+    inexact matches score less. Words in the name count NAME_WEIGHT times. Cases whose name or description
+    contains the query as a substring (what the SQL search matches, e.g. "arket" in "market") are always
+    returned too, after the ranked ones.
+    The index is built at startup and kept up to date through the cache invalidation bus: whoever changes an
+    agent publishes its id, and every worker reloads that one agent. It is also rebuilt every REBUILD_INTERVAL
+    seconds, in case an invalidation message is lost.
+    """
+    INVALIDATION_TOPIC = "casebook"
+    REBUILD_INTERVAL = 600  # seconds
+    NAME_WEIGHT = 2
+    PREFIX_WEIGHT = 0.8
+    TYPO_WEIGHT = 0.6
+    MIN_PREFIX_LENGTH = 2
+    MIN_TYPO_LENGTH = 4  # shorter words have too many neighbours within one typo
+    MAX_EXPANSIONS = 50  # index terms tried per query word
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = False
+        self.task: asyncio.Task | None = None
+        self.build_reloads: set[str] | None = None  # agents reloaded while a build runs, None when not building
+        self.documents: dict[str, dict] = {}  # agent id -> listing fields, workspace and term frequencies
+        self.postings: dict[str, dict[str, int]] = {}  # term -> {agent id: weighted term frequency}
+        self.sorted_terms: list[str] = []  # for prefix lookups
+        self.deletes: dict[str, set[str]] = {}  # term with one letter removed (or the term itself) -> terms
+
+    @classmethod
+    def tokenize(cls, text: str | None) -> list[str]:
+        return cls.TOKEN_PATTERN.findall(text.casefold()) if text else []
+
+    def build(self):
+        """
+        Load every case that is not deleted, called from the app lifespan and every REBUILD_INTERVAL seconds.
+        The new index is built aside and swapped in, searches are not blocked meanwhile. Agents reloaded while
+        it is built may be older in the new index than in the current one, they are reloaded again after the swap.
+        """
+        with self.lock:
+            self.build_reloads = set()
+        try:
+            with SessionLocal() as db:
+                agents = db.query(Agent).filter(Agent.status != 2).all()
+            fresh = CasebookSearchIndex()
+            for agent in agents:
+                fresh.__add(agent)
+            with self.lock:
+                self.documents, self.postings = fresh.documents, fresh.postings
+                self.sorted_terms, self.deletes = fresh.sorted_terms, fresh.deletes
+                self.ready = True
+                build_reloads, self.build_reloads = self.build_reloads, None
+            for agent_id in build_reloads:
+                self.reload(agent_id)
+            logger.info(f"Casebook search index built with {len(agents)} cases")
+        except Exception as e:
+            with self.lock:
+                self.build_reloads = None
+            logger.error(f"Error building the casebook search index: {e}")
+
+    async def start(self):
+        """
+        Build the index and start rebuilding it periodically, called from the app lifespan.
+        """
+        await asyncio.to_thread(self.build)
+        self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.REBUILD_INTERVAL)
+            await asyncio.to_thread(self.build)
+
+    def publish_change(self, agent_id: str):
+        """
+        Tell every worker (this one included) to reload an agent, call it after the change is committed.
+        Blocking, run it in the threadpool from async code.
+        """
+        cache_invalidation_bus.publish(self.INVALIDATION_TOPIC, agent_id)
+
+    def reload(self, agent_id: str):
+        """
+        Reload one agent from the database, called through the cache invalidation bus.
+        """
+        with self.lock:
+            if self.build_reloads is not None:
+                self.build_reloads.add(agent_id)
+            if not self.ready:
+                return
+        try:
+            with SessionLocal() as db:
+                agent = db.query(Agent).filter(Agent.agent_id == agent_id).first()
+            with self.lock:
+                self.__remove(agent_id)
+                if agent is not None and agent.status != 2:
+                    self.__add(agent)
+        except Exception as e:
+            logger.error(f"Error updating the casebook search index: {e}")
+
+    def search(self, query: str, workspace_ids) -> list[tuple[float, str, dict]]:
+        """
+        Rank the cases of the given workspaces against the query.
+        :param query: the search text
+        :param workspace_ids: the workspaces to search in
+        :return: (score, agent id, listing fields) of the matching cases, ordered by descending score then agent
+            id. Cases only matching the query as a substring score 0.
+        """
+        workspace_ids = set(workspace_ids)
+        scores: dict[str, float] = {}
+        substring = query.lower()
+        with self.lock:
+            total_documents = len(self.documents)
+            for word in self.tokenize(query):
+                # a document scores the best of its matches for this word
+                word_scores: dict[str, float] = {}
+                for term, match_weight in self.__expand(word).items():
+                    postings = self.postings[term]
+                    idf = math.log(1 + total_documents / len(postings))
+                    for agent_id, frequency in postings.items():
+                        document = self.documents[agent_id]
+                        if document["workspace_id"] not in workspace_ids:
+                            continue
+                        score = match_weight * (1 + math.log(frequency)) * idf / document["norm"]
+                        if score > word_scores.get(agent_id, 0):
+                            word_scores[agent_id] = score
+                for agent_id, score in word_scores.items():
+                    scores[agent_id] = scores.get(agent_id, 0) + score
+            if substring:
+                for agent_id, document in self.documents.items():
+                    if (agent_id not in scores and document["workspace_id"] in workspace_ids
+                            and any(substring in text for text in document["texts"])):
+                        scores[agent_id] = 0.0
+            ranked = sorted(scores, key=lambda agent_id: (-scores[agent_id], agent_id))
+            return [(scores[agent_id], agent_id, self.documents[agent_id]["fields"]) for agent_id in ranked]
+
+    def __expand(self, word: str) -> dict[str, float]:
+        """
+        The index terms a query word matches, with their match weight.
+        """
+        matches = {}
+        if len(word) >= self.MIN_TYPO_LENGTH:
+            for variant in self.__variants(word):
+                for term in self.deletes.get(variant, ()):
+                    matches[term] = self.TYPO_WEIGHT
+        if len(word) >= self.MIN_PREFIX_LENGTH:
+            start = bisect.bisect_left(self.sorted_terms, word)
+            for term in self.sorted_terms[start:start + self.MAX_EXPANSIONS]:
+                if not term.startswith(word):
+                    break
+                matches[term] = self.PREFIX_WEIGHT
+        if word in self.postings:
+            matches[word] = 1.0
+        return matches
+
+    @staticmethod
+    def __variants(term: str) -> set[str]:
+        """
+        The term and the term with each letter removed. Two terms are within one insertion, deletion or
+        substitution of each other when their variants overlap.
+        """
+        return {term} | {term[:i] + term[i + 1:] for i in range(len(term))}
+
+    def __add(self, agent: Agent):
+        agent_id = str(agent.agent_id)
+        frequencies = Counter()
+        for term in self.tokenize(agent.agent_name):
+            frequencies[term] += self.NAME_WEIGHT
+        for term in self.tokenize(agent.agent_description):
+            frequencies[term] += 1
+        self.documents[agent_id] = {
+            "workspace_id": agent.workspace_id,
+            "frequencies": frequencies,
+            "norm": math.sqrt(sum(frequencies.values())) or 1,
+            "texts": [text.lower() for text in (agent.agent_name, agent.agent_description) if text],
+            "fields": dict(agent_name=agent.agent_name, agent_cover=agent.agent_cover,
+                           agent_description=agent.agent_description, agent_id=agent.agent_id,
+                           updated_at=agent.updated_at, workspace_id=agent.workspace_id),
+        }
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                bisect.insort(self.sorted_terms, term)
+                if len(term) >= self.MIN_TYPO_LENGTH:
+                    for variant in self.__variants(term):
+                        self.deletes.setdefault(variant, set()).add(term)
+            self.postings[term][agent_id] = frequency
+
+    def __remove(self, agent_id: str):
+        document = self.documents.pop(agent_id, None)
+        if document is None:
+            return
+        for term in document["frequencies"]:
+            postings = self.postings[term]
+            postings.pop(agent_id, None)
+            if postings:
+                continue
+            del self.postings[term]
+            del self.sorted_terms[bisect.bisect_left(self.sorted_terms, term)]
+            if len(term) >= self.MIN_TYPO_LENGTH:
+                for variant in self.__variants(term):
+                    terms = self.deletes.get(variant)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self.deletes[variant]
+
+
+casebook_search_index = CasebookSearchIndex()
+cache_invalidation_bus.subscribe(CasebookSearchIndex.INVALIDATION_TOPIC, casebook_search_index.reload)
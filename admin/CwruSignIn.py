@@ -6,10 +6,10 @@
 @email: rxy216@case.edu
 @time: 5/6/24 10:23
 """
-import requests
 import xml.etree.ElementTree as ET
 from fastapi.responses import RedirectResponse
 from admin.UserAuth import UserAuth
+from common.ClientRegistry import client_registry
 import os
 
 
@@ -37,7 +37,7 @@ class AuthSSO:
                 "ticket": self.ticket,
                 "service": f"https://api.prepit-ai.com/v1/prod/admin/cwru_sso_callback?came_from={self.came_from}",
             }
-        response = requests.get(url, params=params)
+        response = client_registry.http_session.get(url, params=params)
         root = ET.fromstring(response.text)
         # get child node
         child = root[0]
@@ -52,12 +52,10 @@ class AuthSSO:
                     'last_name': user_info['sn'],
                     'student_id': self.student_id
                 }
-                user_id = user_auth.user_login('cwru', processed_user_info, user_info)
-                if user_id:
-                    refresh_token = user_auth.gen_refresh_token(user_id, user_info)
-                    access_token = user_auth.gen_access_token(refresh_token)
+                login_result = user_auth.login('cwru', processed_user_info, user_info)
+                if login_result:
                     return RedirectResponse(
-                        url=f"{self.came_from}?refresh={refresh_token}&access={access_token}")
+                        url=f"{self.came_from}?refresh={login_result['refresh_token']}&access={login_result['access_token']}")
                 else:
                     return RedirectResponse(url=f"{self.came_from}?refresh=error&access=error")
             else:
@@ -6,13 +6,13 @@
 @email: rxy216@case.edu
 @time: 7/6/24 16:55
 """
-import redis
 import os
 import random
 import uuid
 import json
 import logging
 from fastapi import APIRouter, Depends
+from starlette.concurrency import run_in_threadpool
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Asm, GroupId, ReplyTo, From
 from dotenv import load_dotenv
@@ -22,9 +22,9 @@ from migrations.session import get_db
 from migrations.models import User
 from utils.response import response
 from admin.UserAuth import UserAuth
+from common.ClientRegistry import client_registry
 
 load_dotenv(dotenv_path="/run/secrets/prepit-secret")
-redis_client = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=6379, protocol=3, decode_responses=True)
 sg_client = SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
 
 router = APIRouter()
@@ -56,7 +56,7 @@ async def get_email_otp(email_signin_request: GetOtpRequest, db=Depends(get_db))
     """
     email = email_signin_request.email
     # check if the email is already in redis, if so, get the info and do not send email again
-    sent_check = redis_client.get(email)
+    sent_check = client_registry.redis.get(email)
     if sent_check:
         sent_info = json.loads(str(sent_check))
         return response(True, data={"new_account": sent_info["new_account"], "event_id": sent_info["event_id"],
@@ -79,7 +79,7 @@ async def get_email_otp(email_signin_request: GetOtpRequest, db=Depends(get_db))
             "event_id": event_id,
             "new_account": new_account
         }
-        cache = redis_client.set(email, json.dumps(info), ex=OTP_EXPIRATION)
+        cache = client_registry.redis.set(email, json.dumps(info), ex=OTP_EXPIRATION)
     except Exception as e:
         print(f"Error during get email otp: {e}")
         return response(False, status_code=500, message="Error during get email otp")
@@ -121,13 +121,13 @@ async def email_signin(email_signin_request: EmailSignInRequest):
     first_name = email_signin_request.first_name
     last_name = email_signin_request.last_name
     # check if the email and otp are in redis
-    sent_check = redis_client.get(email)
+    sent_check = client_registry.redis.get(email)
     if not sent_check:
         return response(False, status_code=401, message="Email OTP expired or not found, please try again")
     sent_info = json.loads(str(sent_check))
     if sent_info["email_otp"] != otp:
         return response(False, status_code=401, message="Email OTP does not match")
-    ttl = redis_client.ttl(email)
+    ttl = client_registry.redis.ttl(email)
     email_send_time = OTP_EXPIRATION - ttl
     try:
         user_auth = UserAuth()
@@ -142,14 +142,13 @@ async def email_signin(email_signin_request: EmailSignInRequest):
             "user_event_id": user_event_id,
             "email_send_time": email_send_time
         }
-        login_result = user_auth.user_login("email", user_info_dict, signin_metadata_dict)
+        login_result = await run_in_threadpool(user_auth.login, "email", user_info_dict, signin_metadata_dict)
         if login_result is False:
             return response(False, status_code=401, message="Error during email sign in")
         else:
-            dele = redis_client.delete(email)
-            refresh_token = user_auth.gen_refresh_token(login_result, signin_metadata_dict)
-            access_token = user_auth.gen_access_token(refresh_token)
-            return response(True, data={"refresh_token": refresh_token, "access_token": access_token})
+            dele = client_registry.redis.delete(email)
+            return response(True, data={"refresh_token": login_result["refresh_token"],
+                                        "access_token": login_result["access_token"]})
     except Exception as e:
         print(f"Error during email sign in: {e}")
         return response(False, status_code=500, message="Error during email sign in")
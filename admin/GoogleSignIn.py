@@ -11,8 +11,8 @@ from google.auth.transport import requests
 from google_auth_oauthlib.flow import Flow
 from dotenv import load_dotenv
 import os
-import redis
 from admin.UserAuth import UserAuth
+from common.ClientRegistry import client_registry
 from fastapi.responses import RedirectResponse
 import logging
 
@@ -26,7 +26,6 @@ if CURRENT_ENV == "redis-dev-server":
     GOOGLE_REDIRECT_URI = "https://api.prepit-ai.com/v1/dev/admin/google_signin_callback"
 else:
     GOOGLE_REDIRECT_URI = "https://api.prepit-ai.com/v1/prod/admin/google_signin_callback"
-redis_client = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=6379, protocol=3, decode_responses=True)
 
 
 def get_flow():
@@ -66,7 +65,7 @@ def get_signin_url(current_url):
     )
 
     # Store the state so the callback can verify the auth server response.
-    redis_client.set(state, current_url)
+    client_registry.redis.set(state, current_url)
 
     return authorization_url
 
@@ -79,10 +78,10 @@ def signin_callback(code, state, error):
     log user in
     """
     # Validate the state to protect against cross-site request forgery.
-    redirect_url = redis_client.get(state)
+    redirect_url = client_registry.redis.get(state)
     if redirect_url is None:
         return False
-    redis_client.delete(state)
+    client_registry.redis.delete(state)
     if error is not None:
         return RedirectResponse(url=f"{redirect_url}?refresh=error&access=error")
     try:
@@ -97,12 +96,10 @@ def signin_callback(code, state, error):
             'profile_img_url': id_token_info['picture'] if 'picture' in id_token_info
             else f"https://api.dicebear.com/9.x/notionists-neutral/png?seed={id_token_info['given_name']}{id_token_info['family_name']}"
         }
-        user_id = user_auth.user_login('google', processed_user_info, id_token_info)
-        if user_id:
-            refresh_token = user_auth.gen_refresh_token(user_id, id_token_info)
-            access_token = user_auth.gen_access_token(refresh_token)
+        login_result = user_auth.login('google', processed_user_info, id_token_info)
+        if login_result:
             return RedirectResponse(
-                url=f"{redirect_url}?refresh={refresh_token}&access={access_token}")
+                url=f"{redirect_url}?refresh={login_result['refresh_token']}&access={login_result['access_token']}")
         else:
             return RedirectResponse(url=f"{redirect_url}?refresh=error&access=error")
     except Exception as e:
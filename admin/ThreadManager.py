@@ -6,32 +6,34 @@
 @email: rxy216@case.edu
 @time: 6/19/24 16:50
 """
+import json
 import logging
 from datetime import datetime
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional
 from uuid import UUID, uuid4
 
 from utils.response import response
-from common.MessageStorageHandler import MessageStorageHandler
-from common.FeedbackStorageHandler import FeedbackStorageHandler
+from utils.search import contains_pattern, LIKE_ESCAPE
+from utils.concurrency import fan_out
+from utils.pagination import encode_cursor, decode_cursor, keyset_after, keyset_order, keyset_page, cached_count
+from common.MessageStorageHandler import MessageStorageHandler, get_message_handler
+from common.FeedbackStorageHandler import FeedbackStorageHandler, get_feedback_handler
 
-from migrations.session import get_db
+from migrations.session import get_async_db
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from migrations.models import Thread, Agent
 
-from common.DynamicAuth import DynamicAuth
+from common.DynamicAuth import DynamicAuth, get_dynamic_auth
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# Initialize the MessageStorageHandler
-message_handler = MessageStorageHandler()
-feedback_handler = FeedbackStorageHandler()
-
 
 class ThreadListQuery(BaseModel):
     user_id: Optional[str] = None
@@ -51,14 +53,14 @@ class ThreadContent(BaseModel):
 
 
 @router.get("/new_thread")
-def get_new_thread(agent_id: str, request: Request, db: Session = Depends(get_db)):
+async def get_new_thread(agent_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     user_jwt = request.state.user_jwt_content
     user_id = user_jwt['user_id']
     student_id = user_jwt['student_id']
     user_name = user_jwt['first_name'] + " " + user_jwt['last_name']
     user_workspaces = user_jwt['workspace_role']
     try:
-        agent_query = db.query(Agent).filter(Agent.agent_id == agent_id).first()
+        agent_query = await db.scalar(select(Agent).where(Agent.agent_id == agent_id))
         agent_name = agent_query.agent_name
         workspace_id = agent_query.workspace_id
         if user_workspaces.get(workspace_id, None) is None:
@@ -79,51 +81,92 @@ def get_new_thread(agent_id: str, request: Request, db: Session = Depends(get_db
                         student_id=student_id,
                         user_name=user_name)
         db.add(thread)
-        db.commit()
+        await db.commit()
         return response(True, data={"thread_id": thread_id})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating new thread: {e}")
         return response(False, status_code=500, message="Please try again later")
 
 
 @router.get("/get_thread/{thread_id}")
-def get_thread_by_id(thread_id: UUID):
+async def get_thread_by_id(thread_id: UUID,
+                           message_handler: MessageStorageHandler = Depends(get_message_handler),
+                           feedback_handler: FeedbackStorageHandler = Depends(get_feedback_handler)):
     """
     Fetch all entries for a specific thread by its UUID, sorted by creation time.
+    The messages come from DynamoDB in created_at order (the sort key) and are streamed as the pages arrive,
+    the body is the same JSON as response(True, data={"thread_id", "messages", "feedback"}).
     """
     try:
-        thread_messages = message_handler.get_thread(str(thread_id))
-        thread_feedback = feedback_handler.get_feedback_for_thread(str(thread_id))
-        if not thread_messages:
+        pages = message_handler.iter_thread_pages(str(thread_id))
+        # the first page and the feedback are on different tables, fetch them together.
+        # the first page is needed before streaming, an empty thread is still a 404
+        first_page, thread_feedback = await fan_out(
+            anext(pages, None), feedback_handler.get_feedback_for_thread_async(str(thread_id)))
+        if first_page is None:
             return response(False, status_code=404, message="Interview not found")
-
-        # Sort the messages by 'created_at' time in ascending order
-        sorted_messages = sorted(thread_messages, key=lambda x: x.created_at)
         # Sort the feedback by 'step_id' in ascending order
         sorted_feedback = sorted(thread_feedback, key=lambda x: x.step_id)
-        return response(True, data={"thread_id": thread_id,
-                                    "messages": sorted_messages,
-                                    "feedback": sorted_feedback})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching thread content: {e}")
         response(False, status_code=500, message=str(e))
 
+    async def thread_body():
+        yield (f'{{"status":200,"data":{{"thread_id":{json.dumps(str(thread_id))},"feedback":['
+               + ",".join(feedback.model_dump_json() for feedback in sorted_feedback)
+               + '],"messages":[')
+        page = first_page
+        separator = ""
+        try:
+            while page is not None:
+                yield separator + ",".join(message.model_dump_json() for message in page)
+                separator = ","
+                page = await anext(pages, None)
+        except Exception as e:
+            # the status is already sent, leave the body unterminated so the client sees an error
+            # instead of a silently truncated thread
+            logger.error(f"Error streaming thread content: {e}")
+            raise
+        yield ']},"message":"Success"}'
+
+    return StreamingResponse(thread_body(), media_type="application/json")
+
+
+# the order of thread listings, served by the ix_ai_threads_*_recent indexes
+THREAD_LIST_ORDER = keyset_order(Thread.last_trial_timestamp, Thread.thread_id)
+
+
+def search_threads(query, search: str):
+    """
+    Filter a thread listing by agent name, student id or user name, served by the trigram indexes.
+    """
+    pattern = contains_pattern(search)
+    return query.where((Thread.agent_name.ilike(pattern, escape=LIKE_ESCAPE)) |
+                       (Thread.student_id.ilike(pattern, escape=LIKE_ESCAPE)) |
+                       (Thread.user_name.ilike(pattern, escape=LIKE_ESCAPE)))
+
 
 @router.get("/get_thread_list")
-def get_thread_list(
+async def get_thread_list(
         request: Request,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         page: int = 1,
         page_size: int = 10,
         search: Optional[str] = None,
         workspace_id: Optional[str] = None,
         admin_mode: Optional[bool] = False,
         start_date: Optional[str] = None,
-        end_date: Optional[str] = None
+        end_date: Optional[str] = None,
+        cursor: Optional[str] = None,
+        include_total: bool = False
 ):
     """
     List threads with pagination, filtered by agent creator.
+    Pass cursor (an empty string for the first page) to page by next_cursor instead of page number,
+    deep pages then cost the same as the first one. The total is only counted with include_total, and cached.
    """
     query = None
     if admin_mode:
@@ -134,16 +177,17 @@ def get_thread_list(
         if user_workspaces.get(workspace_id, None) != "teacher" and not request.state.user_jwt_content['system_admin']:
             return response(False, status_code=401,
                             message="You are unauthorized. Attempting to access workspace you are not a teacher of.")
-        query = db.query(Thread).filter(Thread.workspace_id == workspace_id)
+        query = select(Thread).where(Thread.workspace_id == workspace_id)
+        count_key = ("threads", "workspace", workspace_id, search)
     else:
         user_id = request.state.user_jwt_content['user_id']
-        query = db.query(Thread).filter(Thread.user_id == user_id)
+        query = select(Thread).where(Thread.user_id == user_id)
         if workspace_id:
-            query = query.filter(Thread.workspace_id == workspace_id)
+            query = query.where(Thread.workspace_id == workspace_id)
+        count_key = ("threads", "user", user_id, workspace_id, search)
 
     if search:
-        query = query.filter((Thread.agent_name.ilike(f"%{search}%")) | (Thread.student_id.ilike(f"%{search}%")) | (
-            Thread.user_name.ilike(f"%{search}%")))
+        query = search_threads(query, search)
 
     # if start_date:
     #     try:
@@ -159,10 +203,20 @@ def get_thread_list(
     #     except ValueError:
     #         raise response(False, status_code=400,
     #                        message="Invalid end_date format. Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
-    total = query.count()
-    threads = (query.order_by(Thread.last_trial_timestamp.desc()).
-               offset((page - 1) * page_size).
-               limit(page_size).all())
+    next_cursor = None
+    if cursor is not None:
+        total = await cached_count(db, query, count_key) if include_total else None
+        after = keyset_after(Thread.last_trial_timestamp, Thread.thread_id, decode_cursor(cursor, (datetime, UUID)))
+        if after is not None:
+            query = query.where(after)
+        threads = (await db.scalars(query.order_by(*THREAD_LIST_ORDER).limit(page_size + 1))).all()
+        threads, next_cursor = keyset_page(threads, page_size,
+                                           lambda t: encode_cursor(t.last_trial_timestamp, t.thread_id))
+    else:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+        threads = (await db.scalars(query.order_by(*THREAD_LIST_ORDER).
+                                    offset((page - 1) * page_size).
+                                    limit(page_size))).all()
     results = [{"thread_id": str(t.thread_id),
                 "user_id": t.user_id,
                 "created_at": str(t.created_at),
@@ -174,7 +228,7 @@ def get_thread_list(
                 "student_id": t.student_id,
                 "user_name": t.user_name
                 } for t in threads]
-    return response(True, data={"threads": results, "total": total})
+    return response(True, data={"threads": results, "total": total, "next_cursor": next_cursor})
 
 
 class ValidateThreadID(BaseModel):
@@ -183,21 +237,21 @@ class ValidateThreadID(BaseModel):
 
 
 @router.post("/validate_id")
-def validate_thread_id(validate: ValidateThreadID, db: Session = Depends(get_db)):
+async def validate_thread_id(validate: ValidateThreadID, db: AsyncSession = Depends(get_async_db),
+                             dynamic_auth: DynamicAuth = Depends(get_dynamic_auth)):
     """
     Validate the thread ID by looking up the thread in the SQL database.
     """
-    dynamic_auth = DynamicAuth()
     if not dynamic_auth.verify_auth_code(validate.dynamic_auth_code):
         return response(False, status_code=401, message="Invalid auth code")
     try:
-        thread = db.query(Thread).filter(Thread.thread_id == validate.thread_id).first()
+        thread = await db.scalar(select(Thread).where(Thread.thread_id == validate.thread_id))
         if thread is None:
             return response(False, status_code=404, message="Thread not found")
         elif thread.finished:
             return response(False, status_code=400, message="Thread is already finished")
         thread.last_trial_timestamp = datetime.now()
-        db.commit()
+        await db.commit()
         return response(True, data={"agent_id": str(thread.agent_id), "user_id": str(thread.user_id)})
     except Exception as e:
         logger.error(f"Error validating thread ID: {e}")
@@ -205,12 +259,12 @@ def validate_thread_id(validate: ValidateThreadID, db: Session = Depends(get_db)
 
 
 @router.get("/finish_thread")
-def finish_thread(thread_id: str, auth_code: str, db: Session = Depends(get_db)):
+async def finish_thread(thread_id: str, auth_code: str, db: AsyncSession = Depends(get_async_db),
+                        dynamic_auth: DynamicAuth = Depends(get_dynamic_auth)):
     """
     Mark the thread as finished.
     """
     # check if the thread id is a valid UUID
-    dynamic_auth = DynamicAuth()
     if not dynamic_auth.verify_auth_code(auth_code):
         return response(False, status_code=401, message="Invalid auth code")
     try:
@@ -218,13 +272,13 @@ def finish_thread(thread_id: str, auth_code: str, db: Session = Depends(get_db))
     except ValueError:
         return response(False, status_code=400, message="Invalid thread ID")
     try:
-        thread = db.query(Thread).filter(Thread.thread_id == thread_id).first()
+        thread = await db.scalar(select(Thread).where(Thread.thread_id == thread_id))
         if thread is None:
             return response(False, status_code=404, message="Thread not found")
         thread.finished = True
-        db.commit()
+        await db.commit()
         return response(True)
     except Exception as e:
         logger.error(f"Error finishing thread: {e}")
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=500, message="Please try again later")
@@ -7,16 +7,183 @@
 @time: 5/21/24 17:23
 """
 import uuid
+import asyncio
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from cachetools import TTLCache
+from sqlalchemy import update, bindparam
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
 from migrations.models import User, RefreshToken, UserWorkspace
-from migrations.session import get_db
+from migrations.session import session_scope
 from utils.token_utils import jwt_generator
+from common.CacheInvalidationBus import cache_invalidation_bus
 import logging
 
 
-class UserAuth:
+class AccessTokenIssueBuffer:
+    """
+    AccessTokenIssueBuffer: coalesces the issued_access_token_count / last_access_token_issued_at updates of the
+    refresh tokens, and writes them in one batch every FLUSH_INTERVAL seconds instead of a commit per access token.
+    A crash loses at most FLUSH_INTERVAL seconds of counts, they are statistics, not used for authorization.
+    """
+    FLUSH_INTERVAL = 10  # seconds
+
     def __init__(self):
-        self.db = None
+        self.lock = threading.Lock()
+        self.pending: dict[str, list] = {}  # refresh token -> [count, last issued at]
+        self.task: asyncio.Task | None = None
+
+    def record(self, refresh_token: str, issued_at: datetime):
+        with self.lock:
+            entry = self.pending.get(refresh_token)
+            if entry is None:
+                self.pending[refresh_token] = [1, issued_at]
+            else:
+                entry[0] += 1
+                entry[1] = issued_at
+
+    def flush(self):
+        """
+        Write the pending counts in one transaction. Blocking, run it in a thread from async code.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        statement = (update(RefreshToken)
+                     .where(RefreshToken.token == bindparam('b_token'))
+                     .values(issued_access_token_count=RefreshToken.issued_access_token_count + bindparam('b_count'),
+                             last_access_token_issued_at=bindparam('b_issued_at')))
+        try:
+            with session_scope() as db:
+                parameters = [{"b_token": uuid.UUID(token), "b_count": count, "b_issued_at": issued_at}
+                              for token, (count, issued_at) in pending.items()]
+                # one executemany for the whole batch
+                db.connection().execute(statement, parameters)
+                db.commit()
+        except Exception as e:
+            logging.error(f"Error flushing access token counts: {e}")
+            # put the counts back, they are retried on the next flush
+            with self.lock:
+                for token, (count, issued_at) in pending.items():
+                    entry = self.pending.setdefault(token, [0, issued_at])
+                    entry[0] += count
+                    entry[1] = max(entry[1], issued_at)
+
+    async def start(self):
+        self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        """
+        Stop the flush task and write what is left.
+        """
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await asyncio.to_thread(self.flush)
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            await asyncio.to_thread(self.flush)
+
+
+access_token_issue_buffer = AccessTokenIssueBuffer()
+
+
+class UserAuth:
+    """
+    UserAuth: sign in, refresh token and access token management.
+    The user claims behind a refresh token are cached in process, so refreshing an access token does not touch the
+    database, and an access token minted moments ago is handed out again to the other tabs refreshing at once.
+    A change to a user's roles or a logout tells every worker to drop that user's entries.
+    """
+    INVALIDATION_TOPIC = "user_claims"
+    CLAIMS_CACHE_SIZE = 10000
+    CLAIMS_CACHE_TTL = 300  # seconds, a safety net in case an invalidation message is lost
+    TOKEN_REUSE_SECONDS = 60  # an access token minted less than this ago is reused, tokens live for 30 minutes
+
+    # refresh token -> {"user_id", "expire_at", "claims", "access_token", "minted_at"}, shared by the whole process
+    claims_cache = TTLCache(maxsize=CLAIMS_CACHE_SIZE, ttl=CLAIMS_CACHE_TTL)
+    claims_lock = threading.Lock()
+
+    def __init__(self, db: Session = None):
+        # a request scoped session, if not given, each call opens its own and returns it to the pool when done
+        self.db = db
+
+    @contextmanager
+    def __session(self):
+        if self.db is not None:
+            yield self.db
+        else:
+            with session_scope() as db:
+                yield db
+
+    def login(self, signin_source: str, user_info: dict, signin_metadata: dict) -> dict or bool:
+        """
+        Sign in the user when sso authentication is successful: create or update the user, issue a refresh token
+        and mint the first access token, all in one transaction.
+        Same as user_login + gen_refresh_token + gen_access_token, without reading back what was just written.
+        :param signin_source: which way the user sign in, can be 'google' or 'email' or 'cwru'
+        :param user_info: user info from sign in source, must contain 'email', 'first_name', 'last_name'
+        can contain 'student_id', 'profile_img_url', 'school_id'
+        :param signin_metadata: all metadata from sign in source
+        :return: {"user_id", "refresh_token", "access_token"} if login successful, False otherwise
+        """
+        with self.__session() as db:
+            try:
+                signin_metadata['signin_source'] = signin_source
+                now = datetime.now()
+                # create the user, or if the email is already registered, update last login time
+                upsert_user = (insert(User)
+                               .values(first_name=user_info['first_name'],
+                                       last_name=user_info['last_name'],
+                                       email=user_info['email'],
+                                       system_admin=False,
+                                       workspace_role={'prepit': 'student'},
+                                       school_id=0,
+                                       student_id=user_info.get('student_id', ''),
+                                       last_auth_metadata=signin_metadata,
+                                       last_login=now,
+                                       create_at=now,
+                                       profile_img_url=user_info.get('profile_img_url',
+                                                                     f"https://api.dicebear.com/9.x/notionists-neutral/png?seed={user_info['first_name']}{user_info['last_name']}"))
+                               .on_conflict_do_update(index_elements=[User.email],
+                                                      set_={'last_login': now, 'last_auth_metadata': signin_metadata})
+                               .returning(User))
+                user = db.scalars(upsert_user, execution_options={"populate_existing": True}).one()
+                # the refresh token is born with its first access token
+                user_id = user.user_id
+                token = uuid.uuid4()
+                expire_at = now + timedelta(days=30)  # refresh token expires in 30 days
+                refresh_token = RefreshToken(
+                    token_id=uuid.uuid4(),
+                    user_id=user_id,
+                    token=token,
+                    created_at=now,
+                    expire_at=expire_at,
+                    auth_metadata=signin_metadata,
+                    issued_access_token_count=1,
+                    last_access_token_issued_at=now
+                )
+                db.add(refresh_token)
+                claims = self.__claims_of(user)
+                access_token = jwt_generator(*claims)
+                # everything is read before the commit, which expires the loaded objects
+                db.commit()
+                self.__cache_claims(str(token), {"user_id": user_id, "expire_at": expire_at, "claims": claims,
+                                                 "access_token": access_token, "minted_at": now})
+                return {"user_id": user_id, "refresh_token": str(token), "access_token": access_token}
+            except Exception as e:
+                logging.error(f"Error during user login: {e}")
+                db.rollback()
+                return False
 
     def user_login(self, signin_source: str, user_info: dict, signin_metadata: dict) -> int or bool:
         """
@@ -27,50 +194,49 @@ class UserAuth:
         :param signin_metadata: all metadata from sign in source
         :return: user_id if login successful, False otherwise
         """
-        if self.db is None:
-            self.db = next(get_db())
-        try:
-            user = self.db.query(User).filter(
-                User.email == user_info['email']).first()
-            signin_metadata['signin_source'] = signin_source
-            if user:
-                # if user already exists, update last login time
-                user.last_login = datetime.now()
-                user.last_auth_metadata = signin_metadata
-            else:
-                # if user does not exist, create a new user
-                user = User(
-                    first_name=user_info['first_name'],
-                    last_name=user_info['last_name'],
-                    email=user_info['email'],
-                    system_admin=False,
-                    workspace_role={'prepit': 'student'},
-                    school_id=0,
-                    student_id=user_info.get('student_id', ''),
-                    last_auth_metadata=signin_metadata,
-                    last_login=datetime.now(),
-                    create_at=datetime.now(),
-                    profile_img_url=user_info.get('profile_img_url',
-                                                  f"https://api.dicebear.com/9.x/notionists-neutral/png?seed={user_info['first_name']}{user_info['last_name']}")
-                )
-                self.db.add(user)
-            self.db.commit()
-            user_id = user.user_id
-            # TODO: add user to default workspace 'prepit'
-            # # add user to default workspace 'prepit'
-            # user_workspace = UserWorkspace(
-            #     user_id=user_id,
-            #     student_id=user_info.get('student_id', ''),
-            #     workspace_id="prepit",
-            #     role='student',
-            # )
-            # self.db.add(user_workspace)
-            # self.db.commit()
-            return user_id
-        except Exception as e:
-            logging.error(f"Error during user login: {e}")
-            self.db.rollback()
-            return False
+        with self.__session() as db:
+            try:
+                user = db.query(User).filter(
+                    User.email == user_info['email']).first()
+                signin_metadata['signin_source'] = signin_source
+                if user:
+                    # if user already exists, update last login time
+                    user.last_login = datetime.now()
+                    user.last_auth_metadata = signin_metadata
+                else:
+                    # if user does not exist, create a new user
+                    user = User(
+                        first_name=user_info['first_name'],
+                        last_name=user_info['last_name'],
+                        email=user_info['email'],
+                        system_admin=False,
+                        workspace_role={'prepit': 'student'},
+                        school_id=0,
+                        student_id=user_info.get('student_id', ''),
+                        last_auth_metadata=signin_metadata,
+                        last_login=datetime.now(),
+                        create_at=datetime.now(),
+                        profile_img_url=user_info.get('profile_img_url',
+                                                      f"https://api.dicebear.com/9.x/notionists-neutral/png?seed={user_info['first_name']}{user_info['last_name']}")
+                    )
+                    db.add(user)
+                db.commit()
+                user_id = user.user_id
+                # TODO: add user to default workspace 'prepit'
+                # # add user to default workspace 'prepit'
+                # user_workspace = UserWorkspace(
+                #     user_id=user_id,
+                #     student_id=user_info.get('student_id', ''),
+                #     workspace_id="prepit",
+                #     role='student',
+                # )
+                # db.add(user_workspace)
+                # db.commit()
+                return user_id
+            except Exception as e:
+                logging.error(f"Error during user login: {e}")
+                db.rollback()
+                return False
 
     def gen_refresh_token(self, user_id: int, signin_metadata: dict) -> str or bool:
         """
@@ -79,71 +245,110 @@ class UserAuth:
         :param signin_metadata: all metadata from sign in source
         :return: refresh token if successful, False otherwise
         """
-        if self.db is None:
-            self.db = next(get_db())
-        try:
-            token = uuid.uuid4()
-            token_id = uuid.uuid4()
-            expire_at = datetime.now() + timedelta(
-                days=30)  # refresh token expires in 30 days
-            refresh_token = RefreshToken(
-                token_id=token_id,
-                user_id=user_id,
-                token=token,
-                created_at=datetime.now(),
-                expire_at=expire_at,
-                auth_metadata=signin_metadata,
-                issued_access_token_count=0
-            )
-            self.db.add(refresh_token)
-            self.db.commit()
-            return str(token)
-        except Exception as e:
-            logging.error(f"Error during refresh token generation: {e}")
-            self.db.rollback()
-            return False
+        with self.__session() as db:
+            try:
+                token = uuid.uuid4()
+                token_id = uuid.uuid4()
+                expire_at = datetime.now() + timedelta(
+                    days=30)  # refresh token expires in 30 days
+                refresh_token = RefreshToken(
+                    token_id=token_id,
+                    user_id=user_id,
+                    token=token,
+                    created_at=datetime.now(),
+                    expire_at=expire_at,
+                    auth_metadata=signin_metadata,
+                    issued_access_token_count=0
+                )
+                db.add(refresh_token)
+                db.commit()
+                return str(token)
+            except Exception as e:
+                logging.error(f"Error during refresh token generation: {e}")
+                db.rollback()
+                return False
 
     def gen_access_token(self, refresh_token) -> str or bool:
         """
         Generate access token from refresh token.
+        The claims are served from the claims cache when possible, the issue counters are written in batches.
         :param refresh_token: refresh token
         :return: access token if refresh token is valid, False otherwise
         """
-        if self.db is None:
-            self.db = next(get_db())
-        try:
-            # Check if the refresh token is valid
-            refresh_token_obj = self.db.query(RefreshToken).filter(
-                RefreshToken.token == refresh_token).first()
-            if refresh_token_obj and refresh_token_obj.expire_at > datetime.now():
-                # refresh token is valid, get user info
-                user_id = refresh_token_obj.user_id
-                user = self.db.query(User).filter(User.user_id == user_id).first()
-                first_name = user.first_name
-                last_name = user.last_name
-                email = user.email
-                system_admin = user.system_admin
-                workspace_role = user.workspace_role
-                student_id = user.student_id
-                profile_img_url = user.profile_img_url
-                try:
-                    token = jwt_generator(user_id, first_name, last_name, email, system_admin, workspace_role,
-                                          student_id,
-                                          profile_img_url)
-                    refresh_token_obj.issued_access_token_count += 1
-                    refresh_token_obj.last_access_token_issued_at = datetime.now()
-                    self.db.commit()
-                    return token
-                except Exception as e:
-                    logging.error(f"Error during access token generation: {e}")
-                    self.db.rollback()
-                    return False
-            else:
+        now = datetime.now()
+        with self.claims_lock:
+            entry = self.claims_cache.get(refresh_token)
+            if entry is not None and entry["expire_at"] > now \
+                    and (now - entry["minted_at"]).total_seconds() < self.TOKEN_REUSE_SECONDS:
+                access_token_issue_buffer.record(refresh_token, now)
+                return entry["access_token"]
+        if entry is None or entry["expire_at"] <= now:
+            entry = self.__load_claims(refresh_token)
+            if entry is None:
                 return False
+        try:
+            token = jwt_generator(*entry["claims"])
         except Exception as e:
             logging.error(f"Error during access token generation: {e}")
-            self.db.rollback()
             return False
+        entry["access_token"] = token
+        entry["minted_at"] = now
+        self.__cache_claims(refresh_token, entry)
+        access_token_issue_buffer.record(refresh_token, now)
+        return token
+
+    def __load_claims(self, refresh_token) -> dict | None:
+        """
+        Read the user claims behind a refresh token from the database.
+        :return: the claims cache entry, None if the refresh token is invalid or expired
+        """
+        with self.__session() as db:
+            try:
+                # Check if the refresh token is valid
+                refresh_token_obj = db.query(RefreshToken).filter(
+                    RefreshToken.token == uuid.UUID(refresh_token)).first()
+                if refresh_token_obj and refresh_token_obj.expire_at > datetime.now():
+                    # refresh token is valid, get user info
+                    user_id = refresh_token_obj.user_id
+                    user = db.query(User).filter(User.user_id == user_id).first()
+                    return {"user_id": user_id, "expire_at": refresh_token_obj.expire_at,
+                            "claims": self.__claims_of(user)}
+                else:
+                    return None
+            except Exception as e:
+                logging.error(f"Error during access token generation: {e}")
+                db.rollback()
+                return None
+
+    @staticmethod
+    def __claims_of(user: User) -> tuple:
+        """
+        The arguments of jwt_generator for a user.
+        """
+        return (user.user_id, user.first_name, user.last_name, user.email, user.system_admin, user.workspace_role,
+                user.student_id, user.profile_img_url)
+
+    def __cache_claims(self, refresh_token: str, entry: dict):
+        with self.claims_lock:
+            self.claims_cache[refresh_token] = entry
+
+    @staticmethod
+    def publish_user_change(user_id):
+        """
+        Tell every worker that the roles or sessions of a user changed, call it after the change is committed.
+        Blocking, run it in the threadpool from async code.
+        """
+        cache_invalidation_bus.publish(UserAuth.INVALIDATION_TOPIC, str(user_id))
+
+    @classmethod
+    def invalidate_user(cls, user_id: str):
+        """
+        Drop the cached claims of a user, called through the cache invalidation bus.
+        """
+        with cls.claims_lock:
+            stale = [token for token, entry in cls.claims_cache.items() if str(entry["user_id"]) == user_id]
+            for token in stale:
+                cls.claims_cache.pop(token, None)
 
     def user_logout_all_devices(self, user_id) -> bool:
         """
@@ -151,17 +356,20 @@ class UserAuth:
         :param user_id: user id
         :return: True if logout successful, False otherwise
         """
-        if self.db is None:
-            self.db = next(get_db())
-        try:
-            tokens = self.db.query(RefreshToken).filter(
-                RefreshToken.user_id == user_id,
-                RefreshToken.expire_at > datetime.now()).all()
-            for token in tokens:
-                token.expire_at = datetime.now()
-            self.db.commit()
-            return True
-        except Exception as e:
-            logging.error(f"Error during user logout: {e}")
-            self.db.rollback()
-            return False
+        with self.__session() as db:
+            try:
+                tokens = db.query(RefreshToken).filter(
+                    RefreshToken.user_id == user_id,
+                    RefreshToken.expire_at > datetime.now()).all()
+                for token in tokens:
+                    token.expire_at = datetime.now()
+                db.commit()
+                self.publish_user_change(user_id)
+                return True
+            except Exception as e:
+                logging.error(f"Error during user logout: {e}")
+                db.rollback()
+                return False
+
+
+cache_invalidation_bus.subscribe(UserAuth.INVALIDATION_TOPIC, UserAuth.invalidate_user)
@@ -7,20 +7,32 @@
 @time: 8/20/24 20:44
 """
 import logging
-from fastapi import APIRouter, Depends, Request
-from sqlalchemy.orm import Session
+import csv
+import codecs
+from fastapi import APIRouter, Depends, Request, UploadFile, Form
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm.attributes import flag_modified
 
 from migrations.models import User, UserWorkspace, Workspace
-from migrations.session import get_db
+from migrations.session import get_async_db
+from admin.UserAuth import UserAuth
 from utils.response import response
+from utils.search import contains_pattern, LIKE_ESCAPE
+from utils.pagination import encode_cursor, decode_cursor, keyset_after, keyset_order, keyset_page, cached_count
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# roster imports insert this many students per statement
+ROSTER_BATCH_SIZE = 1000
+ROSTER_READ_SIZE = 64 * 1024
+
 
 class WorkspaceCreate(BaseModel):
     workspace_id: str
@@ -53,7 +65,7 @@ class AddAuthorizedUsers(BaseModel):
 
 
 @router.post("/create")
-def create_workspace(request: Request, workspace: WorkspaceCreate, db: Session = Depends(get_db)):
+async def create_workspace(request: Request, workspace: WorkspaceCreate, db: AsyncSession = Depends(get_async_db)):
     if not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
     try:
@@ -64,21 +76,38 @@ def create_workspace(request: Request, workspace: WorkspaceCreate, db: Session =
             school_id=workspace.school_id
         )
         db.add(new_workspace)
-        db.commit()
+        await db.commit()
         return response(True, message="Workspace created successfully")
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=400, message="Workspace with this name already exists")
     except Exception as e:
         logger.error(f"Error creating workspace: {e}")
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=500, message=str(e))
 
 
+async def insert_authorized_users(db: AsyncSession, workspace_id: str, student_ids: list[str]) -> int:
+    """
+    Add a batch of students to a workspace as pending in one statement, students already there are skipped.
+    Does not commit.
+    :return: the number of students inserted
+    """
+    if not student_ids:
+        return 0
+    statement = (insert(UserWorkspace)
+                 .values([{"student_id": student_id, "workspace_id": workspace_id, "role": "pending"}
+                          for student_id in student_ids])
+                 .on_conflict_do_nothing(index_elements=[UserWorkspace.workspace_id, UserWorkspace.student_id])
+                 .returning(UserWorkspace.student_id))
+    return len((await db.execute(statement)).all())
+
+
 @router.post("/add_authorized_users")
-def add_authorized_users(add_user: AddAuthorizedUsers, request: Request, db: Session = Depends(get_db)):
+async def add_authorized_users(add_user: AddAuthorizedUsers, request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Add authorized users to a workspace, users still need to join the workspace
+    The whole list is added in one transaction, a failure adds nobody.
     :param add_user: AddAuthorizedUsers
     :param request: Request
     :param db: database session
@@ -89,46 +118,96 @@ def add_authorized_users(add_user: AddAuthorizedUsers, request: Request, db: Ses
     if user_workspace_role != 'teacher' and not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
     try:
-        for student_id in students:
-            if not student_id:
-                continue
-            # Check if the record already exists
-            existing_user_workspace = db.query(UserWorkspace).filter_by(workspace_id=workspace_id,
-                                                                        student_id=student_id).first()
-            if existing_user_workspace:
-                continue  # Skip this row if it already exists
-            user_workspace = UserWorkspace(
-                student_id=student_id,
-                workspace_id=workspace_id,
-                role="pending"
-            )
-            db.add(user_workspace)
-            db.commit()
-        return response(True, message="Users added successfully")
+        # drop empty and repeated ids, keeping the order of the list
+        student_ids = list(dict.fromkeys(str(student_id) for student_id in students if student_id))
+        inserted = 0
+        for start in range(0, len(student_ids), ROSTER_BATCH_SIZE):
+            inserted += await insert_authorized_users(db, workspace_id, student_ids[start:start + ROSTER_BATCH_SIZE])
+        await db.commit()
+        return response(True, data={"inserted": inserted, "skipped": len(students) - inserted},
+                        message="Users added successfully")
     except Exception as e:
         logger.error(f"Error adding users via CSV: {e}")
-        db.rollback()
+        await db.rollback()
+        return response(False, status_code=500, message="Error adding users")
+
+
+@router.post("/add_authorized_users_csv")
+async def add_authorized_users_csv(request: Request,
+                                   file: UploadFile,
+                                   workspace_id: str = Form(...),
+                                   db: AsyncSession = Depends(get_async_db)):
+    """
+    Add authorized users to a workspace from a CSV roster, the student id is the first column.
+    A first row with the header "student_id" is skipped. The file is read and inserted in batches,
+    so a large roster never sits in memory as a whole, and everything is added in one transaction.
+    :param request: Request
+    :param file: the CSV file
+    :param workspace_id: workspace id
+    :param db: database session
+    """
+    user_workspace_role = request.state.user_jwt_content['workspace_role'].get(workspace_id, None)
+    if user_workspace_role != 'teacher' and not request.state.user_jwt_content['system_admin']:
+        return response(False, status_code=403, message="You do not have access to this resource")
+    try:
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        pending_line = ""
+        first_row = True
+        rows = 0
+        inserted = 0
+        batch = {}  # student ids of the batch, a dict keeps the order and drops repeats
+        while True:
+            data = await file.read(ROSTER_READ_SIZE)
+            text = pending_line + decoder.decode(data, final=not data)
+            lines = text.splitlines()
+            # the last line may be cut in the middle, unless the file has ended
+            pending_line = lines.pop() if data and lines and not text.endswith(("\n", "\r")) else ""
+            for row in csv.reader(lines):
+                if not row or not row[0].strip():
+                    continue
+                student_id = row[0].strip()
+                if first_row and student_id.lower() == "student_id":
+                    first_row = False
+                    continue
+                first_row = False
+                rows += 1
+                batch[student_id] = None
+                if len(batch) >= ROSTER_BATCH_SIZE:
+                    inserted += await insert_authorized_users(db, workspace_id, list(batch))
+                    batch = {}
+            if not data:
+                break
+        inserted += await insert_authorized_users(db, workspace_id, list(batch))
+        await db.commit()
+        return response(True, data={"inserted": inserted, "skipped": rows - inserted},
+                        message="Users added successfully")
+    except UnicodeDecodeError:
+        await db.rollback()
+        return response(False, status_code=400, message="The roster must be a UTF-8 CSV file")
+    except Exception as e:
+        logger.error(f"Error adding users via CSV: {e}")
+        await db.rollback()
         return response(False, status_code=500, message="Error adding users")
 
 
 @router.post("/join")
-def student_join_workspace(request: Request, join_workspace: StudentJoinWorkspace, db: Session = Depends(get_db)):
+async def student_join_workspace(request: Request, join_workspace: StudentJoinWorkspace, db: AsyncSession = Depends(get_async_db)):
     user_id = request.state.user_jwt_content['user_id']
     student_id = request.state.user_jwt_content['student_id']
     try:
-        user = db.query(User).filter(User.user_id == user_id, User.student_id == student_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id, User.student_id == student_id))
         if not user:
             return response(False, status_code=404, message="User not found")
 
-        workspace = db.query(Workspace).filter(Workspace.workspace_id == join_workspace.workspace_id).first()
+        workspace = await db.scalar(select(Workspace).where(Workspace.workspace_id == join_workspace.workspace_id))
 
         if not workspace.workspace_password or join_workspace.password != workspace.workspace_password:
             return response(False, status_code=400, message="Failed to join workspace")
 
-        user_workspace = db.query(UserWorkspace).filter(
+        user_workspace = await db.scalar(select(UserWorkspace).where(
             UserWorkspace.student_id == student_id,
             UserWorkspace.workspace_id == join_workspace.workspace_id
-        ).first()
+        ))
 
         if not user_workspace:
             return response(False, status_code=404, message="Not authorized to join this workspace")
@@ -141,41 +220,61 @@ def student_join_workspace(request: Request, join_workspace: StudentJoinWorkspac
         user_workspace.user_name = user.first_name + " " + user.last_name
         user.workspace_role[join_workspace.workspace_id] = "student"
         flag_modified(user, "workspace_role")
-        db.commit()
+        await db.commit()
+        # access tokens refreshed from now on carry the new role
+        await run_in_threadpool(UserAuth.publish_user_change, user_id)
 
         return response(True, message="User added to workspace successfully")
     except Exception as e:
         logger.error(f"Error adding user to workspace: {e}")
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=500, message=str(e))
 
 
 @router.get("/list_users")
-def list_users_in_workspace(request: Request,
-                            workspace_id: str,
-                            page: int,
-                            page_size: int = 30,
-                            search: str = None,
-                            db: Session = Depends(get_db)):
+async def list_users_in_workspace(request: Request,
+                                  workspace_id: str,
+                                  page: int = 1,
+                                  page_size: int = 30,
+                                  search: str = None,
+                                  cursor: str = None,
+                                  include_total: bool = False,
+                                  db: AsyncSession = Depends(get_async_db)):
     """
     List all users in a workspace with pagination
     :param request: Request
     :param workspace_id: workspace id
-    :param page: page number.
+    :param page: page number, ignored when cursor is given
     :param page_size: number of items per page
     :param search: search query
+    :param cursor: next_cursor of the previous page, an empty string for the first page, pages by student id
+    :param include_total: whether to count the total in cursor mode, the count is cached
     :param db: database session
     """
     user_workspace_role = request.state.user_jwt_content['workspace_role'].get(workspace_id, None)
     if user_workspace_role != 'teacher' and not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
+    cursor_values = decode_cursor(cursor, (str,)) if cursor is not None else None
     try:
-        query = db.query(UserWorkspace).filter(UserWorkspace.workspace_id == workspace_id)
+        query = select(UserWorkspace).where(UserWorkspace.workspace_id == workspace_id)
         if search:
-            query = query.filter(
-                (UserWorkspace.student_id.contains(search)) | (UserWorkspace.user_name.contains(search)))
-        total_users = query.count()
-        user_workspaces = query.offset((page - 1) * page_size).limit(page_size).all()
+            query = query.where(
+                (UserWorkspace.student_id.ilike(contains_pattern(search), escape=LIKE_ESCAPE)) |
+                (UserWorkspace.user_name.ilike(contains_pattern(search), escape=LIKE_ESCAPE)))
+        next_cursor = None
+        if cursor is not None:
+            count_key = ("roster", workspace_id, search)
+            total_users = await cached_count(db, query, count_key) if include_total else None
+            after = keyset_after(UserWorkspace.student_id, None, cursor_values, descending=False)
+            if after is not None:
+                query = query.where(after)
+            query = query.order_by(*keyset_order(UserWorkspace.student_id, None, descending=False))
+            user_workspaces = (await db.scalars(query.limit(page_size + 1))).all()
+            user_workspaces, next_cursor = keyset_page(user_workspaces, page_size,
+                                                       lambda user_workspace: encode_cursor(user_workspace.student_id))
+        else:
+            total_users = await db.scalar(select(func.count()).select_from(query.subquery()))
+            user_workspaces = (await db.scalars(query.offset((page - 1) * page_size).limit(page_size))).all()
         user_list = [
             {
                 "user_id": user_workspace.user_id,
@@ -186,75 +285,78 @@ def list_users_in_workspace(request: Request,
             }
             for user_workspace in user_workspaces
         ]
-        return response(True, data={"users": user_list, "total": total_users})
+        return response(True, data={"users": user_list, "total": total_users, "next_cursor": next_cursor})
     except Exception as e:
         logger.error(f"Error fetching user list: {e}")
         return response(False, status_code=500, message=str(e))
 
 
 @router.post("/delete_user")
-def delete_user_from_workspace(request: Request, delete_user: DeleteUser, db: Session = Depends(get_db)):
+async def delete_user_from_workspace(request: Request, delete_user: DeleteUser, db: AsyncSession = Depends(get_async_db)):
     user_workspace_role = request.state.user_jwt_content['workspace_role'].get(delete_user.workspace_id, None)
     if user_workspace_role != 'teacher' and not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
     try:
 
-        user_workspace = db.query(UserWorkspace).filter(
+        user_workspace = await db.scalar(select(UserWorkspace).where(
             UserWorkspace.student_id == delete_user.student_id,
             UserWorkspace.workspace_id == delete_user.workspace_id
-        ).first()
+        ))
 
         if not user_workspace:
             return response(False, status_code=404, message="User not in this workspace")
 
         if user_workspace.role != "pending" and delete_user.user_id:
-            user = db.query(User).filter(User.user_id == user_workspace.user_id).first()
+            user = await db.scalar(select(User).where(User.user_id == user_workspace.user_id))
             del user.workspace_role[delete_user.workspace_id]
             flag_modified(user, "workspace_role")
 
-        db.delete(user_workspace)
-        db.commit()
+        await db.delete(user_workspace)
+        await db.commit()
+        if user_workspace.user_id is not None:
+            await run_in_threadpool(UserAuth.publish_user_change, user_workspace.user_id)
 
         return response(True, message="User deleted from workspace successfully")
     except Exception as e:
         logger.error(f"Error deleting user from workspace: {e}")
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=500, message=str(e))
 
 
 @router.post("/set_user_role")
-def set_user_role(request: Request, user_role_update: UserRoleUpdate, db: Session = Depends(get_db)):
+async def set_user_role(request: Request, user_role_update: UserRoleUpdate, db: AsyncSession = Depends(get_async_db)):
     user_workspace_role = request.state.user_jwt_content['workspace_role'].get(user_role_update.workspace_id, None)
     if user_workspace_role != 'teacher' and not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
     try:
-        user = db.query(User).filter(User.user_id == user_role_update.user_id,
-                                     User.student_id == user_role_update.student_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_role_update.user_id,
+                                                  User.student_id == user_role_update.student_id))
         if not user:
             return response(False, status_code=404, message="User not found")
 
-        user_workspace = db.query(UserWorkspace).filter(
+        user_workspace = await db.scalar(select(UserWorkspace).where(
             UserWorkspace.user_id == user.user_id,
             UserWorkspace.student_id == user_role_update.student_id,
             UserWorkspace.workspace_id == user_role_update.workspace_id
-        ).first()
+        ))
 
         if not user_workspace:
             return response(False, status_code=404, message="User not in this workspace")
 
         user_workspace.role = user_role_update.role
         user.workspace_role[user_role_update.workspace_id] = user_role_update.role
-        db.commit()
+        await db.commit()
+        await run_in_threadpool(UserAuth.publish_user_change, user.user_id)
 
         return response(True, message="User role updated successfully")
     except Exception as e:
         logger.error(f"Error setting user role: {e}")
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=500, message=str(e))
 
 
 @router.post("/set_user_role_with_student_id")
-def set_user_role_with_student_id(request: Request, user_role_update: UserRoleUpdate, db: Session = Depends(get_db)):
+async def set_user_role_with_student_id(request: Request, user_role_update: UserRoleUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     This should be able to set any user to any role in any workspace, even if the user is not in that workspace
     :param request:
@@ -265,15 +367,15 @@ def set_user_role_with_student_id(request: Request, user_role_update: UserRoleUp
     if not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
     try:
-        user = db.query(User).filter(User.student_id == user_role_update.student_id).first()
+        user = await db.scalar(select(User).where(User.student_id == user_role_update.student_id))
         if not user:
             return response(False, status_code=404, message="User not found")
 
-        user_workspace = db.query(UserWorkspace).filter(
+        user_workspace = await db.scalar(select(UserWorkspace).where(
             UserWorkspace.user_id == user.user_id,
             UserWorkspace.student_id == user_role_update.student_id,
             UserWorkspace.workspace_id == user_role_update.workspace_id
-        ).first()
+        ))
 
         if not user_workspace:
             # create a new user workspace record
@@ -284,27 +386,28 @@ def set_user_role_with_student_id(request: Request, user_role_update: UserRoleUp
                 role=user_role_update.role
             )
             db.add(new_user_workspace)
-            db.commit()
+            await db.commit()
         else:
             user_workspace.role = user_role_update.role
 
         user.workspace_role[user_role_update.workspace_id] = user_role_update.role
         flag_modified(user, "workspace_role")
-        db.commit()
+        await db.commit()
+        await run_in_threadpool(UserAuth.publish_user_change, user.user_id)
 
         return response(True, message="User role updated successfully")
     except Exception as e:
         logger.error(f"Error setting user role: {e}")
-        db.rollback()
+        await db.rollback()
         return response(False, status_code=500, message=str(e))
 
 
 @router.get("/list_workspaces")
-def get_workspace_list(request: Request, db: Session = Depends(get_db)):
+async def get_workspace_list(request: Request, db: AsyncSession = Depends(get_async_db)):
     if not request.state.user_jwt_content['system_admin']:
         return response(False, status_code=403, message="You do not have access to this resource")
     try:
-        workspaces = db.query(Workspace).all()
+        workspaces = (await db.scalars(select(Workspace))).all()
         workspace_list = [
             {
                 "workspace_id": workspace.workspace_id,
@@ -6,45 +6,91 @@
 @email: rxy216@case.edu
 @time: 4/11/24 11:48
 """
-import boto3
-import redis
 from boto3.dynamodb.conditions import Key
+from cachetools import TTLCache
+from datetime import datetime
+import json
 import logging
-import os
+import threading
+
+from common.ClientRegistry import client_registry
+from common.DynamoTable import DynamoTable
+from common.CacheInvalidationBus import cache_invalidation_bus
 
 logging.basicConfig(level=logging.INFO)
 
 
 class AgentPromptHandler:
+    """
+    Agent prompts are stored in dynamodb, cached in redis, and cached again in process (L1).
+    Prompts are versioned by the agent's updated_at: an update writes every step under a new version, then points
+    the agent at it and tells every worker to drop its L1 entry.
+    A dynamodb row holds one step of the latest version written, and carries that version. A row read on a cache
+    miss is only cached when its version is the one being served: a row of an older version is a step removed
+    since, and is not served; a row of a newer version (an update in flight, or one this worker has not switched
+    to yet) is served but not cached, so the new content never lands under the old version's keys.
+    """
     DYNAMODB_TABLE_NAME = "prepit_agent_prompt"
+    INVALIDATION_TOPIC = "agent_prompt"
+    DEFAULT_VERSION = "0"  # agents saved before prompts were versioned
+    REDIS_PROMPT_TTL = 7 * 24 * 3600  # seconds, old versions expire on their own
+    L1_MAX_AGENTS = 1024
+    L1_TTL = 300  # seconds, a safety net in case an invalidation message is lost
+
+    # agent_id -> {"version": str, "steps": {step: prompt}, "parsed": {step: dict}}, shared by the whole process
+    l1_cache = TTLCache(maxsize=L1_MAX_AGENTS, ttl=L1_TTL)
+    l1_lock = threading.Lock()
+
+    table = DynamoTable(DYNAMODB_TABLE_NAME)
 
     def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name='us-east-2',
-                                       aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID_DYNAMODB"),
-                                       aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_DYNAMODB"))
-        self.table = self.dynamodb.Table(self.DYNAMODB_TABLE_NAME)
-        self.redis_client = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=6379, protocol=3, decode_responses=True)
+        self.redis_client = client_registry.redis
 
-    def put_agent_prompt(self, agent_id: str, prompt: str, step: str) -> bool:
+    @staticmethod
+    def version_of(updated_at: datetime) -> str:
         """
-        Put the agent prompt into the database.
-        :param prompt: The prompt of the agent.
+        The prompt version of an agent, derived from Agent.updated_at.
+        """
+        return str(int(updated_at.timestamp() * 1000))
+
+    def put_agent_prompts(self, agent_id: str, prompts: dict[str, str], version: str = DEFAULT_VERSION,
+                          stale_steps: list[str] = ()) -> bool:
+        """
+        Put all the prompts of an agent in one round trip per backend (BatchWriteItem and a redis pipeline).
+        The new version is not served until activate_version is called.
         :param agent_id: The ID of the agent.
-        :param step: The step of the agent.
+        :param prompts: {step: prompt}
+        :param version: The prompt version, see version_of.
+        :param stale_steps: steps removed by this update, deleted from the database.
         :return: True if successful, False otherwise.
         """
+        requests = [{'PutRequest': {'Item': {'agent_id': agent_id, 'step': str(step), 'prompt': prompt,
+                                             'version': version}}} for step, prompt in prompts.items()]
+        requests += [{'DeleteRequest': {'Key': {'agent_id': agent_id, 'step': str(step)}}} for step in stale_steps]
         try:
-            self.table.put_item(
-                Item={
-                    'agent_id': agent_id,
-                    'step': step,
-                    'prompt': prompt
-                }
-            )
-            self.__cache_agent_prompt(agent_id, prompt, step)
+            for i in range(0, len(requests), DynamoTable.BATCH_WRITE_LIMIT):
+                batch = requests[i:i + DynamoTable.BATCH_WRITE_LIMIT]
+                while batch:
+                    batch = self.table.batch_write(batch)
+        except Exception as e:
+            logging.error(f"Error putting the agent prompts into the database: {e}")
+            return False
+        self.__cache_agent_prompts(agent_id, prompts, version)
+        return True
+
+    def activate_version(self, agent_id: str, version: str) -> bool:
+        """
+        Serve the given prompt version of the agent from now on, call this after all steps are put.
+        :param agent_id: The ID of the agent.
+        :param version: The prompt version.
+        :return: True if successful, False otherwise.
+        """
+        try:
+            self.redis_client.set(self.__version_key(agent_id), version)
+            cache_invalidation_bus.publish(self.INVALIDATION_TOPIC, agent_id)
             return True
         except Exception as e:
-            logging.error(f"Error putting the agent prompt into the database: {e}")
+            logging.error(f"Error activating the agent prompt version: {e}")
             return False
 
     def get_agent_prompt(self, agent_id: str, step: str) -> str | None:
@@ -54,48 +100,195 @@ class AgentPromptHandler:
         :param step: The step of the agent.
         :return: The prompt of the agent.
         """
-        cached_prompt = self.__get_cached_agent_prompt(agent_id, step)
+        step = str(step)
+        entry = self.__get_l1_entry(agent_id)
+        prompt = entry["steps"].get(step)
+        if prompt is not None:
+            return prompt
+        version = entry["version"]
+        cached_prompt = self.__get_cached_agent_prompt(agent_id, step, version)
         if cached_prompt:
             logging.info(f"Cache hit, getting the agent prompt from the cache. {agent_id}")
+            entry["steps"][step] = cached_prompt
             return cached_prompt
         # if cache miss, get the prompt from the database, and cache it
         logging.info(f"Cache miss, getting the agent prompt from the database. {agent_id}")
         try:
             response = self.table.query(
-                KeyConditionExpression=Key('agent_id').eq(agent_id) & Key('step').eq(str(step))
+                KeyConditionExpression=Key('agent_id').eq(agent_id) & Key('step').eq(step)
             )
-            if response['Items']:
-                prompt = response['Items'][0]['prompt']
-                self.__cache_agent_prompt(agent_id, prompt, step)
-                return prompt
-            else:
+            if not response['Items']:
+                return None
+            item = response['Items'][0]
+            row_state = self.__row_state(agent_id, version, item)
+            if row_state == "removed":
                 return None
+            if row_state == "current":
+                self.__cache_agent_prompt(agent_id, item['prompt'], step, version)
+                entry["steps"][step] = item['prompt']
+            return item['prompt']
         except Exception as e:
             logging.error(f"Error getting the agent prompt from the database: {e}")
             return None
 
-    def __cache_agent_prompt(self, agent_id: str, prompt: str, step: str) -> bool:
+    def get_agent_prompts(self, agent_id: str, steps: list[str]) -> dict[str, str | None]:
+        """
+        Get the prompts of several steps in one round trip per backend (redis MGET, dynamodb BatchGetItem).
+        :param agent_id: The ID of the agent.
+        :param steps: The steps of the agent.
+        :return: {step: prompt}, None for steps that are not found.
+        """
+        steps = [str(step) for step in steps]
+        entry = self.__get_l1_entry(agent_id)
+        version = entry["version"]
+        prompts = {step: entry["steps"].get(step) for step in steps}
+        missing = [step for step in steps if prompts[step] is None]
+        if missing:
+            try:
+                cached_prompts = self.redis_client.mget([self.__prompt_key(agent_id, step, version)
+                                                         for step in missing])
+                for step, prompt in zip(missing, cached_prompts):
+                    if prompt:
+                        prompts[step] = entry["steps"][step] = prompt
+            except Exception as e:
+                logging.error(f"Error getting the agent prompts from redis cache: {e}")
+            missing = [step for step in missing if prompts[step] is None]
+        if missing:
+            logging.info(f"Cache miss, getting {len(missing)} agent prompts from the database. {agent_id}")
+            try:
+                fetched = self.__batch_get_from_database(agent_id, missing)
+            except Exception as e:
+                logging.error(f"Error getting the agent prompts from the database: {e}")
+                fetched = {}
+            current = {}
+            for step, item in fetched.items():
+                row_state = self.__row_state(agent_id, version, item)
+                if row_state == "removed":
+                    continue
+                prompts[step] = item['prompt']
+                if row_state == "current":
+                    current[step] = entry["steps"][step] = item['prompt']
+            self.__cache_agent_prompts(agent_id, current, version)
+        return prompts
+
+    def get_parsed_agent_prompt(self, agent_id: str, step: str) -> dict | None:
+        """
+        Get the agent prompt of a step parsed from json, e.g. {"instruction": "...", "information": "..."}.
+        :param agent_id: The ID of the agent.
+        :param step: The step of the agent.
+        :return: The parsed prompt of the agent, None if not found.
+        """
+        step = str(step)
+        entry = self.__get_l1_entry(agent_id)
+        parsed = entry["parsed"].get(step)
+        if parsed is None:
+            prompt = self.get_agent_prompt(agent_id, step)
+            if not prompt:
+                return None
+            parsed = entry["parsed"][step] = json.loads(prompt)
+        return parsed
+
+    @classmethod
+    def invalidate(cls, agent_id: str):
+        """
+        Drop the L1 entry of an agent, called through the cache invalidation bus.
+        """
+        with cls.l1_lock:
+            cls.l1_cache.pop(agent_id, None)
+
+    def __get_l1_entry(self, agent_id: str) -> dict:
+        with self.l1_lock:
+            entry = self.l1_cache.get(agent_id)
+        if entry is None:
+            entry = {"version": self.__get_version(agent_id), "steps": {}, "parsed": {}}
+            with self.l1_lock:
+                entry = self.l1_cache.setdefault(agent_id, entry)
+        return entry
+
+    def __get_version(self, agent_id: str) -> str:
+        try:
+            return self.redis_client.get(self.__version_key(agent_id)) or self.DEFAULT_VERSION
+        except Exception as e:
+            logging.error(f"Error getting the agent prompt version from redis: {e}")
+            return self.DEFAULT_VERSION
+
+    def __row_state(self, agent_id: str, version: str, item: dict) -> str:
+        """
+        How a database row relates to the version being served.
+        :return: "current" if written by that version (or before rows carried one), "removed" if written by an
+            older version, "newer" if overwritten by a newer one
+        """
+        row_version = item.get('version')
+        if row_version is None or row_version == version:
+            return "current"
+        if int(row_version) < int(version):
+            return "removed"
+        # check the pointer again after the read, if the new version is already active this worker's entry is stale
+        if self.__get_version(agent_id) != version:
+            self.invalidate(agent_id)
+        return "newer"
+
+    @staticmethod
+    def __version_key(agent_id: str) -> str:
+        return f"agent_prompt_version:{agent_id}"
+
+    @staticmethod
+    def __prompt_key(agent_id: str, step: str, version: str) -> str:
+        return f"agent_prompt:{agent_id}:{version}:{step}"
+
+    def __batch_get_from_database(self, agent_id: str, steps: list[str]) -> dict[str, dict]:
+        return {item['step']: item for item in self.table.batch_get([{'agent_id': agent_id, 'step': step}
+                                                                     for step in steps])}
+
+    def __cache_agent_prompts(self, agent_id: str, prompts: dict[str, str], version: str) -> bool:
+        """
+        Cache several prompts of the agent into redis with one pipeline.
+        """
+        if not prompts:
+            return True
+        try:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            for step, prompt in prompts.items():
+                pipeline.set(self.__prompt_key(agent_id, str(step), version), prompt, ex=self.REDIS_PROMPT_TTL)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.error(f"Error caching the agent prompts into redis: {e}")
+            return False
+
+    def __cache_agent_prompt(self, agent_id: str, prompt: str, step: str, version: str) -> bool:
         """
         Cache the agent prompt into redis.
         :param agent_id: The ID of the agent.
         :param prompt: The prompt of the agent.
         :param step: The step of the agent.
+        :param version: The prompt version.
         :return: True if successful, False otherwise.
         """
         try:
-            self.redis_client.set(f"{agent_id}_{step}", prompt)
+            self.redis_client.set(self.__prompt_key(agent_id, step, version), prompt, ex=self.REDIS_PROMPT_TTL)
             return True
         except Exception as e:
             logging.error(f"Error caching the agent prompt into redis: {e}")
             return False
 
-    def __get_cached_agent_prompt(self, agent_id: str, step: str) -> str | None:
+    def __get_cached_agent_prompt(self, agent_id: str, step: str, version: str) -> str | None:
         """
         Get the agent prompt from redis.
         :param agent_id: The ID of the agent.
         """
         try:
-            return self.redis_client.get(f"{agent_id}_{step}")
+            return self.redis_client.get(self.__prompt_key(agent_id, step, version))
         except Exception as e:
             logging.error(f"Error getting the agent prompt from redis cache: {e}")
             return None
+
+
+cache_invalidation_bus.subscribe(AgentPromptHandler.INVALIDATION_TOPIC, AgentPromptHandler.invalidate)
+
+
+def get_agent_prompt_handler() -> AgentPromptHandler:
+    """
+    FastAPI dependency, a handler on the shared clients.
+    """
+    return AgentPromptHandler()
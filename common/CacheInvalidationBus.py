@@ -0,0 +1,93 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: CacheInvalidationBus.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 15:10
+"""
+import json
+import logging
+import os
+import uuid
+from typing import Callable
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class CacheInvalidationBus:
+    """
+    CacheInvalidationBus: tells every worker to drop stale entries from its in-process caches.
+    A cache subscribes a handler to a topic, and whoever changes the underlying data publishes the changed key.
+    Handlers of this worker run right away, other workers get the message over redis pub/sub.
+    """
+    CHANNEL = "prepit_cache_invalidation"
+
+    def __init__(self):
+        self.origin = str(uuid.uuid4())  # messages published by this worker are already handled locally
+        self.handlers: dict[str, list[Callable[[str], None]]] = {}
+        self.redis_client = None
+        self.pubsub = None
+        self.thread = None
+
+    def subscribe(self, topic: str, handler: Callable[[str], None]):
+        """
+        :param topic: the topic, e.g. "agent_prompt"
+        :param handler: called with the invalidated key
+        """
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, key: str):
+        """
+        Invalidate a key on every worker.
+        :param topic: the topic
+        :param key: the invalidated key
+        """
+        self.__dispatch(topic, key)
+        try:
+            self.__get_redis_client().publish(self.CHANNEL, json.dumps({"origin": self.origin, "topic": topic,
+                                                                        "key": key}))
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidation: {e}")
+
+    def start(self):
+        """
+        Start listening in a background thread, called from the app lifespan.
+        """
+        try:
+            self.pubsub = self.__get_redis_client().pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(**{self.CHANNEL: self.__on_message})
+            self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            logger.error(f"Error subscribing to cache invalidation: {e}")
+
+    def stop(self):
+        if self.thread:
+            self.thread.stop()
+            self.thread = None
+        if self.pubsub:
+            self.pubsub.close()
+            self.pubsub = None
+
+    def __get_redis_client(self) -> redis.Redis:
+        if self.redis_client is None:
+            # a dedicated RESP2 connection, pub/sub push messages are not handled by the RESP3 clients
+            self.redis_client = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=6379, decode_responses=True)
+        return self.redis_client
+
+    def __on_message(self, message: dict):
+        try:
+            data = json.loads(message["data"])
+            if data["origin"] != self.origin:
+                self.__dispatch(data["topic"], data["key"])
+        except Exception as e:
+            logger.error(f"Error handling cache invalidation: {e}")
+
+    def __dispatch(self, topic: str, key: str):
+        for handler in self.handlers.get(topic, []):
+            handler(key)
+
+
+cache_invalidation_bus = CacheInvalidationBus()
@@ -0,0 +1,141 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: ClientRegistry.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 14:30
+"""
+import logging
+import os
+import threading
+
+import boto3
+import httpx
+import redis
+import redis.asyncio as aioredis
+import requests
+from anthropic import AsyncAnthropic
+from botocore.config import Config
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# load secrets from /run/secrets/ (only when running in docker)
+load_dotenv(dotenv_path="/run/secrets/prepit-secret")
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """
+    ClientRegistry: the long-lived, connection pooled SDK clients shared by the whole process.
+    Building a boto3 resource or a redis client resolves credentials and endpoints, which costs tens of
+    milliseconds, so every handler takes its clients from here instead of building them per request.
+    Clients are built on first use (or by startup()) and closed by shutdown(), both called from the app lifespan.
+    boto3 resources are not thread safe, so DynamoDB is served by one low-level client (clients are), through
+    DynamoTable.
+    """
+    AWS_REGION = "us-east-2"
+    MAX_POOL_CONNECTIONS = 50
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: dict[str, object] = {}
+
+    def __get(self, name: str, factory):
+        client = self.clients.get(name)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(name)
+                if client is None:
+                    client = self.clients[name] = factory()
+        return client
+
+    @property
+    def dynamodb(self):
+        """
+        The low-level DynamoDB client, shared by every thread. Use it through DynamoTable.
+        """
+        return self.__get("dynamodb", lambda: boto3.client(
+            'dynamodb', region_name=self.AWS_REGION,
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID_DYNAMODB"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_DYNAMODB"),
+            config=Config(max_pool_connections=self.MAX_POOL_CONNECTIONS)))
+
+    @property
+    def s3(self):
+        return self.__get("s3", lambda: boto3.client(
+            's3', config=Config(max_pool_connections=self.MAX_POOL_CONNECTIONS)))
+
+    @property
+    def redis(self) -> redis.Redis:
+        return self.__get("redis", lambda: redis.Redis(
+            host=os.getenv("REDIS_ADDRESS"), port=6379, protocol=3, decode_responses=True))
+
+    @property
+    def redis_async(self) -> aioredis.Redis:
+        """
+        Async redis client for binary values (TTS audio), responses are not decoded.
+        """
+        return self.__get("redis_async", lambda: aioredis.Redis(host=os.getenv("REDIS_ADDRESS"), port=6379,
+                                                                protocol=3))
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """
+        Async HTTP client for outbound APIs (Deepgram TTS), keeps connections alive between requests.
+        """
+        return self.__get("http", lambda: httpx.AsyncClient(timeout=30))
+
+    @property
+    def http_session(self) -> requests.Session:
+        """
+        Blocking HTTP session for outbound APIs called from sync code (Deepgram keys, CWRU SSO).
+        """
+        return self.__get("http_session", requests.Session)
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        return self.__get("openai", lambda: AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+
+    @property
+    def anthropic(self) -> AsyncAnthropic:
+        return self.__get("anthropic", lambda: AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY")))
+
+    def startup(self):
+        """
+        Build every client up front, so the first request does not pay for it.
+        """
+        for name in ("dynamodb", "s3", "redis", "redis_async", "http", "http_session", "openai", "anthropic"):
+            try:
+                getattr(self, name)
+            except Exception as e:
+                logger.error(f"Error creating the {name} client: {e}")
+
+    async def shutdown(self):
+        """
+        Close the clients that hold connections.
+        """
+        with self.lock:
+            clients, self.clients = self.clients, {}
+        for name, client in clients.items():
+            try:
+                if name in ("http", "redis_async"):
+                    await client.aclose()
+                elif name in ("openai", "anthropic"):
+                    await client.close()
+                elif name in ("redis", "http_session", "dynamodb"):
+                    client.close()
+            except Exception as e:
+                logger.error(f"Error closing the {name} client: {e}")
+
+
+client_registry = ClientRegistry()
+
+
+def get_clients() -> ClientRegistry:
+    """
+    FastAPI dependency, the process wide client registry.
+    """
+    return client_registry
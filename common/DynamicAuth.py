@@ -17,3 +17,13 @@ class DynamicAuth:
             if received_code == expected_hash:
                 return True
         return False
+
+
+dynamic_auth = DynamicAuth()
+
+
+def get_dynamic_auth() -> DynamicAuth:
+    """
+    FastAPI dependency, DynamicAuth is stateless so one instance is shared.
+    """
+    return dynamic_auth
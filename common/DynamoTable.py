@@ -0,0 +1,96 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: DynamoTable.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/19/26 10:00
+"""
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from common.ClientRegistry import client_registry
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def serialize_item(item: dict) -> dict:
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def deserialize_item(item: dict) -> dict:
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+class DynamoTable:
+    """
+    DynamoTable: the part of the boto3 Table resource the storage handlers use, on the process wide low-level
+    DynamoDB client of the client registry. Clients are thread safe, resources are not and cost tens of
+    milliseconds to build, so items and key conditions are (de)serialized here instead.
+    Items go in and come out as plain python values, numbers as Decimal, the same as with the resource.
+    """
+    BATCH_WRITE_LIMIT = 25
+    BATCH_GET_LIMIT = 100
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+
+    def put_item(self, Item: dict) -> dict:
+        return client_registry.dynamodb.put_item(TableName=self.table_name, Item=serialize_item(Item))
+
+    def get_item(self, Key: dict) -> dict:
+        response = client_registry.dynamodb.get_item(TableName=self.table_name, Key=serialize_item(Key))
+        if 'Item' in response:
+            response['Item'] = deserialize_item(response['Item'])
+        return response
+
+    def query(self, KeyConditionExpression: ConditionBase, ExclusiveStartKey: dict | None = None, **kwargs) -> dict:
+        """
+        Query with a boto3.dynamodb.conditions key condition, other arguments are passed through.
+        """
+        expression = ConditionExpressionBuilder().build_expression(KeyConditionExpression, is_key_condition=True)
+        if ExclusiveStartKey is not None:
+            kwargs['ExclusiveStartKey'] = serialize_item(ExclusiveStartKey)
+        response = client_registry.dynamodb.query(
+            TableName=self.table_name,
+            KeyConditionExpression=expression.condition_expression,
+            ExpressionAttributeNames=expression.attribute_name_placeholders,
+            ExpressionAttributeValues=serialize_item(expression.attribute_value_placeholders),
+            **kwargs)
+        response['Items'] = [deserialize_item(item) for item in response['Items']]
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = deserialize_item(response['LastEvaluatedKey'])
+        return response
+
+    def batch_get(self, keys: list[dict]) -> list[dict]:
+        """
+        Get the items of the keys with BatchGetItem, following the unprocessed keys. Missing items are left out.
+        """
+        items = []
+        for i in range(0, len(keys), self.BATCH_GET_LIMIT):
+            request_items = {self.table_name: {'Keys': [serialize_item(key)
+                                                        for key in keys[i:i + self.BATCH_GET_LIMIT]]}}
+            while request_items:
+                response = client_registry.dynamodb.batch_get_item(RequestItems=request_items)
+                items.extend(deserialize_item(item) for item in response['Responses'].get(self.table_name, []))
+                request_items = response.get('UnprocessedKeys') or None
+        return items
+
+    def batch_write(self, requests: list[dict]) -> list[dict]:
+        """
+        One BatchWriteItem call, at most BATCH_WRITE_LIMIT requests.
+        :param requests: [{'PutRequest': {'Item': item}}] or [{'DeleteRequest': {'Key': key}}]
+        :return: the requests DynamoDB left unprocessed, in the same form
+        """
+        response = client_registry.dynamodb.batch_write_item(
+            RequestItems={self.table_name: [self.__convert_request(request, serialize_item)
+                                            for request in requests]})
+        return [self.__convert_request(request, deserialize_item)
+                for request in response.get('UnprocessedItems', {}).get(self.table_name, [])]
+
+    @staticmethod
+    def __convert_request(request: dict, convert) -> dict:
+        if 'PutRequest' in request:
+            return {'PutRequest': {'Item': convert(request['PutRequest']['Item'])}}
+        return {'DeleteRequest': {'Key': convert(request['DeleteRequest']['Key'])}}
@@ -6,12 +6,13 @@
 @email: rxy216@case.edu
 @time: 6/30/24 01:16
 """
-import boto3
+import asyncio
 import logging
-import os
 from boto3.dynamodb.conditions import Key
 from pydantic import BaseModel
 
+from common.DynamoTable import DynamoTable
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -26,11 +27,7 @@ class Feedback(BaseModel):
 class FeedbackStorageHandler:
     DYNAMODB_TABLE_NAME = "prepit_ai_feedback"
 
-    def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name='us-east-2',
-                                       aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID_DYNAMODB"),
-                                       aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_DYNAMODB"))
-        self.table = self.dynamodb.Table(self.DYNAMODB_TABLE_NAME)
+    table = DynamoTable(DYNAMODB_TABLE_NAME)
 
     def get_feedback_for_thread(self, thread_id: str) -> list:
         """
@@ -39,11 +36,31 @@ class FeedbackStorageHandler:
         :return: A list of feedbacks.
         """
         try:
-            response = self.table.query(
-                KeyConditionExpression=Key('thread_id').eq(thread_id)
-            )
-            items = response['Items']
+            query_args = {"KeyConditionExpression": Key('thread_id').eq(thread_id)}
+            items = []
+            # follow LastEvaluatedKey, a query returns at most 1 MB
+            while True:
+                response = self.table.query(**query_args)
+                items.extend(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_args["ExclusiveStartKey"] = response['LastEvaluatedKey']
             return [Feedback(**item) for item in items]
         except Exception as e:
             logging.error(f"Error getting the feedback for the thread: {e}")
             return []
+
+    async def get_feedback_for_thread_async(self, thread_id: str) -> list:
+        """
+        get_feedback_for_thread, run in a worker thread.
+        :param thread_id: The ID of the thread.
+        :return: A list of feedbacks.
+        """
+        return await asyncio.to_thread(self.get_feedback_for_thread, thread_id)
+
+
+def get_feedback_handler() -> FeedbackStorageHandler:
+    """
+    FastAPI dependency, a handler on the shared clients.
+    """
+    return FeedbackStorageHandler()
@@ -9,9 +9,9 @@
 import json
 import os
 from typing import Any, Optional
-import boto3
 from botocore.exceptions import ClientError
-from dotenv import load_dotenv
+
+from common.ClientRegistry import client_registry
 
 
 class FileStorageHandler:
@@ -20,8 +20,7 @@ class FileStorageHandler:
     S3_FOLDER = "prepit_data/"
 
     def __init__(self):
-        load_dotenv()
-        self.s3_client = boto3.client('s3')
+        self.s3_client = client_registry.s3
 
     @staticmethod
     def _ensure_directory_exists(path: str) -> None:
@@ -6,11 +6,12 @@
 @email: rxy216@case.edu
 @time: 4/17/24 21:51
 """
-import boto3
 from botocore.exceptions import ClientError
 import uuid
 import mimetypes
 
+from common.ClientRegistry import client_registry
+
 
 def get_extension_from_mime(content_type: str) -> str:
     """
@@ -29,7 +30,7 @@ class FileUploadHandler:
     S3_FOLDER = 'prepit_data/uploads/'  # Folder in S3 to store uploaded files
 
     def __init__(self):
-        self.s3_client = boto3.client('s3')
+        self.s3_client = client_registry.s3
 
     def upload_file(self, file, content_type: str, public: bool = False) -> str:
         """
@@ -59,6 +60,13 @@ class FileUploadHandler:
             print(f"An error occurred: {e}")
             return ""
 
+
+def get_file_upload_handler() -> FileUploadHandler:
+    """
+    FastAPI dependency, a handler on the shared clients.
+    """
+    return FileUploadHandler()
+
 # Usage example:
 # with open('path_to_your_file', 'rb') as f:
 #     handler = FileUploadHandler()
@@ -6,13 +6,18 @@
 @email: rxy216@case.edu
 @time: 4/10/24 23:26
 """
-import boto3
+from typing import AsyncIterator
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from cachetools import TTLCache
 from pydantic import BaseModel
+import asyncio
 import logging
-import os
+import threading
 import time
 
+from common.DynamoTable import DynamoTable
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -40,11 +45,7 @@ class Message(BaseModel):
 class MessageStorageHandler:
     DYNAMODB_TABLE_NAME = "prepit_chat_msg"
 
-    def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name='us-east-2',
-                                       aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID_DYNAMODB"),
-                                       aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_DYNAMODB"))
-        self.table = self.dynamodb.Table(self.DYNAMODB_TABLE_NAME)
+    table = DynamoTable(DYNAMODB_TABLE_NAME)
 
     def put_message(self, thread_id: str, user_id: str, role: str, content: str) -> str | None:
         """
@@ -56,25 +57,44 @@ class MessageStorageHandler:
         :return: The time when the message is created. If failed, return None.
         """
         try:
-            created_at = str(int(time.time() * 1000))  # unix timestamp in milliseconds
-            msg_id = thread_id[:8] + '#' + created_at
-            self.table.put_item(
-                Item={
-                    'thread_id': thread_id,
-                    'created_at': created_at,
-                    'msg_id': msg_id,
-                    'user_id': user_id,
-                    'role': role,
-                    'content': content,
-                    'section_id': '1',
-                    'trial_id': '1'
-                }
-            )
-            return created_at
+            item = self.__message_item(thread_id, user_id, role, content)
+            self.table.put_item(Item=item)
+            return item['created_at']
         except Exception as e:
             print(f"Error putting the message into the database: {e}")
             return None
 
+    def buffer_message(self, thread_id: str, user_id: str, role: str, content: str, step_id: int) -> str:
+        """
+        Queue the message in the write-behind buffer instead of writing it on the request path.
+        It is written within MessageWriteBuffer.FLUSH_INTERVAL seconds, so it may not be readable right away.
+        Call it from the event loop.
+        :param thread_id: The ID of the thread.
+        :param user_id: The ID of the user who the message belongs to.
+        :param role: The role of message sender.
+        :param content: The content of the message.
+        :param step_id: The step of the interview the message belongs to.
+        :return: The time when the message is created.
+        """
+        item = self.__message_item(thread_id, user_id, role, content)
+        item['step_id'] = step_id
+        message_write_buffer.add(item)
+        return item['created_at']
+
+    @staticmethod
+    def __message_item(thread_id: str, user_id: str, role: str, content: str) -> dict:
+        created_at = message_write_buffer.next_created_at(thread_id)
+        return {
+            'thread_id': thread_id,
+            'created_at': created_at,
+            'msg_id': thread_id[:8] + '#' + created_at,
+            'user_id': user_id,
+            'role': role,
+            'content': content,
+            'section_id': '1',
+            'trial_id': '1'
+        }
+
     def get_message(self, thread_id: str, created_at: str) -> Message | None:
         """
         Get the message from the database.
@@ -97,16 +117,215 @@ class MessageStorageHandler:
 
     def get_thread(self, thread_id: str) -> list[Message]:
         """
-        Get all the messages in the thread.
+        Get all the messages in the thread, in created_at order.
         :param thread_id: The ID of the thread.
         :return:
         """
         try:
-            response = self.table.query(
-                KeyConditionExpression=Key('thread_id').eq(thread_id)
-            )
-            items = response['Items']
-            return [Message(**item) for item in items]
+            messages = []
+            start_key = None
+            while True:
+                items, start_key = self.get_thread_page(thread_id, start_key)
+                messages.extend(Message(**item) for item in items)
+                if start_key is None:
+                    return messages
         except Exception as e:
             print(f"Error getting the thread from the database: {e}")
             return []
+
+    def get_thread_page(self, thread_id: str, start_key: dict | None = None,
+                        limit: int | None = None) -> tuple[list[dict], dict | None]:
+        """
+        Get one page of the messages in the thread, in created_at order (the sort key).
+        A query returns at most 1 MB, follow the returned key to get the rest.
+        :param thread_id: The ID of the thread.
+        :param start_key: The key returned with the previous page, None for the first page.
+        :param limit: The maximum number of messages in the page.
+        :return: The raw items of the page, and the key of the next page (None if this is the last page).
+        """
+        query_args = {"KeyConditionExpression": Key('thread_id').eq(thread_id), "ScanIndexForward": True}
+        if start_key is not None:
+            query_args["ExclusiveStartKey"] = start_key
+        if limit is not None:
+            query_args["Limit"] = limit
+        response = self.table.query(**query_args)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    async def iter_thread_pages(self, thread_id: str, limit: int | None = None) -> AsyncIterator[list[Message]]:
+        """
+        Iterate over the messages in the thread page by page, in created_at order.
+        Each query runs in a worker thread, so the event loop is free while a page is fetched.
+        :param thread_id: The ID of the thread.
+        :param limit: The maximum number of messages per page.
+        """
+        start_key = None
+        while True:
+            items, start_key = await asyncio.to_thread(self.get_thread_page, thread_id, start_key, limit)
+            if items:
+                yield [Message(**item) for item in items]
+            if start_key is None:
+                return
+
+
+class MessageWriteBuffer:
+    """
+    MessageWriteBuffer: write-behind buffer of the chat messages, written with BatchWriteItem in batches of up to
+    BATCH_SIZE when a batch is full, every FLUSH_INTERVAL seconds and on shutdown.
+    Items DynamoDB leaves unprocessed and calls failing with a retryable error (throttling, network) are retried
+    with exponential backoff, what is still not written after MAX_ATTEMPTS goes back to the buffer for the next
+    flush, at most MAX_FLUSHES times. A call rejected outright (e.g. a ValidationException from one oversized
+    item) is split in halves until the bad item is alone, so it does not hold back the rest of its batch.
+    Items given up on are logged as dead letters and dropped.
+    It also hands out the created_at sort keys: unix milliseconds, but always past the last one of the same thread,
+    so two messages in the same millisecond do not overwrite each other. This only holds within one process: two
+    workers writing to the same thread in the same millisecond can still collide. A thread's messages come from
+    its chat stream one turn at a time, so they are seconds apart.
+    """
+    BATCH_SIZE = 25  # the BatchWriteItem limit
+    FLUSH_INTERVAL = 1  # seconds
+    MAX_ATTEMPTS = 5
+    MAX_FLUSHES = 3
+    BACKOFF_BASE = 0.05  # seconds, doubled on each attempt
+    RETRYABLE_ERRORS = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded",
+                        "InternalServerError", "ServiceUnavailable"}
+    THREAD_CACHE_SIZE = 10000
+    THREAD_CACHE_TTL = 3600  # seconds, by then the clock is past the last created_at of the thread anyway
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_created_at = TTLCache(maxsize=self.THREAD_CACHE_SIZE, ttl=self.THREAD_CACHE_TTL)
+        self.pending: list[dict] = []
+        self.failed_flushes: dict[tuple, int] = {}  # (thread_id, created_at) -> flushes the item was not written in
+        self.batch_ready = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def next_created_at(self, thread_id: str) -> str:
+        """
+        The created_at of a new message of the thread, unix timestamp in milliseconds, unique within the thread.
+        """
+        with self.lock:
+            created_at = max(int(time.time() * 1000), self.last_created_at.get(thread_id, -1) + 1)
+            self.last_created_at[thread_id] = created_at
+        return str(created_at)
+
+    def add(self, item: dict):
+        """
+        Queue an item, call it from the event loop.
+        """
+        self.pending.append(item)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.batch_ready.set()
+
+    async def flush(self):
+        """
+        Write everything pending, one batch at a time.
+        """
+        unwritten = []
+        while self.pending:
+            batch = self.pending[:self.BATCH_SIZE]
+            del self.pending[:self.BATCH_SIZE]
+            try:
+                batch_unwritten = await self.__write_batch(batch)
+            except BaseException:
+                # cancelled during the write, keep the batch, putting an item twice is harmless
+                self.pending[:0] = batch
+                raise
+            unwritten_keys = {self.__key(item) for item in batch_unwritten}
+            for item in batch:
+                if self.__key(item) not in unwritten_keys:
+                    self.failed_flushes.pop(self.__key(item), None)
+            unwritten.extend(batch_unwritten)
+        retry = []
+        for item in unwritten:
+            key = self.__key(item)
+            self.failed_flushes[key] = self.failed_flushes.get(key, 0) + 1
+            if self.failed_flushes[key] >= self.MAX_FLUSHES:
+                del self.failed_flushes[key]
+                self.__dead_letter(item, "still not written after retrying")
+            else:
+                retry.append(item)
+        if retry:
+            logging.error(f"{len(retry)} messages not written, retrying on the next flush")
+            self.pending.extend(retry)
+
+    async def __write_batch(self, batch: list[dict]) -> list[dict]:
+        """
+        Write a batch, retrying the unprocessed items and the retryable errors with backoff.
+        A non-retryable error splits the batch.
+        :return: the items still not written
+        """
+        requests = [{'PutRequest': {'Item': item}} for item in batch]
+        for attempt in range(self.MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(self.BACKOFF_BASE * 2 ** (attempt - 1))
+            try:
+                unprocessed = await asyncio.to_thread(MessageStorageHandler.table.batch_write, requests)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in self.RETRYABLE_ERRORS:
+                    logging.warning(f"Error writing a batch of messages (attempt {attempt + 1}): {e}")
+                    continue
+                return await self.__split_batch([request['PutRequest']['Item'] for request in requests], e)
+            except Exception as e:
+                logging.warning(f"Error writing a batch of messages (attempt {attempt + 1}): {e}")
+                continue
+            requests = unprocessed
+            if not requests:
+                return []
+        return [request['PutRequest']['Item'] for request in requests]
+
+    async def __split_batch(self, batch: list[dict], error: Exception) -> list[dict]:
+        """
+        Write the halves of a batch DynamoDB rejected, down to the item causing it.
+        :return: the items still not written
+        """
+        if len(batch) == 1:
+            self.__dead_letter(batch[0], error)
+            return []
+        middle = len(batch) // 2
+        return await self.__write_batch(batch[:middle]) + await self.__write_batch(batch[middle:])
+
+    @staticmethod
+    def __key(item: dict) -> tuple:
+        return item['thread_id'], item['created_at']
+
+    @staticmethod
+    def __dead_letter(item: dict, reason):
+        logging.error(f"Dropping message {item.get('msg_id')} of thread {item['thread_id']} "
+                      f"({len(item.get('content', ''))} characters): {reason}")
+
+    async def start(self):
+        self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        """
+        Stop the flush task and write what is left.
+        """
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+        if self.pending:
+            logging.error(f"{len(self.pending)} messages lost on shutdown")
+
+    async def __run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            await self.flush()
+
+
+message_write_buffer = MessageWriteBuffer()
+
+
+def get_message_handler() -> MessageStorageHandler:
+    """
+    FastAPI dependency, a handler on the shared clients.
+    """
+    return MessageStorageHandler()
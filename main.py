@@ -6,38 +6,46 @@
 @email: rxy216@case.edu
 @time: 3/27/24 17:52
 """
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, UploadFile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException, UploadFile, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse, FileResponse
 from dotenv import load_dotenv, dotenv_values
 import os
-import time
 from datetime import datetime
 import uuid
 
-import redis
-from openai import OpenAI
-from anthropic import Anthropic
-from sqlalchemy import create_engine
+from anyio import from_thread
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.sql import text
 
-from common.DynamicAuth import DynamicAuth
+from common.ClientRegistry import ClientRegistry, client_registry, get_clients
+from common.CacheInvalidationBus import cache_invalidation_bus
+from common.DynamicAuth import DynamicAuth, get_dynamic_auth
+from common.AgentPromptHandler import AgentPromptHandler, get_agent_prompt_handler
 from common.FileStorageHandler import FileStorageHandler
-from common.FileUploadHandler import FileUploadHandler
-from common.MessageStorageHandler import MessageStorageHandler
+from common.FileUploadHandler import FileUploadHandler, get_file_upload_handler
+from common.MessageStorageHandler import MessageStorageHandler, message_write_buffer
+from migrations.session import engine, async_engine
+from migrations.pool_metrics import pool_metrics
 from user.ChatStream import ChatStream, ChatStreamModel, ChatSingleCallResponse
-from user.TtsStream import TtsStream
+from user.TtsAudioStore import LocalTtsAudioStore, tts_audio_store
+from user.TtsCache import tts_cache
+from user.TtsJanitor import tts_janitor
+from user.TtsAudioBroker import tts_audio_broker
 from user.SttApiKey import SttApiKey, SttApiKeyResponse
 from admin.AgentManager import router as AgentRouter
+from admin.CasebookSearchIndex import casebook_search_index
 from admin.ThreadManager import router as ThreadRouter
 from admin.GoogleSignIn import get_signin_url, signin_callback
 from admin.CwruSignIn import AuthSSO
-from admin.UserAuth import UserAuth
+from admin.UserAuth import UserAuth, access_token_issue_buffer
 from user.GetAgent import router as GetAgentRouter
 from admin.EmailSignIn import router as EmailSignInRouter
 from admin.WorkspaceManager import router as WorkspaceRouter
 from utils.response import response
 from middleware.authorization import AuthorizationMiddleware, extract_token
+from middleware.db_timing import DbTimingMiddleware
 
 import logging
 
@@ -70,11 +78,32 @@ except FileNotFoundError:
 load_dotenv(dotenv_path="/run/secrets/prepit-secret")
 load_dotenv()
 
-# initialize FastAPI app and OpenAI client
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the shared clients and background workers of this process, and stop them on shutdown.
+    """
+    await run_in_threadpool(client_registry.startup)
+    cache_invalidation_bus.start()
+    await casebook_search_index.start()
+    await access_token_issue_buffer.start()
+    await message_write_buffer.start()
+    await tts_janitor.start(LocalTtsAudioStore.TTS_AUDIO_CACHE_FOLDER)
+    yield
+    await tts_janitor.stop()
+    await casebook_search_index.stop()
+    await message_write_buffer.stop()
+    await access_token_issue_buffer.stop()
+    await tts_audio_store.close()
+    cache_invalidation_bus.stop()
+    await client_registry.shutdown()
+    await async_engine.dispose()
+
+
+# initialize FastAPI app, the async LLM clients shared by all chat streams live in the client registry
 app = FastAPI(docs_url=f"{URL_PATHS['current_dev_admin']}/docs", redoc_url=f"{URL_PATHS['current_dev_admin']}/redoc",
-              openapi_url=f"{URL_PATHS['current_dev_admin']}/openapi.json")
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+              openapi_url=f"{URL_PATHS['current_dev_admin']}/openapi.json", lifespan=lifespan)
 
 # Register the AgentRouter for admin endpoints
 app.include_router(AgentRouter, prefix=f"{URL_PATHS['current_dev_admin']}/agents")
@@ -100,6 +129,8 @@ app.include_router(WorkspaceRouter, prefix=f"{URL_PATHS['current_prod_admin']}/w
 
 # system authorization middleware before CORS middleware, so it executes after CORS
 app.add_middleware(AuthorizationMiddleware)
+# per-request database time, outside of authorization so rejected requests are counted too
+app.add_middleware(DbTimingMiddleware)
 
 origins = [
     "http://127.0.0.1:8001",
@@ -131,59 +162,77 @@ app.add_middleware(
 
 @app.post(f"{URL_PATHS['current_dev_user']}/stream_chat")
 @app.post(f"{URL_PATHS['current_prod_user']}/stream_chat")
-async def stream_chat(chat_stream_model: ChatStreamModel):
+async def stream_chat(chat_stream_model: ChatStreamModel,
+                      clients: ClientRegistry = Depends(get_clients),
+                      auth: DynamicAuth = Depends(get_dynamic_auth),
+                      agent_prompt_handler: AgentPromptHandler = Depends(get_agent_prompt_handler)):
     """
     ENDPOINT: /user/stream_chat
     :param chat_stream_model:
+    :param clients: the shared client registry
+    :param auth:
+    :param agent_prompt_handler:
     """
-    auth = DynamicAuth()
     if not auth.verify_auth_code(chat_stream_model.dynamic_auth_code):
         return ChatSingleCallResponse(status="fail", messages=[], thread_id="")
     chat_instance = ChatStream(chat_stream_model.provider, chat_stream_model.current_step, chat_stream_model.agent_id,
-                               openai_client, anthropic_client)
-    return chat_instance.stream_chat(chat_stream_model)
-
-
-def delete_file_after_delay(file_path: str, delay: float):
-    """
-    Deletes the specified file after a delay.
-    :param file_path: The path to the file to delete.
-    :param delay: The delay before deletion, in seconds.
-    """
-    time.sleep(delay)
-    if os.path.isfile(file_path):
-        os.remove(file_path)
+                               clients.openai, clients.anthropic, agent_prompt_handler)
+    return await chat_instance.stream_chat(chat_stream_model)
 
 
 @app.get(f"{URL_PATHS['current_dev_user']}/get_tts_file")
 @app.get(f"{URL_PATHS['current_prod_user']}/get_tts_file")
-async def get_tts_file(tts_session_id: str, chunk_id: str, background_tasks: BackgroundTasks):
+async def get_tts_file(tts_session_id: str, chunk_id: str):
     """
     ENDPOINT: /user/get_tts_file
     serves the TTS audio file for the specified session id and chunk id.
     :param tts_session_id:
     :param chunk_id:
-    :param background_tasks:
     :return:
     """
-    file_location = f"{TtsStream.TTS_AUDIO_CACHE_FOLDER}/{tts_session_id}_{chunk_id}.mp3"
-    if os.path.isfile(file_location):
-        # Add the delete_file_after_delay function as a background task
-        background_tasks.add_task(delete_file_after_delay, file_location, 60)  # 60 seconds delay
-        return FileResponse(path=file_location, media_type="audio/mpeg")
+    file_path = tts_audio_store.local_file(tts_session_id, chunk_id)
+    if file_path is not None:
+        # the janitor deletes the file once it has had time to be served
+        await tts_audio_store.mark_served(tts_session_id, chunk_id)
+        return FileResponse(path=file_path, media_type="audio/mpeg")
+    content = await tts_audio_store.get(tts_session_id, chunk_id)
+    if content is not None:
+        # the audio is cleaned up once it has had time to be served
+        await tts_audio_store.mark_served(tts_session_id, chunk_id)
+        return Response(content=content, media_type="audio/mpeg")
     else:
         raise HTTPException(status_code=404, detail="File not found")
 
 
+@app.get(f"{URL_PATHS['current_dev_user']}/stream_tts_session")
+@app.get(f"{URL_PATHS['current_prod_user']}/stream_tts_session")
+async def stream_tts_session(tts_session_id: str):
+    """
+    ENDPOINT: /user/stream_tts_session
+    streams all the TTS audio chunks of the specified session in order over one chunked response,
+    each chunk is pushed as soon as it is synthesized. The response ends after the last chunk of the reply.
+    :param tts_session_id:
+    :return:
+    """
+
+    async def audio_generator():
+        async for chunk_id in tts_audio_broker.chunks(tts_session_id, tts_audio_store):
+            content = await tts_audio_store.get(tts_session_id, str(chunk_id))
+            if content:
+                await tts_audio_store.mark_served(tts_session_id, str(chunk_id))
+                yield content
+
+    return StreamingResponse(audio_generator(), media_type="audio/mpeg")
+
+
 @app.get(f"{URL_PATHS['current_dev_user']}/get_temp_stt_auth_code")
 @app.get(f"{URL_PATHS['current_prod_user']}/get_temp_stt_auth_code")
-def get_temp_stt_auth_code(dynamic_auth_code: str):
+def get_temp_stt_auth_code(dynamic_auth_code: str, auth: DynamicAuth = Depends(get_dynamic_auth)):
     """
     ENDPOINT: /user/get_temp_stt_auth_code
     Generates a temporary STT auth code for the user
     :return:
     """
-    auth = DynamicAuth()
     if not auth.verify_auth_code(dynamic_auth_code):
         return SttApiKeyResponse(status="fail", error_message="Invalid auth code", key="")
     stt_key_instance = SttApiKey()
@@ -218,7 +267,7 @@ async def google_signin_callback(state: str, code: str = None, error: str = None
     :param error: The error. error=access_denied when user denies access
     :return:
     """
-    return signin_callback(code, state, error)
+    return await run_in_threadpool(signin_callback, code, state, error)
 
 
 @app.get(f"{URL_PATHS['current_dev_admin']}/cwru_sso_callback")
@@ -232,7 +281,7 @@ async def cwru_sso_callback(ticket: str, came_from: str):
     :return:
     """
     auth = AuthSSO(ticket, came_from)
-    return auth.get_user_info()
+    return await run_in_threadpool(auth.get_user_info)
 
 
 @app.get(f"{URL_PATHS['current_dev_admin']}/generate_access_token")
@@ -256,15 +305,15 @@ def generate_access_token(request: Request):
 
 @app.post(f"{URL_PATHS['current_dev_admin']}/upload_file")
 @app.post(f"{URL_PATHS['current_prod_admin']}/upload_file")
-async def upload_file(file: UploadFile):
+async def upload_file(file: UploadFile, file_upload_handler: FileUploadHandler = Depends(get_file_upload_handler)):
     """
     ENDPOINT: /admin/upload_file
     Uploads a file to the server.
     :param file: The file to upload.
+    :param file_upload_handler:
     :return: The response.
     """
-    file_upload_handler = FileUploadHandler()
-    file_url = file_upload_handler.upload_file(file.file, file.content_type, public=True)
+    file_url = await run_in_threadpool(file_upload_handler.upload_file, file.file, file.content_type, public=True)
     return response(True, data={"file_url": file_url})
 
 
@@ -310,12 +359,11 @@ def read_root(request: Request):
         formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
 
         #  test redis connection
-        r = redis.Redis(host=redis_address, port=6379, protocol=3, decode_responses=True)
+        r = client_registry.redis
         r.set('foo', 'success-' + formatted_time)
         rds = r.get('foo')
 
         # test database connection
-        engine = create_engine(os.getenv("DB_URI"))
         with engine.connect() as conn:
             result = conn.execute(text("SELECT version FROM db_version"))
             db_result = result.fetchone()[0]
@@ -341,7 +389,10 @@ def read_root(request: Request):
         test_role = 'test'
         test_content = 'test content'
         message = MessageStorageHandler()
-        created_at = message.put_message(test_thread_id, test_user_id, test_role, test_content)
+        # written through the write-behind buffer like every message, flushed right away to read it back
+        created_at = from_thread.run_sync(message.buffer_message, test_thread_id, test_user_id, test_role,
+                                          test_content, 0)
+        from_thread.run(message_write_buffer.flush)
         test_msg_get_content = message.get_message(test_thread_id, created_at).content
         test_thread_get_content = message.get_thread(test_thread_id)
 
@@ -358,7 +409,9 @@ def read_root(request: Request):
                 "DYNAMODB": {
                     "Message Content": test_msg_get_content,
                     "Thread Content": test_thread_get_content
-                }
+                },
+                "TTS-CACHE": tts_cache.stats(),
+                "DB-POOL": {name: metrics.stats() for name, metrics in pool_metrics.items()}
             },
             "request-path": str(request.url.path)
         }
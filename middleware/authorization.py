@@ -1,9 +1,9 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+from starlette.datastructures import Headers
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 from utils.whitelist import whitelist
 from utils.endpoint_access_map import endpoint_access_map
-from utils.token_utils import parse_token
+from utils.token_utils import parse_token_cached
 import logging
 
 logger = logging.getLogger(__name__)
@@ -67,17 +67,72 @@ def has_access(endpoint_access_map, user_access, current_path):
     return False
 
 
+ROLE_BITS = {"student": 1, "teacher": 2, "admin": 4}
+
+
+def role_mask(roles: dict) -> int:
+    """
+    Pack a role dictionary, e.g. {"admin": True, "teacher": False}, into a role bitmask
+    """
+    mask = 0
+    for role, has_role in roles.items():
+        if has_role:
+            mask |= ROLE_BITS.get(role, 0)
+    return mask
+
+
+class RouteAccessIndex:
+    """
+    RouteAccessIndex: the endpoint_access_map compiled into role bitmasks.
+    Exact paths are a single dict lookup. Dynamic patterns are grouped by their number of segments, so a path
+    is split once and only compared with the patterns of the same shape.
+    Decisions are the same as has_access: an exact match decides alone, otherwise any matching pattern grants.
+    """
+
+    def __init__(self, access_map: dict):
+        self.exact = {}
+        self.patterns = {}  # number of segments -> [(segments, role mask)], None segments are wildcards
+        for endpoint, access_roles in access_map.items():
+            mask = role_mask(access_roles)
+            self.exact[endpoint] = mask
+            if "{" in endpoint:
+                segments = tuple(None if "{" in part else part for part in endpoint.split("/"))
+                self.patterns.setdefault(len(segments), []).append((segments, mask))
+
+    def allowed_mask(self, current_path: str) -> int:
+        """
+        The bitmask of roles allowed on the current path, 0 if no endpoint matches
+        """
+        mask = self.exact.get(current_path)
+        if mask is not None:
+            return mask
+        mask = 0
+        path_parts = current_path.split("/")
+        for segments, pattern_mask in self.patterns.get(len(path_parts), ()):
+            for segment, path_part in zip(segments, path_parts):
+                if segment is not None and segment != path_part:
+                    break
+            else:
+                mask |= pattern_mask
+        return mask
+
+    def has_access(self, user_mask: int, current_path: str) -> bool:
+        return bool(self.allowed_mask(current_path) & user_mask)
+
+
+# compiled once at import, the access map does not change at runtime
+route_access_index = RouteAccessIndex(endpoint_access_map)
+
+
 def extract_actual_path(path):
     """
     Extract the actual path from the URL path, get rid of version and flags
     """
-    # Split the path by the forward slash (/)
-    path_parts = path.split("/")
-    # Remove the first three elements from the path_parts list
-    actual_path_parts = path_parts[4:]
-    # Join the remaining elements back together with a forward slash (/)
-    actual_path = "/" + "/".join(actual_path_parts)
-    return actual_path
+    # Split off the first four elements ("", api prefix, version, flags), the rest is the actual path
+    path_parts = path.split("/", 4)
+    if len(path_parts) < 5:
+        return "/"
+    return "/" + path_parts[4]
 
 
 def extract_role(access_token_load) -> dict:
@@ -99,23 +154,40 @@ def extract_role(access_token_load) -> dict:
     return default_role
 
 
-class AuthorizationMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        path = extract_actual_path(request.url.path)
-        print('path', path)
+class AuthorizationMiddleware:
+    """
+    Pure ASGI authorization middleware. Unlike BaseHTTPMiddleware it does not wrap the response,
+    so long-lived SSE streams pass straight through without extra task and queue machinery.
+    The verified payload is put in the request state as user_jwt_content.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = extract_actual_path(scope["path"])
         # TODO: temp hard code for /agent/get/xxx
         if path in whitelist or path.startswith('/agent/get/'):
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
-        tokens = extract_token(request.headers.get('Authorization', ''))
+        tokens = extract_token(Headers(scope=scope).get('Authorization', ''))
         if tokens['access_token'] is not None:
-            parse_result = parse_token(tokens['access_token'])
+            parse_result = parse_token_cached(tokens['access_token'])
             if parse_result['success']:
-                user_access = extract_role(parse_result['data'])
-                if has_access(endpoint_access_map, user_access, path):
-                    request.state.user_jwt_content = parse_result['data']
-                    return await call_next(request)
+                user_mask = role_mask(extract_role(parse_result['data']))
+                if route_access_index.has_access(user_mask, path):
+                    scope.setdefault("state", {})["user_jwt_content"] = parse_result['data']
+                    await self.app(scope, receive, send)
+                    return
             else:
-                return JSONResponse(content={"success": False, "message": parse_result['message'],
-                                             "status_code": parse_result['status_code']}, status_code=401)
-        return JSONResponse(content={"success": False, "message": "unauthorized", "status_code": 401}, status_code=401)
+                error_response = JSONResponse(content={"success": False, "message": parse_result['message'],
+                                                       "status_code": parse_result['status_code']}, status_code=401)
+                await error_response(scope, receive, send)
+                return
+        error_response = JSONResponse(content={"success": False, "message": "unauthorized", "status_code": 401},
+                                      status_code=401)
+        await error_response(scope, receive, send)
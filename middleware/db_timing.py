@@ -0,0 +1,50 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from migrations.pool_metrics import RequestDbStats, request_db_stats
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DbTimingMiddleware:
+    """
+    Pure ASGI middleware that collects the database time of each request.
+    The stats are put in the request state as db_stats, and reported in a Server-Timing header
+    (the time spent before the response starts, streamed bodies are not included).
+    It also catches leaked sessions: a connection the request checked out and did not return by the time the
+    request ends is reported by report_leak, which logs an error (the db_leak_check test fixture fails the test).
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestDbStats()
+        scope.setdefault("state", {})["db_stats"] = stats
+        token = request_db_stats.set(stats)
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start" and stats.query_count:
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing",
+                               f"db;dur={stats.query_seconds * 1000:.1f};desc=\"{stats.query_count} queries\", "
+                               f"db-pool;dur={stats.pool_wait_seconds * 1000:.1f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_db_stats.reset(token)
+            if stats.checked_out > 0:
+                self.report_leak(scope['path'], stats.checked_out)
+            if stats.query_count:
+                logger.debug(f"{scope['path']}: {stats.query_count} queries, {stats.query_seconds * 1000:.1f}ms, "
+                             f"pool wait {stats.pool_wait_seconds * 1000:.1f}ms")
+
+    @staticmethod
+    def report_leak(path: str, checked_out: int):
+        logger.error(f"{path}: {checked_out} DB connection(s) still checked out at the end of the request, "
+                     f"a session was not closed")
@@ -8,7 +8,7 @@
 """
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, DateTime, String, Integer, func, MetaData, Boolean, UUID, JSON, UniqueConstraint, \
-    ForeignKey, PrimaryKeyConstraint
+    ForeignKey, PrimaryKeyConstraint, Index
 
 Base = declarative_base(metadata=MetaData(schema="public"))
 metadata = Base.metadata
@@ -33,6 +33,14 @@ class Agent(Base):
     files = Column(JSON, default={}, nullable=False)
     workspace_id = Column(String, nullable=False)
 
+    __table_args__ = (
+        # trigram indexes for the ILIKE '%term%' search, need the pg_trgm extension
+        Index('ix_ai_agents_agent_name_trgm', 'agent_name', postgresql_using='gin',
+              postgresql_ops={'agent_name': 'gin_trgm_ops'}),
+        Index('ix_ai_agents_agent_description_trgm', 'agent_description', postgresql_using='gin',
+              postgresql_ops={'agent_description': 'gin_trgm_ops'}),
+    )
+
     def __repr__(self):
         return f"Agent id: {self.agent_id}, name: {self.agent_name}, description: {self.agent_description}, cover: {self.agent_cover}, creator: {self.creator}, status: {self.status}, model: {self.model}"
 
@@ -97,6 +105,20 @@ class Thread(Base):
     student_id = Column(String(20))
     user_name = Column(String(256), nullable=False)
 
+    __table_args__ = (
+        # thread listings, in the keyset order of get_thread_list
+        Index('ix_ai_threads_workspace_recent', 'workspace_id', last_trial_timestamp.desc().nulls_last(),
+              thread_id.desc()),
+        Index('ix_ai_threads_user_recent', 'user_id', last_trial_timestamp.desc().nulls_last(), thread_id.desc()),
+        # trigram indexes for the ILIKE '%term%' search, need the pg_trgm extension
+        Index('ix_ai_threads_agent_name_trgm', 'agent_name', postgresql_using='gin',
+              postgresql_ops={'agent_name': 'gin_trgm_ops'}),
+        Index('ix_ai_threads_student_id_trgm', 'student_id', postgresql_using='gin',
+              postgresql_ops={'student_id': 'gin_trgm_ops'}),
+        Index('ix_ai_threads_user_name_trgm', 'user_name', postgresql_using='gin',
+              postgresql_ops={'user_name': 'gin_trgm_ops'}),
+    )
+
     def __repr__(self):
         return f"Thread id: {self.thread_id}, user_id: {self.user_id}, agent_id: {self.agent_id}, trial_id: {self.last_trial_id}, finished: {self.finished}"
 
@@ -127,6 +149,11 @@ class UserWorkspace(Base):
 
     __table_args__ = (
         PrimaryKeyConstraint('workspace_id', 'student_id', name='ai_user_workspace_pk'),
+        # trigram indexes for the ILIKE '%term%' roster search, need the pg_trgm extension
+        Index('ix_ai_user_workspace_student_id_trgm', 'student_id', postgresql_using='gin',
+              postgresql_ops={'student_id': 'gin_trgm_ops'}),
+        Index('ix_ai_user_workspace_user_name_trgm', 'user_name', postgresql_using='gin',
+              postgresql_ops={'user_name': 'gin_trgm_ops'}),
     )
 
     def __repr__(self):
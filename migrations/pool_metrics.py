@@ -0,0 +1,198 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: pool_metrics.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 14:10
+"""
+import os
+import time
+import logging
+import threading
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# a checkout that waits longer than this for a free connection logs a warning
+DB_POOL_WAIT_WARN_MS = float(os.getenv("DB_POOL_WAIT_WARN_MS", 100))
+
+
+class RequestDbStats:
+    """
+    RequestDbStats: the database time of one request, filled in by the engine and pool events.
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.checked_out = 0  # connections checked out by this request and not returned yet
+
+
+# the stats of the request being served, set by DbTimingMiddleware, None outside of a request
+request_db_stats: ContextVar[RequestDbStats | None] = ContextVar("request_db_stats", default=None)
+
+
+class PoolMetrics:
+    """
+    PoolMetrics: counters of one connection pool, fed by the pool events and the timed pool classes.
+    Counters only grow, except checked_out, so rates can be taken by diffing two stats() snapshots.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None  # set by instrument_engine, the pool is looked up live since dispose() replaces it
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.slow_waits = 0
+        self.hold_seconds_total = 0.0
+        self.lifetime_seconds_total = 0.0
+
+    def record_wait(self, seconds: float):
+        with self.lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if seconds * 1000 >= DB_POOL_WAIT_WARN_MS:
+                self.slow_waits += 1
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats.pool_wait_seconds += seconds
+        if seconds * 1000 >= DB_POOL_WAIT_WARN_MS:
+            logger.warning(f"DB pool {self.name}: waited {seconds * 1000:.0f}ms for a connection, {self.status()}")
+
+    @property
+    def pool(self):
+        return self.engine.pool if self.engine is not None else None
+
+    def status(self) -> str:
+        return self.pool.status() if self.pool is not None else "pool not created"
+
+    def stats(self) -> dict:
+        """
+        A snapshot of the counters and the live pool state.
+        """
+        with self.lock:
+            snapshot = {
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.checkouts, 2) if self.checkouts else 0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 2),
+                "slow_waits": self.slow_waits,
+                "hold_ms_avg": round(self.hold_seconds_total * 1000 / self.checkouts, 2) if self.checkouts else 0,
+                "lifetime_s_avg": round(self.lifetime_seconds_total / self.closes, 2) if self.closes else 0,
+            }
+        if isinstance(self.pool, QueuePool):
+            snapshot["size"] = self.pool.size()
+            snapshot["idle"] = self.pool.checkedin()
+            snapshot["overflow"] = self.pool.overflow()
+        return snapshot
+
+    def on_connect(self, dbapi_connection, connection_record):
+        connection_record.info["connected_at"] = time.monotonic()
+        with self.lock:
+            self.connects += 1
+
+    def on_close(self, dbapi_connection, connection_record):
+        connected_at = connection_record.info.get("connected_at")
+        with self.lock:
+            self.closes += 1
+            if connected_at is not None:
+                self.lifetime_seconds_total += time.monotonic() - connected_at
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.monotonic()
+        stats = request_db_stats.get()
+        if stats is not None:
+            # checkin may run in another context (e.g. garbage collection), so keep the owner on the connection
+            stats.checked_out += 1
+            connection_record.info["request_stats"] = stats
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        stats = connection_record.info.pop("request_stats", None)
+        if stats is not None:
+            stats.checked_out -= 1
+        with self.lock:
+            # checkin also fires for connections that are invalidated before they were ever checked out
+            if checked_out_at is not None:
+                self.checked_out -= 1
+                self.hold_seconds_total += time.monotonic() - checked_out_at
+
+
+pool_metrics = {"sync": PoolMetrics("sync"), "async": PoolMetrics("async")}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that times how long each checkout waits for a connection, the pool events have no hook for that.
+    """
+    metrics_name = "sync"
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics[self.metrics_name].record_wait(time.perf_counter() - start_time)
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that times how long each checkout waits for a connection.
+    """
+    metrics_name = "async"
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics[self.metrics_name].record_wait(time.perf_counter() - start_time)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.query_seconds += time.perf_counter() - conn.info.pop("query_start", time.perf_counter())
+
+
+def instrument_engine(engine, metrics: PoolMetrics):
+    """
+    Attach the pool and query events of a sync engine (use .sync_engine for an async engine) to the metrics.
+    """
+    metrics.engine = engine
+    event.listen(engine, "connect", metrics.on_connect)
+    event.listen(engine, "close", metrics.on_close)
+    event.listen(engine, "invalidate", metrics.on_invalidate)
+    event.listen(engine, "checkout", metrics.on_checkout)
+    event.listen(engine, "checkin", metrics.on_checkin)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
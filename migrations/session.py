@@ -1,7 +1,13 @@
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv, dotenv_values
 
+from migrations.pool_metrics import TimedQueuePool, TimedAsyncAdaptedQueuePool, instrument_engine, pool_metrics
+
 import os
 
 # try loading from .env file (only when running locally)
@@ -15,12 +21,49 @@ load_dotenv()
 
 DATABASE_URL = config.get("DB_URI") or os.getenv("DB_URI")
 
+# connection pool settings, shared by the sync and the async engine (each engine has its own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds before a connection is replaced
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": True,
+}
+
+
+def async_database_url(database_url: str):
+    """
+    The async driver url of the database, postgres urls are moved to psycopg 3, which serves both sync and async
+    """
+    url = make_url(database_url)
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+psycopg")
+    return url
+
+
 engine = create_engine(
-    DATABASE_URL
+    DATABASE_URL,
+    poolclass=TimedQueuePool,
+    **POOL_OPTIONS
 )
+instrument_engine(engine, pool_metrics["sync"])
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    poolclass=TimedAsyncAdaptedQueuePool,
+    **POOL_OPTIONS
+)
+instrument_engine(async_engine.sync_engine, pool_metrics["async"])
+
+# expire_on_commit=False: objects stay readable after commit, lazy refreshes are not possible in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 
@@ -30,3 +73,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+@contextmanager
+def session_scope():
+    """
+    A session for code outside of a request dependency, the connection goes back to the pool when the block exits.
+    Do not use next(get_db()), its finally block never runs and the connection leaks until garbage collection.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,57 @@
+"""Add trigram search indexes and thread listing indexes
+
+Revision ID: 7d2f1a9c4e3b
+Revises: c435a6f85f90
+Create Date: 2026-10-18 15:55:12.418302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f1a9c4e3b'
+down_revision: Union[str, None] = 'c435a6f85f90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, column) of the trigram indexes backing the ILIKE '%term%' searches
+TRIGRAM_INDEXES = [
+    ('ix_ai_agents_agent_name_trgm', 'ai_agents', 'agent_name'),
+    ('ix_ai_agents_agent_description_trgm', 'ai_agents', 'agent_description'),
+    ('ix_ai_threads_agent_name_trgm', 'ai_threads', 'agent_name'),
+    ('ix_ai_threads_student_id_trgm', 'ai_threads', 'student_id'),
+    ('ix_ai_threads_user_name_trgm', 'ai_threads', 'user_name'),
+    ('ix_ai_user_workspace_student_id_trgm', 'ai_user_workspace', 'student_id'),
+    ('ix_ai_user_workspace_user_name_trgm', 'ai_user_workspace', 'user_name'),
+]
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # build the indexes concurrently so the tables stay writable, this cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for index_name, table_name, column_name in TRIGRAM_INDEXES:
+            op.create_index(index_name, table_name, [column_name], schema='public', postgresql_using='gin',
+                            postgresql_ops={column_name: 'gin_trgm_ops'}, postgresql_concurrently=True,
+                            if_not_exists=True)
+        # thread listings, in the keyset order of get_thread_list
+        op.create_index('ix_ai_threads_workspace_recent', 'ai_threads',
+                        ['workspace_id', sa.text('last_trial_timestamp DESC NULLS LAST'), sa.text('thread_id DESC')],
+                        schema='public', postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_ai_threads_user_recent', 'ai_threads',
+                        ['user_id', sa.text('last_trial_timestamp DESC NULLS LAST'), sa.text('thread_id DESC')],
+                        schema='public', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_ai_threads_user_recent', table_name='ai_threads', schema='public',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_ai_threads_workspace_recent', table_name='ai_threads', schema='public',
+                      postgresql_concurrently=True, if_exists=True)
+        for index_name, table_name, column_name in reversed(TRIGRAM_INDEXES):
+            op.drop_index(index_name, table_name=table_name, schema='public', postgresql_concurrently=True,
+                          if_exists=True)
@@ -0,0 +1,11 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: __init__.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 19:55
+
+Benchmarks, run them from the repository root with python -m tests.benchmarks.<name>.
+They are not collected by pytest.
+"""
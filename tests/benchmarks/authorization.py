@@ -0,0 +1,129 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: authorization.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 22:55
+
+Per-request auth overhead and SSE throughput through the authorization middleware: the pure ASGI
+AuthorizationMiddleware (cached token verification) against the BaseHTTPMiddleware it replaced
+(a full RS256 jwt.decode on every request), and against no middleware at all.
+The requests are ASGI calls made in-process, so only the middleware and app cost is measured.
+python -m tests.benchmarks.authorization
+"""
+import asyncio
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from sse_starlette.sse import EventSourceResponse
+
+from middleware.authorization import (AuthorizationMiddleware, extract_actual_path, extract_token, extract_role,
+                                      has_access)
+from utils.endpoint_access_map import endpoint_access_map
+from utils.token_utils import jwt_generator, parse_token
+from utils.whitelist import whitelist
+
+PATH = "/api/v1/user/stream_chat"
+REQUESTS = 2000
+SSE_STREAMS = 20
+SSE_EVENTS = 1000
+
+
+class LegacyAuthorizationMiddleware(BaseHTTPMiddleware):
+    """
+    The AuthorizationMiddleware before it became pure ASGI.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        path = extract_actual_path(request.url.path)
+        if path in whitelist or path.startswith('/agent/get/'):
+            return await call_next(request)
+        tokens = extract_token(request.headers.get('Authorization', ''))
+        if tokens['access_token'] is not None:
+            parse_result = parse_token(tokens['access_token'])
+            if parse_result['success']:
+                if has_access(endpoint_access_map, extract_role(parse_result['data']), path):
+                    request.state.user_jwt_content = parse_result['data']
+                    return await call_next(request)
+        return JSONResponse(content={"success": False, "message": "unauthorized", "status_code": 401},
+                            status_code=401)
+
+
+async def json_app(scope, receive, send):
+    await JSONResponse({"success": True})(scope, receive, send)
+
+
+async def sse_app(scope, receive, send):
+    async def events():
+        for i in range(SSE_EVENTS):
+            yield '{"delta": " word", "seq": %d}' % i
+
+    await EventSourceResponse(events())(scope, receive, send)
+
+
+async def call(app, authorization: bytes) -> tuple[int, int]:
+    """
+    One ASGI request to PATH.
+    :return: the response status and the number of body messages sent
+    """
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": PATH, "raw_path": PATH.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"authorization", authorization)], "client": ("127.0.0.1", 50000),
+             "server": ("testserver", 80)}
+    request_sent = False
+    disconnected = asyncio.Event()
+    status = 0
+    body_messages = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, body_messages
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body_messages += 1
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return status, body_messages
+
+
+def stacks(app) -> dict:
+    return {"none": app, "legacy": LegacyAuthorizationMiddleware(app), "asgi": AuthorizationMiddleware(app)}
+
+
+async def main():
+    token = jwt_generator("benchmark-user", "Bench", "Mark", "bench@example.com", False, {}, "", "")
+    authorization = f"Bearer access={token}&refresh=".encode()
+    print(f"per request, {REQUESTS} sequential requests")
+    print(f"{'middleware':>10} {'us/request':>11} {'overhead us':>12}")
+    baseline = None
+    for name, app in stacks(json_app).items():
+        assert (await call(app, authorization))[0] == 200
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            await call(app, authorization)
+        per_request = (time.perf_counter() - start) / REQUESTS * 1e6
+        baseline = per_request if baseline is None else baseline
+        print(f"{name:>10} {per_request:>11.1f} {per_request - baseline:>12.1f}")
+    print(f"SSE, {SSE_STREAMS} concurrent streams of {SSE_EVENTS} events")
+    print(f"{'middleware':>10} {'events/s':>11}")
+    for name, app in stacks(sse_app).items():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(call(app, authorization) for _ in range(SSE_STREAMS)))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10} {sum(body_messages for _, body_messages in results) / elapsed:>11.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
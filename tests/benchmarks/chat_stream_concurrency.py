@@ -0,0 +1,104 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: chat_stream_concurrency.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 22:20
+
+How stream_chat scales with concurrent streams against a local fake provider: the async ChatStream generator
+against the sync generator it replaced, which Starlette iterates on its threadpool (40 threads by default).
+The fake provider sends TOKENS tokens, one every TOKEN_DELAY seconds, so one stream takes about 1s on its own.
+python -m tests.benchmarks.chat_stream_concurrency
+"""
+import asyncio
+import json
+import statistics
+import time
+
+from starlette.concurrency import iterate_in_threadpool
+
+from user.ChatStream import ChatStream
+
+TOKENS = 50
+TOKEN_DELAY = 0.02
+CONCURRENCY = (10, 40, 160, 640)
+REPLY_TOKENS = [f"word{i}{'.' if i % 12 == 11 else ''} " for i in range(TOKENS)]
+MESSAGES = [{"role": "system", "content": "You are an interviewer."}, {"role": "user", "content": "Hello."}]
+
+
+class FakeTextStream:
+    """
+    What AsyncAnthropic.messages.stream() returns: an async context manager with a text_stream.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for token in REPLY_TOKENS:
+            await asyncio.sleep(TOKEN_DELAY)
+            yield token
+
+
+class FakeAnthropic:
+    class messages:
+        @staticmethod
+        def stream(**kwargs):
+            return FakeTextStream()
+
+
+async def fake_tts(text: str, chunk_id: str) -> bool:
+    await asyncio.sleep(TOKEN_DELAY)
+    return True
+
+
+def legacy_chat_generator():
+    """
+    The sync generator stream_chat used before the async clients: the sync provider client blocks for each token.
+    """
+    response_text = ""
+    for token in REPLY_TOKENS:
+        time.sleep(TOKEN_DELAY)
+        response_text += token
+        yield json.dumps({"response": response_text, "tts_session_id": "legacy", "tts_max_chunk_id": -1})
+
+
+async def consume_legacy() -> float:
+    start = time.perf_counter()
+    async for _ in iterate_in_threadpool(legacy_chat_generator()):
+        pass
+    return time.perf_counter() - start
+
+
+async def consume_async() -> float:
+    chat = ChatStream("anthropic", 0, "benchmark", None, FakeAnthropic(), agent_prompt_handler=object())
+    chat.tts.stream_tts = fake_tts
+    start = time.perf_counter()
+    async for _ in chat._ChatStream__chat_generator(list(MESSAGES)):
+        pass
+    return time.perf_counter() - start
+
+
+async def run(consume, concurrency: int) -> tuple[float, float, float]:
+    start = time.perf_counter()
+    durations = await asyncio.gather(*(consume() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return wall, statistics.median(durations), max(durations)
+
+
+async def main():
+    print(f"one stream: {TOKENS} tokens, {TOKEN_DELAY * 1000:.0f}ms apart")
+    print(f"{'streams':>8} {'mode':>6} {'wall s':>7} {'p50 stream s':>13} {'max stream s':>13} {'streams/s':>10}")
+    for concurrency in CONCURRENCY:
+        for mode, consume in (("sync", consume_legacy), ("async", consume_async)):
+            wall, p50, slowest = await run(consume, concurrency)
+            print(f"{concurrency:>8} {mode:>6} {wall:>7.2f} {p50:>13.2f} {slowest:>13.2f} {concurrency / wall:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: route_access.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 20:10
+
+Per-request cost of the route permission check: RouteAccessIndex against the reference has_access.
+python -m tests.benchmarks.route_access
+"""
+import timeit
+
+from middleware.authorization import has_access, role_mask, route_access_index, extract_actual_path
+from utils.endpoint_access_map import endpoint_access_map
+
+ROLES = {"admin": False, "teacher": False, "student": True}
+PATHS = {
+    "exact": "/stream_chat",
+    "dynamic": "/threads/get_thread/4f8a1c2e-9b7d-4e3a-8c1f-2d6b5a9e0f13",
+    "no match": "/workspace/unknown/endpoint",
+}
+NUMBER = 200000
+
+
+def main():
+    user_mask = role_mask(ROLES)
+    print(f"{'path':>10} {'has_access ns':>14} {'index ns':>9}")
+    for name, path in PATHS.items():
+        reference = timeit.timeit(lambda: has_access(endpoint_access_map, ROLES, path), number=NUMBER)
+        indexed = timeit.timeit(lambda: route_access_index.has_access(user_mask, path), number=NUMBER)
+        print(f"{name:>10} {reference / NUMBER * 1e9:>14.0f} {indexed / NUMBER * 1e9:>9.0f}")
+    url = "/v1/prod/user/threads/get_thread/4f8a1c2e-9b7d-4e3a-8c1f-2d6b5a9e0f13"
+    elapsed = timeit.timeit(lambda: extract_actual_path(url), number=NUMBER)
+    print(f"extract_actual_path: {elapsed / NUMBER * 1e9:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: sentence_segmenter.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 19:55
+
+Speed and quality of the TTS chunker: SentenceSegmenter against the per-token split() loop it replaced.
+python -m tests.benchmarks.sentence_segmenter
+"""
+import time
+
+from user.SentenceSegmenter import SentenceSegmenter
+from tests.test_sentence_segmenter import CORPUS, tokenize
+
+ROUNDS = 20
+
+
+def legacy_chunks(tokens: list[str]) -> list[str]:
+    """
+    The chunking loop ChatStream used before SentenceSegmenter.
+    """
+    chunks = []
+    chunk_id = -1
+    chunk_buffer = ""
+    for new_text in tokens:
+        if len(chunk_buffer.split()) > (16 + (chunk_id * 13)):
+            for ender in ".?!":
+                if ender in new_text and (ender != "." or not chunk_buffer[-1].isnumeric()):
+                    chunk_id += 1
+                    parts = new_text.split(ender)
+                    chunks.append(chunk_buffer + parts[0] + ender)
+                    chunk_buffer = ender.join(parts[1:])
+                    break
+            else:
+                chunk_buffer += new_text
+        else:
+            chunk_buffer += new_text
+    if chunk_buffer:
+        chunks.append(chunk_buffer)
+    return chunks
+
+
+def segmenter_chunks(tokens: list[str]) -> list[str]:
+    segmenter = SentenceSegmenter()
+    chunks = [text for token in tokens for _, text in segmenter.feed(token)]
+    last_chunk = segmenter.flush()
+    if last_chunk:
+        chunks.append(last_chunk[1])
+    return chunks
+
+
+def time_per_token(chunker, tokens: list[str]) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        chunker(tokens)
+    return (time.perf_counter() - start) / ROUNDS / len(tokens) * 1e6
+
+
+def bad_cuts(chunks: list[str], sentence_ends: set[str]) -> int:
+    """
+    Cuts (every chunk but the last) that do not end a corpus sentence.
+    """
+    return sum(1 for chunk in chunks[:-1] if not any(chunk.rstrip().endswith(end) for end in sentence_ends))
+
+
+def main():
+    reply = " ".join(case["reply"] for case in CORPUS)
+    sentence_ends = {sentence[-12:] for case in CORPUS for sentence in case["sentences"]}
+    print(f"{'reply tokens':>12} {'legacy us/token':>16} {'segmenter us/token':>19}")
+    for repeat in (1, 4, 16):
+        tokens = tokenize(" ".join([reply] * repeat), seed=repeat)
+        print(f"{len(tokens):>12} {time_per_token(legacy_chunks, tokens):>16.2f} "
+              f"{time_per_token(segmenter_chunks, tokens):>19.2f}")
+    legacy_bad = segmenter_bad = total_legacy = total_segmenter = 0
+    for seed in range(20):
+        tokens = tokenize(reply, seed)
+        legacy, segmented = legacy_chunks(tokens), segmenter_chunks(tokens)
+        legacy_bad += bad_cuts(legacy, sentence_ends)
+        segmenter_bad += bad_cuts(segmented, sentence_ends)
+        total_legacy += len(legacy) - 1
+        total_segmenter += len(segmented) - 1
+    print(f"cuts not at a sentence end, over 20 tokenizations of the corpus: "
+          f"legacy {legacy_bad}/{total_legacy}, segmenter {segmenter_bad}/{total_segmenter}")
+
+
+if __name__ == "__main__":
+    main()
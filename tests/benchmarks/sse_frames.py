@@ -0,0 +1,60 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: sse_frames.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 22:40
+
+Bytes on the wire and CPU per turn of the stream_chat frames: "full" frames (the whole response every token)
+against "delta" frames (only the new text, plus a final frame with the whole response).
+python -m tests.benchmarks.sse_frames
+"""
+import time
+
+from user.ChatStream import ChatStream
+
+REPLY_TOKENS = (256, 1024, 2048)
+ROUNDS = 5
+
+
+def reply_tokens(count: int) -> list[str]:
+    words = "Tell me about a time you had to make a decision with incomplete market data and what you did".split()
+    return [f" {words[i % len(words)]}{'.' if i % 17 == 16 else ''}" for i in range(count)]
+
+
+def frames_per_turn(frame_mode: str, tokens: list[str]) -> tuple[int, float]:
+    """
+    Build every frame of one turn.
+    :return: the bytes sent and the CPU seconds spent
+    """
+    chat = ChatStream("openai", 0, "benchmark", None, None, agent_prompt_handler=object())
+    chat.frame_mode = frame_mode
+    build_frame = chat._ChatStream__build_frame
+    sent_bytes = 0
+    start = time.process_time()
+    response_text = ""
+    for token in tokens:
+        response_text += token
+        sent_bytes += len(build_frame(response_text, token).encode())
+    if frame_mode == "delta":
+        sent_bytes += len(build_frame(response_text, "", final=True).encode())
+    return sent_bytes, time.process_time() - start
+
+
+def main():
+    print(f"{'tokens':>7} {'full KB':>9} {'delta KB':>9} {'full ms CPU':>12} {'delta ms CPU':>13}")
+    for count in REPLY_TOKENS:
+        tokens = reply_tokens(count)
+        results = {}
+        for frame_mode in ("full", "delta"):
+            sent_bytes, cpu_seconds = frames_per_turn(frame_mode, tokens)
+            for _ in range(ROUNDS - 1):
+                cpu_seconds = min(cpu_seconds, frames_per_turn(frame_mode, tokens)[1])
+            results[frame_mode] = (sent_bytes, cpu_seconds)
+        print(f"{count:>7} {results['full'][0] / 1024:>9.1f} {results['delta'][0] / 1024:>9.1f} "
+              f"{results['full'][1] * 1000:>12.2f} {results['delta'][1] * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: stream_chat_setup.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/19/26 10:40
+
+Setup cost of a stream_chat request: building ChatStream with its AgentPromptHandler and the storage handlers,
+then the first prompt query. Per-call clients (every handler built its own boto3 resource and redis client, as
+before the client registry) against the registry clients. The DynamoDB responses come from a botocore Stubber,
+so no network is used.
+python -m tests.benchmarks.stream_chat_setup
+"""
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+import boto3
+import redis
+from boto3.dynamodb.conditions import Key
+from botocore.stub import Stubber
+
+from common.AgentPromptHandler import AgentPromptHandler
+from common.ClientRegistry import ClientRegistry, client_registry
+from common.FeedbackStorageHandler import FeedbackStorageHandler
+from common.MessageStorageHandler import MessageStorageHandler
+from user.ChatStream import ChatStream
+
+ROUNDS = 50
+AGENT_ID = "agent-1"
+
+
+def prompt_response() -> dict:
+    # a new one each time, the resource deserializes the response in place
+    return {"Items": [{"agent_id": {"S": AGENT_ID}, "step": {"S": "0"}, "prompt": {"S": "{}"}}]}
+
+
+def per_call_resource():
+    """
+    What each handler built in its __init__ before the client registry.
+    """
+    return boto3.resource('dynamodb', region_name=ClientRegistry.AWS_REGION,
+                          aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID_DYNAMODB", "test"),
+                          aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_DYNAMODB", "test"))
+
+
+def per_call_setup():
+    prompt_handler = SimpleNamespace(
+        dynamodb=per_call_resource(),
+        redis_client=redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=6379, protocol=3, decode_responses=True))
+    SimpleNamespace(dynamodb=per_call_resource())  # MessageStorageHandler
+    SimpleNamespace(dynamodb=per_call_resource())  # FeedbackStorageHandler
+    ChatStream("openai", 0, AGENT_ID, None, None, agent_prompt_handler=prompt_handler)
+    table = prompt_handler.dynamodb.Table(AgentPromptHandler.DYNAMODB_TABLE_NAME)
+    with Stubber(table.meta.client) as stubber:
+        stubber.add_response("query", prompt_response())
+        table.query(KeyConditionExpression=Key('agent_id').eq(AGENT_ID) & Key('step').eq("0"))
+
+
+def registry_setup(stubber: Stubber):
+    prompt_handler = AgentPromptHandler()
+    MessageStorageHandler()
+    FeedbackStorageHandler()
+    ChatStream("openai", 0, AGENT_ID, client_registry.openai, client_registry.anthropic,
+               agent_prompt_handler=prompt_handler)
+    stubber.add_response("query", prompt_response())
+    prompt_handler.table.query(KeyConditionExpression=Key('agent_id').eq(AGENT_ID) & Key('step').eq("0"))
+
+
+def timed(setup, *args) -> list[float]:
+    durations = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        setup(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(name: str, durations: list[float]):
+    durations = sorted(durations)
+    print(f"{name:>10} {durations[0] * 1000:>9.2f} {statistics.median(durations) * 1000:>8.2f} "
+          f"{durations[int(len(durations) * 0.95)] * 1000:>8.2f}")
+
+
+def main():
+    print(f"{ROUNDS} setups each")
+    print(f"{'clients':>10} {'min ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    start = time.perf_counter()
+    per_call_setup()
+    first_per_call = time.perf_counter() - start
+    report("per-call", [first_per_call] + timed(per_call_setup))
+    start = time.perf_counter()
+    client_registry.startup()
+    with Stubber(client_registry.dynamodb) as stubber:
+        registry_setup(stubber)
+        first_registry = time.perf_counter() - start
+        report("registry", [first_registry] + timed(registry_setup, stubber))
+    print(f"first setup, including building the clients: per-call {first_per_call * 1000:.1f}ms, "
+          f"registry startup and setup {first_registry * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: thread_read.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 23:50
+
+Memory and time to first byte of get_thread_by_id on a synthetic 5,000-message thread: the streamed response
+(pages sent as they arrive) against building the whole response first, as the endpoint did before.
+The table is a local fake returning 1 MB pages, each query takes QUERY_LATENCY seconds.
+python -m tests.benchmarks.thread_read
+"""
+import asyncio
+import json
+import time
+import tracemalloc
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from admin.ThreadManager import get_thread_by_id
+from common.MessageStorageHandler import MessageStorageHandler
+from utils.response import response
+
+THREAD_ID = UUID("4f8a1c2e-9b7d-4e3a-8c1f-2d6b5a9e0f13")
+MESSAGES = 5000
+PAGE_BYTES = 1024 * 1024  # a query returns at most 1 MB
+QUERY_LATENCY = 0.03
+
+
+class FakeTable:
+    """
+    The query of a DynamoDB table holding one thread, paged by size like DynamoDB.
+    """
+
+    def __init__(self, items: list[dict]):
+        self.items = items
+        self.queries = 0
+
+    def query(self, KeyConditionExpression, ScanIndexForward=True, ExclusiveStartKey=None, Limit=None):
+        self.queries += 1
+        time.sleep(QUERY_LATENCY)
+        start = 0
+        if ExclusiveStartKey is not None:
+            start = next(i for i, item in enumerate(self.items)
+                         if item["created_at"] == ExclusiveStartKey["created_at"]) + 1
+        page, page_bytes = [], 0
+        for item in self.items[start:start + (Limit or len(self.items))]:
+            if page_bytes >= PAGE_BYTES:
+                break
+            page.append(item)
+            page_bytes += len(json.dumps(item))
+        result = {"Items": page}
+        if start + len(page) < len(self.items):
+            result["LastEvaluatedKey"] = {"thread_id": page[-1]["thread_id"], "created_at": page[-1]["created_at"]}
+        return result
+
+
+class FakeFeedbackHandler:
+    async def get_feedback_for_thread_async(self, thread_id: str) -> list:
+        return []
+
+
+def synthetic_thread() -> list[dict]:
+    reply = "That is a fair point, could you walk me through how you would size the market in the first year? " * 6
+    return [{"thread_id": str(THREAD_ID), "created_at": str(1718000000000 + i), "msg_id": f"4f8a1c2e#{i}",
+             "user_id": "abc123", "role": "human" if i % 2 == 0 else "openai", "content": reply, "step_id": i // 500,
+             "trial_id": "1"} for i in range(MESSAGES)]
+
+
+class FakeMessageStorageHandler(MessageStorageHandler):
+    def __init__(self, items: list[dict]):
+        self.fake_table = FakeTable(items)
+
+    @property
+    def table(self):
+        return self.fake_table
+
+
+async def buffered(handler: MessageStorageHandler) -> tuple[float, int, int]:
+    """
+    The endpoint before streaming: read the whole thread, sort it, then render the whole JSON body.
+    :return: time to first byte, body bytes, messages
+    """
+    start = time.perf_counter()
+    thread_messages = await asyncio.to_thread(handler.get_thread, str(THREAD_ID))
+    sorted_messages = sorted(thread_messages, key=lambda x: x.created_at)
+    body = JSONResponse(jsonable_encoder(response(True, data={"thread_id": THREAD_ID, "messages": sorted_messages,
+                                                              "feedback": []}))).body
+    return time.perf_counter() - start, len(body), len(json.loads(body)["data"]["messages"])
+
+
+async def streamed(handler: MessageStorageHandler) -> tuple[float, int, int]:
+    """
+    get_thread_by_id as it is, the body chunks are dropped as they would be once sent.
+    :return: time to first byte, body bytes, messages
+    """
+    start = time.perf_counter()
+    streaming_response = await get_thread_by_id(THREAD_ID, message_handler=handler,
+                                                feedback_handler=FakeFeedbackHandler())
+    first_byte = None
+    body_bytes = messages = 0
+    async for chunk in streaming_response.body_iterator:
+        first_byte = first_byte or time.perf_counter() - start
+        body_bytes += len(chunk)
+        messages += chunk.count('"msg_id"')
+    return first_byte, body_bytes, messages
+
+
+async def measure(read, items: list[dict]) -> tuple[float, float, int, int, int]:
+    handler = FakeMessageStorageHandler(items)
+    tracemalloc.start()
+    first_byte, body_bytes, messages = await read(handler)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first_byte, peak, body_bytes, messages, handler.table.queries
+
+
+async def main():
+    items = synthetic_thread()
+    print(f"{MESSAGES} messages, {QUERY_LATENCY * 1000:.0f}ms per query")
+    print(f"{'response':>9} {'first byte ms':>14} {'peak MB':>8} {'body MB':>8} {'messages':>9} {'queries':>8}")
+    for name, read in (("buffered", buffered), ("streamed", streamed)):
+        first_byte, peak, body_bytes, messages, queries = await measure(read, items)
+        print(f"{name:>9} {first_byte * 1000:>14.0f} {peak / 2 ** 20:>8.1f} {body_bytes / 2 ** 20:>8.1f} "
+              f"{messages:>9} {queries:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
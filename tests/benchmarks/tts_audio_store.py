@@ -0,0 +1,124 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: tts_audio_store.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/19/26 11:30
+
+Cost of serving one TTS chunk from each audio store, at a few chunk sizes: exists (the broker's check for a chunk
+written by another worker), reading the chunk (stream_tts_session) and a full get_tts_file response.
+LocalTtsAudioStore writes to its volume folder under the current directory, RedisTtsAudioStore to the redis in
+REDIS_ADDRESS (skipped if it is not reachable). The chunks are deleted at the end.
+REDIS_ADDRESS=127.0.0.1 python -m tests.benchmarks.tts_audio_store
+"""
+import asyncio
+import os
+import statistics
+import time
+import uuid
+
+from common.ClientRegistry import client_registry
+from user.TtsAudioStore import LocalTtsAudioStore, RedisTtsAudioStore, TtsAudioStore
+import main
+
+ROUNDS = 200
+PAYLOAD_SIZES = (16 * 1024, 64 * 1024, 256 * 1024)  # a short sentence of mp3 is around 20 KB
+
+
+async def serve(response) -> int:
+    """
+    Run the response as the server would.
+    :return: the number of body bytes sent
+    """
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "path": "/api/v1/user/get_tts_file", "headers": []}
+    disconnected = asyncio.Event()
+    body_bytes = 0
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal body_bytes
+        if message["type"] == "http.response.body":
+            body_bytes += len(message.get("body", b""))
+
+    await response(scope, receive, send)
+    disconnected.set()
+    return body_bytes
+
+
+async def measure(store: TtsAudioStore, tts_session_id: str, payload_size: int) -> dict[str, list[float]]:
+    """
+    :return: the durations of each step, in seconds
+    """
+    content = os.urandom(payload_size)
+    main.tts_audio_store = store
+    durations = {"exists": [], "get": [], "get_tts_file": []}
+    for i in range(ROUNDS):
+        chunk_id = f"{payload_size}-{i}"
+        await store.put(tts_session_id, chunk_id, content)
+        start = time.perf_counter()
+        assert await store.exists(tts_session_id, chunk_id)
+        durations["exists"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        assert len(await store.get(tts_session_id, chunk_id)) == payload_size
+        durations["get"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        assert await serve(await main.get_tts_file(tts_session_id, chunk_id)) == payload_size
+        durations["get_tts_file"].append(time.perf_counter() - start)
+    return durations
+
+
+async def cleanup(store: TtsAudioStore, tts_session_id: str):
+    chunk_ids = [f"{payload_size}-{i}" for payload_size in PAYLOAD_SIZES for i in range(ROUNDS)]
+    if isinstance(store, LocalTtsAudioStore):
+        for chunk_id in chunk_ids:
+            try:
+                os.remove(store.file_path(tts_session_id, chunk_id))
+            except FileNotFoundError:
+                pass
+    else:
+        await store.redis_client.delete(*(f"{store.KEY_PREFIX}:{tts_session_id}:{chunk_id}"
+                                          for chunk_id in chunk_ids))
+
+
+async def redis_available() -> bool:
+    if not os.getenv("REDIS_ADDRESS"):
+        return False
+    try:
+        return bool(await client_registry.redis_async.ping())
+    except Exception:
+        return False
+
+
+async def main_benchmark():
+    stores = {"local": LocalTtsAudioStore()}
+    if await redis_available():
+        stores["redis"] = RedisTtsAudioStore()
+    else:
+        print("redis is not reachable at REDIS_ADDRESS, only the local store is measured")
+    print(f"{ROUNDS} chunks per size, p50 / p95 in us")
+    print(f"{'store':>6} {'size KB':>8} {'exists':>15} {'get':>15} {'get_tts_file':>15}")
+    try:
+        for name, store in stores.items():
+            tts_session_id = f"benchmark-{uuid.uuid4()}"
+            try:
+                for payload_size in PAYLOAD_SIZES:
+                    durations = await measure(store, tts_session_id, payload_size)
+                    cells = []
+                    for step in ("exists", "get", "get_tts_file"):
+                        step_durations = sorted(durations[step])
+                        cells.append(f"{statistics.median(step_durations) * 1e6:.0f} / "
+                                     f"{step_durations[int(len(step_durations) * 0.95)] * 1e6:.0f}")
+                    print(f"{name:>6} {payload_size // 1024:>8} {cells[0]:>15} {cells[1]:>15} {cells[2]:>15}")
+            finally:
+                await cleanup(store, tts_session_id)
+    finally:
+        await client_registry.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main_benchmark())
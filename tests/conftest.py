@@ -0,0 +1,30 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: conftest.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 22:00
+"""
+import pytest
+
+
+@pytest.fixture
+def db_leaks(monkeypatch) -> list[tuple[str, int]]:
+    """
+    The (path, connections) of every request that ended with a DB connection still checked out.
+    """
+    from middleware.db_timing import DbTimingMiddleware
+    leaks = []
+    monkeypatch.setattr(DbTimingMiddleware, "report_leak",
+                        staticmethod(lambda path, checked_out: leaks.append((path, checked_out))))
+    return leaks
+
+
+@pytest.fixture
+def db_leak_check(db_leaks):
+    """
+    Fail the test if any request it made left a DB connection checked out, i.e. a session was not closed.
+    """
+    yield
+    assert not db_leaks, f"DB connections still checked out at the end of a request: {db_leaks}"
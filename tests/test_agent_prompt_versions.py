@@ -0,0 +1,129 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_agent_prompt_versions.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 20:40
+
+AgentPromptHandler never caches a prompt under a version it does not belong to, and never serves a removed step.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from common import AgentPromptHandler as prompt_module
+from common.AgentPromptHandler import AgentPromptHandler
+
+AGENT_ID = "agent-1"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=False):
+        redis = self
+
+        class Pipeline:
+            def set(self, key, value, ex=None):
+                redis.set(key, value)
+
+            def execute(self):
+                pass
+        return Pipeline()
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = {}  # (agent_id, step) -> item
+
+    def put_item(self, Item):
+        self.rows[(Item['agent_id'], Item['step'])] = dict(Item)
+
+    def query(self, KeyConditionExpression):
+        # Key('agent_id').eq(..) & Key('step').eq(..)
+        values = {condition.get_expression()['values'][0].name: condition.get_expression()['values'][1]
+                  for condition in KeyConditionExpression.get_expression()['values']}
+        row = self.rows.get((values['agent_id'], values['step']))
+        return {'Items': [row] if row else []}
+
+    def batch_write(self, requests):
+        for request in requests:
+            if 'PutRequest' in request:
+                self.put_item(request['PutRequest']['Item'])
+            else:
+                key = request['DeleteRequest']['Key']
+                self.rows.pop((key['agent_id'], key['step']), None)
+        return []
+
+    def batch_get(self, keys):
+        return [self.rows[(key['agent_id'], key['step'])] for key in keys
+                if (key['agent_id'], key['step']) in self.rows]
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    redis, table = FakeRedis(), FakeTable()
+    monkeypatch.setattr(prompt_module, "client_registry", SimpleNamespace(redis=redis))
+    monkeypatch.setattr(AgentPromptHandler, "table", table)
+    # only this worker, no redis pub/sub
+    monkeypatch.setattr(prompt_module.cache_invalidation_bus, "publish",
+                        lambda topic, key: AgentPromptHandler.invalidate(key))
+    AgentPromptHandler.l1_cache.clear()
+    yield redis, table
+    AgentPromptHandler.l1_cache.clear()
+
+
+def publish_version(handler: AgentPromptHandler, prompts: dict, version: str, stale_steps=()):
+    assert handler.put_agent_prompts(AGENT_ID, prompts, version, list(stale_steps))
+    assert handler.activate_version(AGENT_ID, version)
+
+
+def test_serves_the_active_version(backends):
+    handler = AgentPromptHandler()
+    publish_version(handler, {"0": "intro v1", "1": "case v1"}, "1000")
+    publish_version(handler, {"0": "intro v2", "1": "case v2"}, "2000")
+    assert handler.get_agent_prompts(AGENT_ID, ["0", "1"]) == {"0": "intro v2", "1": "case v2"}
+
+
+def test_edit_in_flight_is_not_cached_under_the_old_version(backends):
+    redis, table = backends
+    handler = AgentPromptHandler()
+    publish_version(handler, {"0": "intro v1", "1": "case v1"}, "1000")
+    assert handler.get_agent_prompt(AGENT_ID, "0") == "intro v1"  # L1 entry now pinned to version 1000
+    # redis lost the step, and an edit has overwritten the row but not activated its version yet
+    del redis.data["agent_prompt:agent-1:1000:1"]
+    table.put_item({'agent_id': AGENT_ID, 'step': "1", 'prompt': "case v2", 'version': "2000"})
+    assert handler.get_agent_prompt(AGENT_ID, "1") == "case v2"
+    assert "agent_prompt:agent-1:1000:1" not in redis.data
+    assert handler.get_agent_prompts(AGENT_ID, ["1"]) == {"1": "case v2"}
+    assert "agent_prompt:agent-1:1000:1" not in redis.data
+
+
+def test_removed_step_is_not_served(backends):
+    redis, table = backends
+    handler = AgentPromptHandler()
+    publish_version(handler, {"0": "intro v1", "1": "case v1", "2": "wrap up v1"}, "1000")
+    # the update drops step 2, but its row is still there (e.g. the delete failed)
+    assert handler.put_agent_prompts(AGENT_ID, {"0": "intro v2", "1": "case v2"}, "2000")
+    assert handler.activate_version(AGENT_ID, "2000")
+    assert ("agent-1", "2") in table.rows
+    assert handler.get_agent_prompt(AGENT_ID, "2") is None
+    assert handler.get_agent_prompts(AGENT_ID, ["1", "2"]) == {"1": "case v2", "2": None}
+
+
+def test_rows_without_a_version_are_served(backends):
+    redis, table = backends
+    table.put_item({'agent_id': AGENT_ID, 'step': "0", 'prompt': "legacy"})
+    redis.set("agent_prompt_version:agent-1", "1000")
+    assert AgentPromptHandler().get_agent_prompt(AGENT_ID, "0") == "legacy"
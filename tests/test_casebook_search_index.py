@@ -0,0 +1,110 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_casebook_search_index.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 21:05
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from admin import CasebookSearchIndex as index_module
+from admin.CasebookSearchIndex import CasebookSearchIndex
+
+AGENTS = [
+    SimpleNamespace(agent_id="a1", agent_name="Market entry", agent_description="A retailer enters a new market.",
+                    agent_cover=None, updated_at=datetime(2024, 1, 1), workspace_id="w1", status=1),
+    SimpleNamespace(agent_id="a2", agent_name="Café Müller", agent_description="Profitability of a café chain.",
+                    agent_cover=None, updated_at=datetime(2024, 1, 2), workspace_id="w1", status=1),
+    SimpleNamespace(agent_id="a3", agent_name="Airline pricing", agent_description="Supermarket-style fares.",
+                    agent_cover=None, updated_at=datetime(2024, 1, 3), workspace_id="w1", status=1),
+    SimpleNamespace(agent_id="a4", agent_name="Market sizing", agent_description="Other workspace.",
+                    agent_cover=None, updated_at=datetime(2024, 1, 4), workspace_id="w2", status=1),
+]
+
+
+class FakeSession:
+    def __init__(self, agents):
+        self.agents = agents
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def query(self, model):
+        return self
+
+    def filter(self, *conditions):
+        return self
+
+    def first(self):
+        return self.agents[0] if self.agents else None
+
+    def all(self):
+        return self.agents
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(index_module, "SessionLocal", lambda: FakeSession(AGENTS))
+    casebook = CasebookSearchIndex()
+    casebook.build()
+    assert casebook.ready
+    return casebook
+
+
+def agent_ids(results) -> list[str]:
+    return [agent_id for _, agent_id, _ in results]
+
+
+def test_ranked_words_and_prefixes(index):
+    assert agent_ids(index.search("market", ["w1"]))[0] == "a1"
+    assert "a1" in agent_ids(index.search("mark", ["w1"]))
+
+
+def test_workspace_scope(index):
+    assert "a4" not in agent_ids(index.search("market", ["w1"]))
+    assert agent_ids(index.search("sizing", ["w1", "w2"])) == ["a4"]
+
+
+def test_non_ascii_words(index):
+    assert agent_ids(index.search("müller", ["w1"])) == ["a2"]
+    assert agent_ids(index.search("CAFÉ", ["w1"])) == ["a2"]
+
+
+def test_substring_matches_like_sql(index):
+    # "rket" is neither a word, a prefix nor a typo away from one, the SQL search (ILIKE '%rket%') finds both
+    results = index.search("rket", ["w1"])
+    assert set(agent_ids(results)) == {"a1", "a3"}
+    assert all(score == 0 for score, _, _ in results)
+
+
+def test_one_typo(index):
+    assert "a1" in agent_ids(index.search("markte", ["w1"]))
+
+
+def test_reload_removes_deleted_case(index, monkeypatch):
+    deleted = SimpleNamespace(**{**vars(AGENTS[1]), "status": 2})
+    monkeypatch.setattr(index_module, "SessionLocal", lambda: FakeSession([deleted]))
+    index.reload("a2")
+    assert index.search("müller", ["w1"]) == []
+
+
+def test_reload_during_build_is_kept(index, monkeypatch):
+    renamed = SimpleNamespace(**{**vars(AGENTS[1]), "agent_name": "Bistro Weber"})
+
+    class RacingSession(FakeSession):
+        def all(self):
+            # the agent is renamed and reloaded after the build has read its snapshot
+            monkeypatch.setattr(index_module, "SessionLocal", lambda: FakeSession([renamed]))
+            index.reload("a2")
+            return self.agents
+
+    monkeypatch.setattr(index_module, "SessionLocal", lambda: RacingSession(AGENTS))
+    index.build()
+    assert agent_ids(index.search("weber", ["w1"])) == ["a2"]
@@ -0,0 +1,55 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_db_leak_detector.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 22:00
+"""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from migrations.pool_metrics import PoolMetrics, TimedQueuePool, instrument_engine
+from middleware.db_timing import DbTimingMiddleware
+
+
+@pytest.fixture
+def client():
+    engine = create_engine("sqlite://", poolclass=TimedQueuePool, connect_args={"check_same_thread": False})
+    instrument_engine(engine, PoolMetrics("test"))
+    session_factory = sessionmaker(bind=engine)
+    leaked_sessions = []
+
+    async def closed_session(request):
+        with session_factory() as db:
+            db.execute(text("SELECT 1"))
+        return PlainTextResponse("ok")
+
+    async def leaked_session(request):
+        db = session_factory()
+        db.execute(text("SELECT 1"))
+        leaked_sessions.append(db)  # never closed
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/closed", closed_session), Route("/leaked", leaked_session)])
+    app.add_middleware(DbTimingMiddleware)
+    yield TestClient(app)
+    for db in leaked_sessions:
+        db.close()
+    engine.dispose()
+
+
+def test_closed_session(client, db_leak_check):
+    response = client.get("/closed")
+    assert response.status_code == 200
+    assert "db;dur=" in response.headers["server-timing"]
+
+
+def test_leaked_session_is_reported(client, db_leaks):
+    client.get("/leaked")
+    assert db_leaks == [("/leaked", 1)]
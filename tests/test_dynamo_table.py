@@ -0,0 +1,80 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_dynamo_table.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/19/26 10:20
+
+DynamoTable sends what the boto3 Table resource would, checked against the DynamoDB service model with a Stubber.
+"""
+from decimal import Decimal
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Key
+from botocore.stub import Stubber
+
+from common import DynamoTable as dynamo_module
+from common.DynamoTable import DynamoTable
+
+TABLE = "prepit_chat_msg"
+
+
+@pytest.fixture
+def stubber(monkeypatch):
+    client = boto3.client("dynamodb", region_name="us-east-2", aws_access_key_id="test",
+                          aws_secret_access_key="test")
+    monkeypatch.setattr(dynamo_module, "client_registry", SimpleNamespace(dynamodb=client))
+    with Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_query_pages(stubber):
+    stubber.add_response(
+        "query",
+        {"Items": [{"thread_id": {"S": "t1"}, "created_at": {"S": "2"}, "step_id": {"N": "3"}}],
+         "LastEvaluatedKey": {"thread_id": {"S": "t1"}, "created_at": {"S": "2"}}},
+        {"TableName": TABLE, "KeyConditionExpression": "#n0 = :v0", "ExpressionAttributeNames": {"#n0": "thread_id"},
+         "ExpressionAttributeValues": {":v0": {"S": "t1"}}, "ScanIndexForward": True,
+         "ExclusiveStartKey": {"thread_id": {"S": "t1"}, "created_at": {"S": "1"}}})
+    response = DynamoTable(TABLE).query(KeyConditionExpression=Key("thread_id").eq("t1"), ScanIndexForward=True,
+                                        ExclusiveStartKey={"thread_id": "t1", "created_at": "1"})
+    assert response["Items"] == [{"thread_id": "t1", "created_at": "2", "step_id": Decimal(3)}]
+    assert response["LastEvaluatedKey"] == {"thread_id": "t1", "created_at": "2"}
+
+
+def test_get_and_put_item(stubber):
+    key = {"thread_id": "t1", "created_at": "1"}
+    stubber.add_response("put_item", {}, {"TableName": TABLE,
+                                          "Item": {"thread_id": {"S": "t1"}, "created_at": {"S": "1"},
+                                                   "has_audio": {"BOOL": False}}})
+    stubber.add_response("get_item", {}, {"TableName": TABLE,
+                                          "Key": {"thread_id": {"S": "t1"}, "created_at": {"S": "1"}}})
+    DynamoTable(TABLE).put_item(Item={**key, "has_audio": False})
+    assert "Item" not in DynamoTable(TABLE).get_item(Key=key)
+
+
+def test_batch_write_returns_unprocessed_requests(stubber):
+    put = {"PutRequest": {"Item": {"thread_id": {"S": "t1"}, "created_at": {"S": "1"}}}}
+    delete = {"DeleteRequest": {"Key": {"thread_id": {"S": "t1"}, "created_at": {"S": "2"}}}}
+    stubber.add_response("batch_write_item", {"UnprocessedItems": {TABLE: [delete]}},
+                         {"RequestItems": {TABLE: [put, delete]}})
+    unprocessed = DynamoTable(TABLE).batch_write([
+        {"PutRequest": {"Item": {"thread_id": "t1", "created_at": "1"}}},
+        {"DeleteRequest": {"Key": {"thread_id": "t1", "created_at": "2"}}}])
+    assert unprocessed == [{"DeleteRequest": {"Key": {"thread_id": "t1", "created_at": "2"}}}]
+
+
+def test_batch_get_follows_unprocessed_keys(stubber):
+    first, second = ({"agent_id": {"S": "a1"}, "step": {"S": step}} for step in ("0", "1"))
+    stubber.add_response("batch_get_item",
+                         {"Responses": {TABLE: [{**first, "prompt": {"S": "p0"}}]},
+                          "UnprocessedKeys": {TABLE: {"Keys": [second]}}},
+                         {"RequestItems": {TABLE: {"Keys": [first, second]}}})
+    stubber.add_response("batch_get_item", {"Responses": {TABLE: [{**second, "prompt": {"S": "p1"}}]}},
+                         {"RequestItems": {TABLE: {"Keys": [second]}}})
+    items = DynamoTable(TABLE).batch_get([{"agent_id": "a1", "step": "0"}, {"agent_id": "a1", "step": "1"}])
+    assert [item["prompt"] for item in items] == ["p0", "p1"]
@@ -0,0 +1,86 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_message_write_buffer.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 19:30
+"""
+import asyncio
+
+from botocore.exceptions import ClientError
+
+from common import MessageStorageHandler as storage
+from common.MessageStorageHandler import MessageWriteBuffer
+
+
+class FakeTable:
+    """
+    batch_write rejecting the whole call when it holds an item with content "oversized",
+    and leaving items with content "throttled" unprocessed.
+    """
+
+    def __init__(self):
+        self.written = []
+        self.calls = 0
+
+    def batch_write(self, requests):
+        self.calls += 1
+        items = [request['PutRequest']['Item'] for request in requests]
+        if any(item['content'] == "oversized" for item in items):
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "Item size too large"}},
+                              "BatchWriteItem")
+        self.written.extend(item for item in items if item['content'] != "throttled")
+        return [{'PutRequest': {'Item': item}} for item in items if item['content'] == "throttled"]
+
+
+def make_buffer(monkeypatch) -> tuple[MessageWriteBuffer, FakeTable]:
+    table = FakeTable()
+    monkeypatch.setattr(storage.MessageStorageHandler, "table", table)
+    buffer = MessageWriteBuffer()
+    buffer.BACKOFF_BASE = 0
+    return buffer, table
+
+
+def item(buffer: MessageWriteBuffer, content: str, thread_id: str = "thread-1") -> dict:
+    return {'thread_id': thread_id, 'created_at': buffer.next_created_at(thread_id), 'content': content}
+
+
+def test_created_at_is_unique_and_increasing_per_thread(monkeypatch):
+    buffer, _ = make_buffer(monkeypatch)
+    created = [int(buffer.next_created_at("thread-1")) for _ in range(1000)]
+    assert created == sorted(set(created))
+
+
+def test_batches_of_25(monkeypatch):
+    buffer, table = make_buffer(monkeypatch)
+    for i in range(60):
+        buffer.add(item(buffer, f"message {i}"))
+    asyncio.run(buffer.flush())
+    assert table.calls == 3
+    assert len(table.written) == 60
+    assert not buffer.pending
+
+
+def test_rejected_item_is_split_out_and_dropped(monkeypatch):
+    buffer, table = make_buffer(monkeypatch)
+    for i in range(25):
+        buffer.add(item(buffer, "oversized" if i == 7 else f"message {i}"))
+    asyncio.run(buffer.flush())
+    assert len(table.written) == 24
+    assert all(written['content'] != "oversized" for written in table.written)
+    assert not buffer.pending
+
+
+def test_unprocessed_item_is_retried_then_dropped(monkeypatch):
+    buffer, table = make_buffer(monkeypatch)
+    buffer.add(item(buffer, "throttled"))
+    buffer.add(item(buffer, "message"))
+    for flush in range(1, MessageWriteBuffer.MAX_FLUSHES):
+        asyncio.run(buffer.flush())
+        # kept for the next flush, behind what is queued meanwhile
+        assert [pending['content'] for pending in buffer.pending] == ["throttled"]
+    asyncio.run(buffer.flush())
+    assert not buffer.pending
+    assert not buffer.failed_flushes
+    assert [written['content'] for written in table.written] == ["message"]
@@ -0,0 +1,61 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_route_access_index.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 20:10
+
+RouteAccessIndex must decide exactly like the reference has_access, on the real access map and on random ones.
+"""
+import itertools
+import random
+
+import pytest
+
+from middleware.authorization import has_access, role_mask, RouteAccessIndex, ROLE_BITS
+from utils.endpoint_access_map import endpoint_access_map
+
+ROLE_COMBINATIONS = [dict(zip(ROLE_BITS, flags)) for flags in itertools.product([False, True], repeat=len(ROLE_BITS))]
+SEGMENTS = ["agents", "agent", "threads", "get", "get_thread", "workspace", "join", "ping", "abc", "123", ""]
+
+
+def candidate_paths(access_map: dict, rng: random.Random, count: int) -> list[str]:
+    """
+    The endpoints themselves, their patterns filled in, and random paths sharing their segments.
+    """
+    paths = set(access_map)
+    for endpoint in access_map:
+        parts = endpoint.split("/")
+        paths.add("/".join(rng.choice(SEGMENTS) if "{" in part else part for part in parts))
+        paths.add(endpoint + "/extra")
+        paths.add("/".join(parts[:-1]))
+    for _ in range(count):
+        paths.add("/" + "/".join(rng.choice(SEGMENTS) for _ in range(rng.randint(0, 4))))
+    return sorted(paths)
+
+
+def random_access_map(rng: random.Random) -> dict:
+    access_map = {}
+    for _ in range(rng.randint(1, 12)):
+        parts = ["{id}" if rng.random() < 0.3 else rng.choice(SEGMENTS[:-1]) for _ in range(rng.randint(1, 4))]
+        access_map["/" + "/".join(parts)] = {role: rng.random() < 0.5 for role in ROLE_BITS}
+    return access_map
+
+
+def assert_same_decisions(access_map: dict, paths: list[str]):
+    index = RouteAccessIndex(access_map)
+    for path in paths:
+        for roles in ROLE_COMBINATIONS:
+            assert index.has_access(role_mask(roles), path) == has_access(access_map, roles, path), (path, roles)
+
+
+def test_endpoint_access_map():
+    assert_same_decisions(endpoint_access_map, candidate_paths(endpoint_access_map, random.Random(0), 500))
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_access_maps(seed):
+    rng = random.Random(seed)
+    access_map = random_access_map(rng)
+    assert_same_decisions(access_map, candidate_paths(access_map, rng, 50))
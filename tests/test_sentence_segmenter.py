@@ -0,0 +1,65 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_sentence_segmenter.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 19:50
+"""
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from user.SentenceSegmenter import SentenceSegmenter
+
+CORPUS = json.loads((Path(__file__).parent / "data" / "interviewer_replies.json").read_text())
+
+
+def tokenize(text: str, seed: int) -> list[str]:
+    """
+    Split text into LLM-like tokens of 1 to 6 characters, so enders also land on token boundaries.
+    """
+    rng = random.Random(seed)
+    tokens, start = [], 0
+    while start < len(text):
+        end = start + rng.randint(1, 6)
+        tokens.append(text[start:end])
+        start = end
+    return tokens
+
+
+def segment(tokens: list[str], **policy) -> list[tuple[int, str]]:
+    segmenter = SentenceSegmenter(**policy)
+    chunks = []
+    for token in tokens:
+        chunks.extend(segmenter.feed(token))
+    last_chunk = segmenter.flush()
+    if last_chunk:
+        chunks.append(last_chunk)
+    return chunks
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("case", CORPUS, ids=lambda case: case["reply"][:30])
+def test_sentences(case, seed):
+    # no minimum size, every sentence boundary is a cut
+    chunks = segment(tokenize(case["reply"], seed), base_words=0, step_words=0)
+    assert [text.strip() for _, text in chunks] == case["sentences"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_size_policy(seed):
+    reply = " ".join(case["reply"] for case in CORPUS)
+    chunks = segment(tokenize(reply, seed))
+    assert "".join(text for _, text in chunks) == reply
+    assert [chunk_id for chunk_id, _ in chunks] == list(range(len(chunks)))
+    for chunk_id, text in chunks[:-1]:
+        assert len(text.split()) > 16 + (chunk_id - 1) * 13
+
+
+def test_whitespace_only_flush():
+    segmenter = SentenceSegmenter(base_words=0, step_words=0)
+    assert segmenter.feed("Done. ") == [(0, "Done.")]
+    assert segmenter.flush() is None
@@ -0,0 +1,61 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_tts_audio_broker.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/19/26 12:10
+"""
+import asyncio
+
+from user.TtsAudioBroker import TtsAudioBroker
+from user.TtsAudioStore import TtsAudioStore
+
+
+class FakeAudioStore(TtsAudioStore):
+    """
+    The shared store as seen by a worker that did not run the chat.
+    """
+
+    def __init__(self, chunk_ids: set[int], failed_chunk_ids: set[int], last_chunk_id: int):
+        self.chunk_ids = chunk_ids
+        self.failed_chunk_ids = failed_chunk_ids
+        self.last_chunk_id = last_chunk_id
+
+    async def put(self, tts_session_id: str, chunk_id: str, content: bytes):
+        self.chunk_ids.add(int(chunk_id))
+
+    async def get(self, tts_session_id: str, chunk_id: str) -> bytes | None:
+        return b"audio" if int(chunk_id) in self.chunk_ids else None
+
+    async def exists(self, tts_session_id: str, chunk_id: str) -> bool:
+        return int(chunk_id) in self.chunk_ids
+
+    async def mark_served(self, tts_session_id: str, chunk_id: str):
+        pass
+
+    async def get_last_chunk(self, tts_session_id: str) -> int | None:
+        return self.last_chunk_id
+
+    async def mark_failed(self, tts_session_id: str, chunk_id: str):
+        self.failed_chunk_ids.add(int(chunk_id))
+
+    async def is_failed(self, tts_session_id: str, chunk_id: str) -> bool:
+        return int(chunk_id) in self.failed_chunk_ids
+
+
+async def collect(broker: TtsAudioBroker, audio_store: TtsAudioStore, idle_timeout: float) -> list[int]:
+    return [chunk_id async for chunk_id in broker.chunks("session", audio_store, idle_timeout=idle_timeout)]
+
+
+def test_chunks_failed_on_another_worker_are_skipped():
+    audio_store = FakeAudioStore({0, 2, 3}, {1}, last_chunk_id=3)
+    # a failed chunk must not wait out the idle timeout, nor end the stream early
+    chunk_ids = asyncio.run(asyncio.wait_for(collect(TtsAudioBroker(), audio_store, idle_timeout=30), timeout=5))
+    assert chunk_ids == [0, 2, 3]
+
+
+def test_missing_chunk_still_times_out():
+    audio_store = FakeAudioStore({0, 2}, set(), last_chunk_id=2)
+    chunk_ids = asyncio.run(collect(TtsAudioBroker(), audio_store, idle_timeout=0.1))
+    assert chunk_ids == [0]
@@ -0,0 +1,67 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: test_user_auth.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/19/26 12:40
+"""
+import pytest
+from cachetools import TTLCache
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from admin.UserAuth import UserAuth, access_token_issue_buffer
+from migrations import session as session_module
+from migrations.models import Base, RefreshToken, User
+from migrations.pool_metrics import PoolMetrics, TimedQueuePool, instrument_engine
+from middleware.db_timing import DbTimingMiddleware
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    # a file, every pooled connection to sqlite:// would get its own empty database
+    engine = create_engine(f"sqlite:///{tmp_path / 'auth.db'}", poolclass=TimedQueuePool,
+                           connect_args={"check_same_thread": False})
+    instrument_engine(engine, PoolMetrics("test"))
+    # sqlite has no "public" schema
+    sqlite_engine = engine.execution_options(schema_translate_map={"public": None})
+    Base.metadata.create_all(sqlite_engine, tables=[User.__table__, RefreshToken.__table__])
+    # UserAuth() opens its sessions through session_scope, as the sign-in endpoints use it
+    monkeypatch.setattr(session_module, "SessionLocal", sessionmaker(bind=sqlite_engine))
+    monkeypatch.setattr(UserAuth, "claims_cache", TTLCache(maxsize=UserAuth.CLAIMS_CACHE_SIZE,
+                                                           ttl=UserAuth.CLAIMS_CACHE_TTL))
+    monkeypatch.setattr(access_token_issue_buffer, "pending", {})
+
+    def login(request: Request):
+        user_info = {"email": "student@example.com", "first_name": "Case", "last_name": "Student"}
+        return JSONResponse(UserAuth().login("email", user_info, {"ip": "127.0.0.1"}))
+
+    def access_token(request: Request):
+        return JSONResponse(UserAuth().gen_access_token(request.query_params["refresh_token"]))
+
+    def logout_all_devices(request: Request):
+        return JSONResponse(UserAuth().user_logout_all_devices(int(request.query_params["user_id"])))
+
+    app = Starlette(routes=[Route("/login", login, methods=["POST"]), Route("/access_token", access_token),
+                            Route("/logout_all_devices", logout_all_devices, methods=["POST"])])
+    app.add_middleware(DbTimingMiddleware)
+    yield TestClient(app)
+    engine.dispose()
+
+
+def test_sign_in_and_out_return_every_connection(client, db_leak_check):
+    signed_in = client.post("/login").json()
+    assert signed_in and signed_in["access_token"]
+    # drop the claims cached by login, so the access token is minted from the database
+    UserAuth.invalidate_user(str(signed_in["user_id"]))
+    response = client.get("/access_token", params={"refresh_token": signed_in["refresh_token"]})
+    assert response.json()
+    assert "db;dur=" in response.headers["server-timing"]
+    assert client.post("/logout_all_devices", params={"user_id": signed_in["user_id"]}).json() is True
+    assert client.get("/access_token", params={"refresh_token": signed_in["refresh_token"]}).json() is False
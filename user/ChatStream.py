@@ -6,11 +6,14 @@
 @email: rxy216@case.edu
 @time: 2/29/24 15:14
 """
-from typing import List
+from typing import List, AsyncIterator, Literal
+import asyncio
 import json
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 from user.TtsStream import TtsStream
+from user.TtsPipeline import TtsPipeline
+from user.SentenceSegmenter import SentenceSegmenter
 from user.PromptManager import PromptManager
 import uuid
 from common.AgentPromptHandler import AgentPromptHandler
@@ -23,6 +26,7 @@ class ChatStreamModel(BaseModel):
     agent_id: str
     thread_id: str | None = None
     provider: str = "openai"
+    frame_mode: Literal["full", "delta"] = "full"  # "full": every frame carries the whole response, "delta": only the new text
 
 
 class ChatSingleCallResponse(BaseModel):
@@ -43,9 +47,11 @@ class ChatStream:
     """
     ChatStream: AI chat with OpenAI/Anthropic, streams the output via server-sent events.
     Using this class need to pass in the full messages history, and the provider (openai or anthropic).
+    The openai_client and anthropic_client must be the async clients (AsyncOpenAI / AsyncAnthropic).
     """
 
-    def __init__(self, requested_provider, current_step, agent_id, openai_client, anthropic_client):
+    def __init__(self, requested_provider, current_step, agent_id, openai_client, anthropic_client,
+                 agent_prompt_handler: AgentPromptHandler = None):
         self.requested_provider = requested_provider
         self.current_step = current_step
         self.agent_id = agent_id
@@ -54,19 +60,24 @@ class ChatStream:
         # generate a TtsStream session id (uuid4)
         self.tts_session_id = str(uuid.uuid4())
         self.tts = TtsStream(self.tts_session_id)
-        self.agent_prompt_handler = AgentPromptHandler()
+        self.tts_pipeline = TtsPipeline(self.tts)
+        self.agent_prompt_handler = agent_prompt_handler or AgentPromptHandler()
+        self.frame_mode = "full"
+        self.frame_seq = 0
 
-    def stream_chat(self, chat_stream_model: ChatStreamModel):
+    async def stream_chat(self, chat_stream_model: ChatStreamModel):
         """
         Stream chat messages from OpenAI API.
         :return:
         """
-        messages = self.__messages_processor(chat_stream_model.messages)
+        # the prompt lookup hits redis/dynamodb with blocking clients, keep it off the event loop
+        messages = await asyncio.to_thread(self.__messages_processor, chat_stream_model.messages)
+        self.frame_mode = chat_stream_model.frame_mode
         return EventSourceResponse(self.__chat_generator(messages))
 
-    def __chat_generator(self, messages: List[dict[str, str]]):
+    async def __chat_generator(self, messages: List[dict[str, str]]):
         """
-        Chat generator.
+        Chat generator. Runs entirely on the event loop, so a single worker can hold many concurrent streams.
         :param messages:
         :return:
         """
@@ -79,55 +90,74 @@ class ChatStream:
         else:
             stream = self.__openai_chat_generator(messages)
         response_text = ""
-        chunk_id = -1  # chunk_id starts from 0, -1 means no chunk has been created
-        sentence_ender = [".", "?", "!"]
-        chunk_buffer = ""
-        for text_chunk in stream:
-            new_text = text_chunk
-            response_text += new_text
-            if len(chunk_buffer.split()) > (16 + (chunk_id * 13)):  # dynamically adjust the chunk size
-                if sentence_ender[0] in new_text and not chunk_buffer[-1].isnumeric():  # if the chunk contains a sentence ender . and the last character is not a number
-                    chunk_buffer, chunk_id = self.__process_chunking(sentence_ender[0], new_text, chunk_buffer,
-                                                                     chunk_id)
-                elif sentence_ender[1] in new_text:  # if the chunk contains a sentence ender ?
-                    chunk_buffer, chunk_id = self.__process_chunking(sentence_ender[1], new_text, chunk_buffer,
-                                                                     chunk_id)
-                elif sentence_ender[2] in new_text:  # if the chunk contains a sentence ender !
-                    chunk_buffer, chunk_id = self.__process_chunking(sentence_ender[2], new_text, chunk_buffer,
-                                                                     chunk_id)
-                else:  # if the chunk does not contain a sentence ender
-                    chunk_buffer += new_text
-            else:  # if the chunk is less than 21 words
-                chunk_buffer += new_text
-            yield json.dumps(
-                {"response": response_text, "tts_session_id": self.tts_session_id,
-                 "tts_max_chunk_id": chunk_id})
-        # Process any remaining text in the chunk_buffer after the stream has finished
-        if chunk_buffer:
-            chunk_id += 1
-            self.tts.stream_tts(chunk_buffer, str(chunk_id))
-            yield json.dumps(
-                {"response": response_text, "tts_session_id": self.tts_session_id, "tts_max_chunk_id": chunk_id})
+        segmenter = SentenceSegmenter()
+        try:
+            async for text_chunk in stream:
+                new_text = text_chunk
+                response_text += new_text
+                for chunk_id, chunk_text in segmenter.feed(new_text):
+                    self.tts_pipeline.submit(chunk_text, chunk_id)
+                yield self.__build_frame(response_text, new_text)
+            # Process any remaining text in the segmenter after the stream has finished
+            last_chunk = segmenter.flush()
+            if last_chunk:
+                self.tts_pipeline.submit(last_chunk[1], last_chunk[0])
+            await self.tts_pipeline.close()
+            # keep the stream open until all audio is ready, announcing each chunk as it lands
+            announced_chunk_id = None
+            while not self.tts_pipeline.done or announced_chunk_id != self.tts_pipeline.ready_chunk_id:
+                if not self.tts_pipeline.done:
+                    await self.tts_pipeline.wait_for_progress()
+                announced_chunk_id = self.tts_pipeline.ready_chunk_id
+                yield self.__build_frame(response_text, "")
+            if self.frame_mode == "delta":
+                # the final frame carries the full text so the client can verify what it assembled
+                yield self.__build_frame(response_text, "", final=True)
+        finally:
+            self.tts_pipeline.cancel()
 
-    def __openai_chat_generator(self, messages: List[dict[str, str]]):
+    def __build_frame(self, response_text: str, new_text: str, final: bool = False) -> str:
+        """
+        Build one SSE frame.
+        In "full" mode (legacy clients) every frame carries the whole response so far.
+        In "delta" mode a frame only carries the text added since the previous frame and a sequence number,
+        the final frame also carries the whole response.
+        :param response_text: the whole response so far
+        :param new_text: the text added since the previous frame
+        :param final: whether this is the final frame, only used in "delta" mode
+        :return: the frame as json
+        """
+        if self.frame_mode != "delta":
+            return json.dumps({"response": response_text, "tts_session_id": self.tts_session_id,
+                               "tts_max_chunk_id": self.tts_pipeline.ready_chunk_id})
+        frame = {"delta": new_text, "seq": self.frame_seq, "tts_session_id": self.tts_session_id,
+                 "tts_max_chunk_id": self.tts_pipeline.ready_chunk_id}
+        self.frame_seq += 1
+        if final:
+            frame["final"] = True
+            frame["response"] = response_text
+        return json.dumps(frame)
+
+    async def __openai_chat_generator(self, messages: List[dict[str, str]]) -> AsyncIterator[str]:
         """
         OpenAI chat generator.
         :param messages:
         :return:
         """
-        with self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                stream=True,
-                max_tokens=256,
-                temperature=0.92,
-        ) as stream:
-            for chunk in stream:
+        stream = await self.openai_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            stream=True,
+            max_tokens=256,
+            temperature=0.92,
+        )
+        async with stream:
+            async for chunk in stream:
                 if chunk.choices[0].delta.content is not None:
                     new_text = chunk.choices[0].delta.content
                     yield new_text
 
-    def __anthropic_chat_generator(self, messages: List[dict[str, str]]):
+    async def __anthropic_chat_generator(self, messages: List[dict[str, str]]) -> AsyncIterator[str]:
         """
         Anthropic chat generator.
         :param messages:
@@ -137,42 +167,23 @@ class ChatStream:
         if messages[0]["role"] == "system":
             system_message = messages.pop(0)
             system_message_content = system_message["content"]
-        with self.anthropic_client.messages.stream(
+        async with self.anthropic_client.messages.stream(
                 system=system_message_content,
                 max_tokens=2048,
                 messages=messages,
                 model="claude-3-sonnet-20240229",
         ) as stream:
-            for text in stream.text_stream:
+            async for text in stream.text_stream:
                 if text is not None:
                     yield text
 
-    def __process_chunking(self, sentence_ender: str, new_text: str, chunk_buffer: str, chunk_id: int):
-        """
-        Process the chunking.
-        :param sentence_ender:
-        :param new_text:
-        :param chunk_buffer:
-        :param chunk_id:
-        :return:
-        """
-        chunk_id += 1
-        new_text_split = new_text.split(sentence_ender)
-        chunk_buffer += new_text_split[0] + sentence_ender
-        self.tts.stream_tts(chunk_buffer, str(chunk_id))
-        chunk_buffer = sentence_ender.join(new_text_split[1:])
-        return chunk_buffer, chunk_id
-
     def __messages_processor(self, messages: dict[int, dict[str, str]]):
         """
         Process the message.
         :param messages: {0: {"role": "user", "content": "Hello, how are you?"}, 1: {"role": "assistant", "content": "I am fine, thank you."}}
         :return:
         """
-        current_step = self.agent_prompt_handler.get_agent_prompt(self.agent_id, self.current_step)
-        current_step_info = {}
-        if current_step:
-            current_step_info = json.loads(current_step)
+        current_step_info = self.agent_prompt_handler.get_parsed_agent_prompt(self.agent_id, self.current_step) or {}
         messages_list = [{"role": "system",
                           "content": f"{PromptManager.BASE_ROLE} Please follow this instruction: {current_step_info['instruction']} Here's some information for you, you should not give the info to candidate directly: {current_step_info['information']}"}]
         print(messages_list)
@@ -1,13 +1,14 @@
 from sqlalchemy.sql import text
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from migrations.models import Agent
 from utils.response import response
 import logging
 
-from migrations.session import get_db
+from migrations.session import get_async_db
 
 router = APIRouter()
 
@@ -18,9 +19,9 @@ router = APIRouter()
 
 
 @router.get("/get/{agent_id}")
-def get_agent_by_id(
+async def get_agent_by_id(
         agent_id: str,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """
     This function gets the settings of an agent by its ID
@@ -30,7 +31,7 @@ def get_agent_by_id(
     """
     if not check_uuid_format(agent_id):
         return response(False, status_code=400, message="Invalid UUID format")
-    agent = db.query(Agent).filter(Agent.agent_id == agent_id, Agent.status != 2).first()  # exclude deleted agents
+    agent = await db.scalar(select(Agent).where(Agent.agent_id == agent_id, Agent.status != 2))  # exclude deleted agents
     if agent is None:
         response(False, status_code=404, message="Agent not found")
 
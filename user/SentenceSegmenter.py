@@ -0,0 +1,131 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: SentenceSegmenter.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 11:05
+"""
+
+
+class SentenceSegmenter:
+    """
+    SentenceSegmenter: splits a streamed LLM reply into TTS chunks as tokens arrive.
+    A chunk is cut at a sentence boundary once it holds more than base_words + chunk_id * step_words words,
+    where chunk_id is the id of the last chunk cut (-1 before the first one), so the first chunk is short and
+    later chunks grow. Word count and boundary state are kept incrementally, each token is only scanned once.
+    A sentence ender only counts as a boundary when it is followed by whitespace, so decimals ("3.5"),
+    abbreviations ("e.g.") and enders split across tokens are handled. Abbreviations that also end sentences
+    ("etc.", "no.") are a boundary unless the next word starts with a lowercase letter.
+    The buffer is a list of characters joined only when a chunk is cut, so each character costs O(1).
+    """
+    SENTENCE_ENDERS = frozenset(".?!")
+    # closing characters that stay attached to the sentence they end
+    CLOSERS = frozenset("\"')]")
+    # never end a sentence
+    ABBREVIATIONS = frozenset({"e.g", "i.e", "vs", "mr", "mrs", "ms", "dr", "prof", "approx"})
+    # may end a sentence, decided by the next word
+    AMBIGUOUS_ABBREVIATIONS = frozenset({"etc", "inc", "ltd", "co", "corp", "jr", "sr", "st", "no", "u.s"})
+
+    def __init__(self, base_words: int = 16, step_words: int = 13):
+        self.base_words = base_words
+        self.step_words = step_words
+        self.chunk_id = -1  # chunk_id starts from 0, -1 means no chunk has been created
+        self.buffer: list[str] = []
+        self.word_count = 0  # words in the buffer
+        self.in_word = False
+        self.current_word = ""  # the word being read, used for abbreviation checks
+        self.pending_end = -1  # buffer index right after a sentence ender that still needs confirming
+        self.pending_words = 0  # words in the buffer up to pending_end
+        self.pending_ambiguous = False  # the pending ender ends an ambiguous abbreviation
+        self.awaiting_next_word = False  # the ambiguous ender is followed by whitespace, the next word decides
+
+    def min_words(self) -> int:
+        """
+        The number of words the next chunk must exceed before it can be cut.
+        """
+        return self.base_words + self.chunk_id * self.step_words
+
+    def feed(self, text: str) -> list[tuple[int, str]]:
+        """
+        Feed a token of the reply.
+        :param text: the new text
+        :return: the chunks completed by this token, as (chunk_id, chunk_text), usually empty or one chunk
+        """
+        chunks = []
+        for char in text:
+            if self.awaiting_next_word and not char.isspace():
+                self.awaiting_next_word = False
+                # "etc. and" continues the sentence, "etc. Next" does not
+                if not char.islower() and self.pending_words > self.min_words():
+                    chunks.append(self.__cut())
+                else:
+                    self.pending_end = -1
+            self.buffer.append(char)
+            if char.isspace():
+                if self.in_word:
+                    self.in_word = False
+                    self.current_word = ""
+                if self.pending_end != -1 and not self.awaiting_next_word:
+                    if self.pending_ambiguous:
+                        self.awaiting_next_word = True
+                    # the ender is followed by whitespace, it is a real boundary
+                    elif self.pending_words > self.min_words():
+                        chunks.append(self.__cut())
+                    else:
+                        self.pending_end = -1
+                continue
+            if not self.in_word:
+                self.in_word = True
+                self.word_count += 1
+            if char in self.SENTENCE_ENDERS:
+                abbreviation = self.__abbreviation() if char == "." else None
+                if abbreviation != "unambiguous":
+                    # "?!" and "..." extend the pending boundary
+                    self.pending_end = len(self.buffer)
+                    self.pending_words = self.word_count
+                    self.pending_ambiguous = abbreviation == "ambiguous"
+            elif char in self.CLOSERS and self.pending_end == len(self.buffer) - 1:
+                self.pending_end = len(self.buffer)
+            else:
+                # a letter or digit right after the ender, e.g. "3.5" or "U.S", not a boundary
+                self.pending_end = -1
+            self.current_word += char
+        return chunks
+
+    def flush(self) -> tuple[int, str] | None:
+        """
+        Cut whatever is left in the buffer, call this when the stream has finished.
+        :return: the last chunk as (chunk_id, chunk_text), or None if nothing is left
+        """
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.word_count = 0
+        self.in_word = False
+        self.current_word = ""
+        self.pending_end = -1
+        self.awaiting_next_word = False
+        if not text.strip():
+            return None
+        self.chunk_id += 1
+        return self.chunk_id, text
+
+    def __abbreviation(self) -> str | None:
+        """
+        Whether the word before a period is an abbreviation, "unambiguous", "ambiguous" or None.
+        """
+        word = self.current_word.lower().lstrip("\"'([")
+        # single letters are initials, e.g. "J. Smith"
+        if word in self.ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+            return "unambiguous"
+        return "ambiguous" if word in self.AMBIGUOUS_ABBREVIATIONS else None
+
+    def __cut(self) -> tuple[int, str]:
+        self.chunk_id += 1
+        text = "".join(self.buffer)
+        chunk = (self.chunk_id, text[:self.pending_end])
+        self.buffer = list(text[self.pending_end:])
+        # the remainder is only whitespace up to here, so it holds no words yet
+        self.word_count -= self.pending_words
+        self.pending_end = -1
+        return chunk
@@ -8,9 +8,10 @@
 """
 import os
 
-import requests
 from pydantic import BaseModel
 
+from common.ClientRegistry import client_registry
+
 
 class SttApiKeyResponse(BaseModel):
     status: str  # "success" or "fail"
@@ -48,7 +49,7 @@ class SttApiKey:
             "Authorization": f"Token {self.DEEPGRAM_API_KEY}"
         }
 
-        response = requests.post(url, json=payload, headers=headers)
+        response = client_registry.http_session.post(url, json=payload, headers=headers)
 
         # load the response content as a dictionary
         response_dict = response.json()
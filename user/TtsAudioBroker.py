@@ -0,0 +1,113 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: TtsAudioBroker.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 13:02
+"""
+import asyncio
+import time
+from typing import AsyncIterator
+
+from user.TtsAudioStore import TtsAudioStore
+
+
+class TtsSessionState:
+    """
+    The chunks of one TTS session that are ready so far.
+    """
+
+    def __init__(self):
+        self.chunks: dict[int, bool] = {}  # chunk_id -> whether the audio is available (False if synthesis failed)
+        self.last_chunk_id: int | None = None  # set once the chat stream knows how many chunks there are
+        self.progress = asyncio.Event()
+        self.updated_at = time.monotonic()
+
+    def touch(self):
+        self.updated_at = time.monotonic()
+        self.progress.set()
+
+
+class TtsAudioBroker:
+    """
+    TtsAudioBroker: tells audio streams when the chunks of a TTS session are ready.
+    The TTS pipeline publishes every chunk it finishes, and closes the session once the reply is complete,
+    so a single response can push a session's audio chunk by chunk, in order, as soon as each one lands.
+    """
+    SESSION_TTL = 600  # seconds to remember a session after its last update
+    POLL_INTERVAL = 0.5  # seconds, fallback check of the audio store for chunks written by another worker
+
+    def __init__(self):
+        self.sessions: dict[str, TtsSessionState] = {}
+
+    def publish(self, tts_session_id: str, chunk_id: int, available: bool = True):
+        """
+        Mark a chunk as finished.
+        :param tts_session_id: the TTS session id
+        :param chunk_id: the chunk id
+        :param available: False if the synthesis failed and the chunk should be skipped
+        """
+        session = self.__get_session(tts_session_id)
+        session.chunks[chunk_id] = available
+        session.touch()
+
+    def close(self, tts_session_id: str, last_chunk_id: int):
+        """
+        Mark the session as complete, no chunk after last_chunk_id will be published.
+        :param tts_session_id: the TTS session id
+        :param last_chunk_id: the last chunk id of the session, -1 if the session has no chunk
+        """
+        session = self.__get_session(tts_session_id)
+        session.last_chunk_id = last_chunk_id
+        session.touch()
+
+    async def chunks(self, tts_session_id: str, audio_store: TtsAudioStore,
+                     idle_timeout: float = 30) -> AsyncIterator[int]:
+        """
+        Yield the available chunk ids of a session in order, waiting for each one to be ready.
+        Sessions synthesized by another worker are followed through the audio store, chunks it records as failed
+        are skipped.
+        :param tts_session_id: the TTS session id
+        :param audio_store: the audio store the chunks are saved in
+        :param idle_timeout: stop when no chunk shows up for this many seconds
+        """
+        session = self.__get_session(tts_session_id)
+        chunk_id = 0
+        idle_since = time.monotonic()
+        while session.last_chunk_id is None or chunk_id <= session.last_chunk_id:
+            if chunk_id in session.chunks or await audio_store.exists(tts_session_id, str(chunk_id)):
+                if session.chunks.get(chunk_id, True):
+                    yield chunk_id
+                chunk_id += 1
+                idle_since = time.monotonic()
+                continue
+            if await audio_store.is_failed(tts_session_id, str(chunk_id)):
+                session.chunks[chunk_id] = False
+                continue
+            if session.last_chunk_id is None:
+                session.last_chunk_id = await audio_store.get_last_chunk(tts_session_id)
+                if session.last_chunk_id is not None:
+                    continue
+            if time.monotonic() - idle_since > idle_timeout:
+                return
+            session.progress.clear()
+            try:
+                await asyncio.wait_for(session.progress.wait(), timeout=self.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def __get_session(self, tts_session_id: str) -> TtsSessionState:
+        session = self.sessions.get(tts_session_id)
+        if session is None:
+            self.__prune()
+            session = self.sessions[tts_session_id] = TtsSessionState()
+        return session
+
+    def __prune(self):
+        expired_before = time.monotonic() - self.SESSION_TTL
+        for tts_session_id in [k for k, v in self.sessions.items() if v.updated_at < expired_before]:
+            del self.sessions[tts_session_id]
+
+
+tts_audio_broker = TtsAudioBroker()
@@ -0,0 +1,206 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: TtsAudioStore.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 13:45
+"""
+import asyncio
+import logging
+import os
+import shutil
+from abc import ABC, abstractmethod
+
+from common.ClientRegistry import client_registry
+from user.TtsJanitor import tts_janitor
+
+logger = logging.getLogger(__name__)
+
+
+class TtsAudioStore(ABC):
+    """
+    TtsAudioStore: where the synthesized audio chunks of TTS sessions are kept until they are served.
+    Chunks are written once with ORPHAN_TTL, and shortened to SERVED_TTL once served.
+    """
+    SERVED_TTL = tts_janitor.SERVED_TTL
+    ORPHAN_TTL = tts_janitor.ORPHAN_TTL
+
+    @abstractmethod
+    async def put(self, tts_session_id: str, chunk_id: str, content: bytes):
+        pass
+
+    async def put_from_file(self, tts_session_id: str, chunk_id: str, file_path: str) -> bool:
+        """
+        Store a chunk from an existing audio file, e.g. a cached phrase.
+        :return: False if the file does not exist
+        """
+        try:
+            content = await asyncio.to_thread(self._read_file, file_path)
+        except FileNotFoundError:
+            return False
+        await self.put(tts_session_id, chunk_id, content)
+        return True
+
+    @abstractmethod
+    async def get(self, tts_session_id: str, chunk_id: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    async def exists(self, tts_session_id: str, chunk_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def mark_served(self, tts_session_id: str, chunk_id: str):
+        pass
+
+    def local_file(self, tts_session_id: str, chunk_id: str) -> str | None:
+        """
+        The path of the chunk if it is a file on this node, so it can be streamed from disk instead of read whole.
+        """
+        return None
+
+    async def set_last_chunk(self, tts_session_id: str, last_chunk_id: int):
+        """
+        Record the last chunk id of a finished session, so a worker that did not run the chat can end its stream.
+        """
+        pass
+
+    async def get_last_chunk(self, tts_session_id: str) -> int | None:
+        return None
+
+    async def mark_failed(self, tts_session_id: str, chunk_id: str):
+        """
+        Record a chunk whose synthesis failed, so a worker that did not run the chat skips it instead of waiting.
+        """
+        pass
+
+    async def is_failed(self, tts_session_id: str, chunk_id: str) -> bool:
+        return False
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def _read_file(file_path: str) -> bytes:
+        with open(file_path, "rb") as f:
+            return f.read()
+
+
+class LocalTtsAudioStore(TtsAudioStore):
+    """
+    Chunks are files in the local volume, cleaned up by the TTS janitor. Only the node that ran the chat can serve them.
+    """
+    TTS_AUDIO_CACHE_FOLDER = "volume_cache/tts_audio_cache"
+
+    def file_path(self, tts_session_id: str, chunk_id: str | int) -> str:
+        return f"./{self.TTS_AUDIO_CACHE_FOLDER}/{tts_session_id}_{chunk_id}.mp3"
+
+    async def put(self, tts_session_id: str, chunk_id: str, content: bytes):
+        file_path = self.file_path(tts_session_id, chunk_id)
+        await asyncio.to_thread(self.__write_file, file_path, content)
+        # make sure the file is cleaned up even if the client never fetches it
+        tts_janitor.schedule(file_path, self.ORPHAN_TTL)
+
+    async def put_from_file(self, tts_session_id: str, chunk_id: str, file_path: str) -> bool:
+        target_path = self.file_path(tts_session_id, chunk_id)
+        linked = await asyncio.to_thread(self.__link_file, file_path, target_path)
+        if linked:
+            tts_janitor.schedule(target_path, self.ORPHAN_TTL)
+        return linked
+
+    async def get(self, tts_session_id: str, chunk_id: str) -> bytes | None:
+        try:
+            return await asyncio.to_thread(self._read_file, self.file_path(tts_session_id, chunk_id))
+        except FileNotFoundError:
+            return None
+
+    async def exists(self, tts_session_id: str, chunk_id: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self.file_path(tts_session_id, chunk_id))
+
+    def local_file(self, tts_session_id: str, chunk_id: str) -> str | None:
+        file_path = self.file_path(tts_session_id, chunk_id)
+        return file_path if os.path.isfile(file_path) else None
+
+    async def mark_served(self, tts_session_id: str, chunk_id: str):
+        # the janitor deletes the file once it has had time to be served
+        tts_janitor.schedule(self.file_path(tts_session_id, chunk_id), self.SERVED_TTL)
+
+    def __write_file(self, file_path: str, content: bytes):
+        os.makedirs(self.TTS_AUDIO_CACHE_FOLDER, exist_ok=True)
+        # write then rename, so a reader never sees a partial file
+        with open(f"{file_path}.tmp", "wb") as f:
+            f.write(content)
+        os.replace(f"{file_path}.tmp", file_path)
+
+    def __link_file(self, source_path: str, target_path: str) -> bool:
+        """
+        Hard link the file when possible instead of copying.
+        :return: False if the source file is gone (e.g. evicted from the phrase cache in the meantime)
+        """
+        os.makedirs(self.TTS_AUDIO_CACHE_FOLDER, exist_ok=True)
+        try:
+            try:
+                os.link(source_path, target_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(source_path, target_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+class RedisTtsAudioStore(TtsAudioStore):
+    """
+    Chunks are binary redis values with a TTL, so any worker can serve any chunk without sticky sessions.
+    The redis client is the shared one of the client registry, closed with it.
+    """
+    KEY_PREFIX = "tts_audio"
+
+    @property
+    def redis_client(self):
+        return client_registry.redis_async
+
+    def __key(self, tts_session_id: str, chunk_id: str | int) -> str:
+        return f"{self.KEY_PREFIX}:{tts_session_id}:{chunk_id}"
+
+    async def put(self, tts_session_id: str, chunk_id: str, content: bytes):
+        await self.redis_client.set(self.__key(tts_session_id, chunk_id), content, ex=self.ORPHAN_TTL)
+
+    async def get(self, tts_session_id: str, chunk_id: str) -> bytes | None:
+        return await self.redis_client.get(self.__key(tts_session_id, chunk_id))
+
+    async def exists(self, tts_session_id: str, chunk_id: str) -> bool:
+        return bool(await self.redis_client.exists(self.__key(tts_session_id, chunk_id)))
+
+    async def mark_served(self, tts_session_id: str, chunk_id: str):
+        await self.redis_client.expire(self.__key(tts_session_id, chunk_id), self.SERVED_TTL)
+
+    async def set_last_chunk(self, tts_session_id: str, last_chunk_id: int):
+        await self.redis_client.set(self.__key(tts_session_id, "last"), last_chunk_id, ex=self.ORPHAN_TTL)
+
+    async def get_last_chunk(self, tts_session_id: str) -> int | None:
+        last_chunk_id = await self.redis_client.get(self.__key(tts_session_id, "last"))
+        return int(last_chunk_id) if last_chunk_id is not None else None
+
+    async def mark_failed(self, tts_session_id: str, chunk_id: str):
+        await self.redis_client.set(self.__key(tts_session_id, f"failed:{chunk_id}"), 1, ex=self.ORPHAN_TTL)
+
+    async def is_failed(self, tts_session_id: str, chunk_id: str) -> bool:
+        return bool(await self.redis_client.exists(self.__key(tts_session_id, f"failed:{chunk_id}")))
+
+
+def get_tts_audio_store() -> TtsAudioStore:
+    """
+    Select the audio store backend with the TTS_AUDIO_STORE env variable, "local" (default) or "redis".
+    """
+    backend = os.getenv("TTS_AUDIO_STORE", "local")
+    if backend == "redis":
+        return RedisTtsAudioStore()
+    if backend != "local":
+        logger.warning(f"Unknown TTS_AUDIO_STORE {backend}, using local")
+    return LocalTtsAudioStore()
+
+
+tts_audio_store = get_tts_audio_store()
@@ -0,0 +1,135 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: TtsCache.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 11:40
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TtsCache:
+    """
+    TtsCache: content-addressed cache of synthesized audio for short, repeated phrases ("Okay.", "Correct.").
+    Entries are keyed by hash(voice model + normalized text), kept as files on disk so they survive restarts,
+    and evicted least-recently-used once the cache grows past max_bytes.
+    """
+    CACHE_FOLDER = "volume_cache/tts_phrase_cache"
+    MAX_BYTES = 200 * 1024 * 1024  # 200 MB
+    MAX_CACHEABLE_WORDS = 12  # longer chunks are rarely repeated, caching them would only churn the cache
+
+    def __init__(self, cache_folder: str = CACHE_FOLDER, max_bytes: int = MAX_BYTES):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, int] = OrderedDict()  # key -> file size, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.synthesis_seconds = 0.0  # time spent on deepgram for misses, to estimate what hits save
+        self.lock = threading.Lock()
+        self.__load()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        Normalize the text so trivially different chunks share an entry, punctuation is kept for prosody.
+        """
+        return " ".join(text.split()).casefold()
+
+    def key(self, model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\n{self.normalize(text)}".encode()).hexdigest()
+
+    def cacheable(self, text: str) -> bool:
+        return len(text.split()) <= self.MAX_CACHEABLE_WORDS
+
+    def get(self, model: str, text: str) -> str | None:
+        """
+        Look up the audio for a phrase.
+        :param model: the voice model
+        :param text: the text of the phrase
+        :return: the path of the cached audio file, or None on a miss
+        """
+        key = self.key(model, text)
+        with self.lock:
+            if key in self.entries and os.path.isfile(self.__path(key)):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.__path(key)
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, content: bytes, synthesis_seconds: float = 0.0):
+        """
+        Store the audio for a phrase, evicting least recently used entries if the cache is full.
+        :param model: the voice model
+        :param text: the text of the phrase
+        :param content: the audio content
+        :param synthesis_seconds: how long deepgram took to synthesize it
+        """
+        key = self.key(model, text)
+        path = self.__path(key)
+        try:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            # write then rename, so a reader never links a half written file
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing TTS cache entry: {e}")
+            return
+        with self.lock:
+            self.synthesis_seconds += synthesis_seconds
+            self.total_bytes += len(content) - self.entries.get(key, 0)
+            self.entries[key] = len(content)
+            self.entries.move_to_end(key)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted_key, evicted_size = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                try:
+                    os.remove(self.__path(evicted_key))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        """
+        Hit-rate counters, avg_synthesis_seconds * hits estimates the deepgram latency saved.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_synthesis_seconds": self.synthesis_seconds / self.misses if self.misses else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.cache_folder, f"{key}.mp3")
+
+    def __load(self):
+        """
+        Rebuild the index from disk, oldest access first.
+        """
+        if not os.path.isdir(self.cache_folder):
+            return
+        files = []
+        for entry in os.scandir(self.cache_folder):
+            if entry.is_file() and entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".mp3")], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+
+tts_cache = TtsCache()
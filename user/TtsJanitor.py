@@ -0,0 +1,118 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: TtsJanitor.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 12:20
+"""
+import asyncio
+import heapq
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TtsJanitor:
+    """
+    TtsJanitor: deletes TTS audio files once they expire.
+    A single async task keeps the files in a heap ordered by expiry, sleeps until the earliest one is due
+    and deletes everything that is due in one batch, so serving a file never holds a worker thread.
+    """
+    SERVED_TTL = 60  # seconds to keep a file after it has been served
+    ORPHAN_TTL = 600  # seconds to keep a file that is never served, e.g. the session was abandoned
+    BATCH_SIZE = 256
+
+    def __init__(self):
+        self.heap: list[tuple[float, str]] = []  # (expire_at, file_path)
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def schedule(self, file_path: str, ttl: float):
+        """
+        Delete the file ttl seconds from now. A file scheduled more than once is deleted at the earliest time.
+        :param file_path: the file to delete
+        :param ttl: seconds until the file is deleted
+        """
+        expire_at = time.time() + ttl
+        heapq.heappush(self.heap, (expire_at, file_path))
+        if self.heap[0][0] == expire_at:
+            # the new file expires before anything the janitor is sleeping on
+            self.wakeup.set()
+
+    async def start(self, folder: str):
+        """
+        Sweep the orphaned files left in the folder by a previous run, then start the janitor task.
+        :param folder: the TTS audio folder
+        """
+        await asyncio.to_thread(self.sweep, folder)
+        self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def sweep(self, folder: str):
+        """
+        Delete files older than ORPHAN_TTL and schedule the rest, files in the folder are unknown after a restart.
+        :param folder: the TTS audio folder
+        """
+        if not os.path.isdir(folder):
+            return
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(folder):
+            if not entry.is_file():
+                continue
+            try:
+                age = now - entry.stat().st_mtime
+                if age >= self.ORPHAN_TTL:
+                    os.remove(entry.path)
+                    removed += 1
+                else:
+                    # the janitor task is not running yet, no need to wake it up
+                    heapq.heappush(self.heap, (now + self.ORPHAN_TTL - age, entry.path))
+            except FileNotFoundError:
+                pass
+        logger.info(f"TTS janitor removed {removed} orphaned files from {folder}")
+
+    async def __run(self):
+        while True:
+            if not self.heap:
+                await self.wakeup.wait()
+            else:
+                delay = self.heap[0][0] - time.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            self.wakeup.clear()
+            batch = []
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now and len(batch) < self.BATCH_SIZE:
+                batch.append(heapq.heappop(self.heap)[1])
+            if batch:
+                try:
+                    await asyncio.to_thread(self.__delete_batch, batch)
+                except Exception as e:
+                    logger.error(f"Error deleting TTS files: {e}")
+
+    @staticmethod
+    def __delete_batch(file_paths: list[str]):
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                # scheduled more than once, or already gone
+                pass
+
+
+tts_janitor = TtsJanitor()
@@ -0,0 +1,109 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: TtsPipeline.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 10:12
+"""
+import asyncio
+import logging
+
+from user.TtsStream import TtsStream
+from user.TtsAudioBroker import tts_audio_broker
+from user.TtsAudioStore import tts_audio_store
+
+logger = logging.getLogger(__name__)
+
+
+class TtsPipeline:
+    """
+    TtsPipeline: runs TTS synthesis next to the chat stream, so the token stream never waits for Deepgram.
+    Sentences are put on a queue in chunk order and synthesized by a bounded pool of workers.
+    ready_chunk_id only advances over a contiguous run of finished chunks, so the client is never told
+    about a chunk whose audio (or an earlier chunk's audio) is not there yet.
+    """
+    MAX_WORKERS = 3
+
+    def __init__(self, tts: TtsStream, max_workers: int = MAX_WORKERS):
+        self.tts = tts
+        self.max_workers = max_workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.workers: list[asyncio.Task] = []
+        self.finished_chunk_ids: set[int] = set()
+        self.submitted_chunk_id = -1  # the last chunk id put on the queue
+        self.ready_chunk_id = -1  # every chunk up to and including this one has been synthesized
+        self.progress = asyncio.Event()
+
+    def submit(self, text: str, chunk_id: int):
+        """
+        Queue a chunk for synthesis. Chunks must be submitted in chunk_id order.
+        :param text: the text of the chunk
+        :param chunk_id: the chunk id, starting from 0
+        """
+        self.submitted_chunk_id = chunk_id
+        self.queue.put_nowait((text, chunk_id))
+        # start workers lazily, short replies never need the whole pool
+        if len(self.workers) < self.max_workers:
+            self.workers.append(asyncio.create_task(self.__worker()))
+
+    async def close(self):
+        """
+        Tell the audio streams of this session, on any worker, that no more chunks will be submitted.
+        """
+        tts_audio_broker.close(self.tts.tts_session_id, self.submitted_chunk_id)
+        try:
+            await tts_audio_store.set_last_chunk(self.tts.tts_session_id, self.submitted_chunk_id)
+        except Exception as e:
+            logger.error(f"Error recording the last TTS chunk: {e}")
+
+    @property
+    def done(self) -> bool:
+        """
+        True when every submitted chunk has been synthesized (or has failed).
+        """
+        return self.ready_chunk_id == self.submitted_chunk_id
+
+    async def wait_for_progress(self) -> int:
+        """
+        Wait until ready_chunk_id advances.
+        :return: the new ready_chunk_id
+        """
+        await self.progress.wait()
+        self.progress.clear()
+        return self.ready_chunk_id
+
+    def cancel(self):
+        """
+        Stop all workers, used when the client goes away mid-stream.
+        """
+        for worker in self.workers:
+            worker.cancel()
+
+    async def __worker(self):
+        while True:
+            text, chunk_id = await self.queue.get()
+            available = False
+            try:
+                available = await self.tts.stream_tts(text, str(chunk_id))
+            except Exception as e:
+                # a failed chunk is skipped instead of blocking every chunk after it
+                logger.error(f"Error synthesizing TTS chunk {chunk_id}: {e}")
+            tts_audio_broker.publish(self.tts.tts_session_id, chunk_id, available)
+            if not available:
+                try:
+                    await tts_audio_store.mark_failed(self.tts.tts_session_id, str(chunk_id))
+                except Exception as e:
+                    logger.error(f"Error recording the failed TTS chunk {chunk_id}: {e}")
+            self.__mark_finished(chunk_id)
+            self.queue.task_done()
+
+    def __mark_finished(self, chunk_id: int):
+        self.finished_chunk_ids.add(chunk_id)
+        advanced = False
+        while self.ready_chunk_id + 1 in self.finished_chunk_ids:
+            self.ready_chunk_id += 1
+            self.finished_chunk_ids.discard(self.ready_chunk_id)
+            advanced = True
+        if advanced:
+            self.progress.set()
@@ -6,11 +6,16 @@
 @email: rxy216@case.edu
 @time: 3/1/24 19:30
 """
-import requests
 import os
-
 import time
-from dotenv import load_dotenv
+import asyncio
+import logging
+
+from user.TtsCache import tts_cache
+from user.TtsAudioStore import tts_audio_store
+from common.ClientRegistry import client_registry
+
+logger = logging.getLogger(__name__)
 
 
 class TtsStream:
@@ -18,14 +23,29 @@ class TtsStream:
     TtsStream: Text-to-Speech streaming with Deepgram API.
     """
     # Define the API endpoint
-    URL = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-    TTS_AUDIO_CACHE_FOLDER = "volume_cache/tts_audio_cache"
+    MODEL = "aura-asteria-en"
+    URL = f"https://api.deepgram.com/v1/speak?model={MODEL}"
 
     def __init__(self, tts_session_id: str):
         self.API_KEY = os.getenv("DEEPGRAM_API_KEY")
         self.tts_session_id = tts_session_id
 
-    def stream_tts(self, text: str, chunk_id: str):
+    async def stream_tts(self, text: str, chunk_id: str) -> bool:
+        """
+        Synthesize the text and save the audio for this session's chunk in the audio store.
+        :param text: the text to synthesize
+        :param chunk_id: the chunk id of the text in this session
+        :return: True if the audio is saved, False otherwise
+        """
+        cacheable = tts_cache.cacheable(text)
+        if cacheable:
+            # the cache checks and writes files, keep it off the event loop
+            cached_path = await asyncio.to_thread(tts_cache.get, self.MODEL, text)
+            # the cached file may have been evicted in the meantime, synthesize it again then
+            if cached_path and await tts_audio_store.put_from_file(self.tts_session_id, chunk_id, cached_path):
+                logger.info("TTS audio served from cache.")
+                return True
+
         # Define the headers
         headers = {
             "Authorization": f"Token {self.API_KEY}",
@@ -38,16 +58,17 @@ class TtsStream:
         }
 
         # Make the POST request
-        response = requests.post(self.URL, headers=headers, json=payload)
+        start_time = time.monotonic()
+        response = await client_registry.http.post(self.URL, headers=headers, json=payload)
 
         # Check if the request was successful
         if response.status_code == 200:
-            # check if the folder exists
-            if not os.path.exists(self.TTS_AUDIO_CACHE_FOLDER):
-                os.makedirs(self.TTS_AUDIO_CACHE_FOLDER)
-            # Save the response content to a file
-            with open(f"./{self.TTS_AUDIO_CACHE_FOLDER}/{self.tts_session_id}_{chunk_id}.mp3", "wb") as f:
-                f.write(response.content)
-            print("TTS file saved successfully.")
+            await tts_audio_store.put(self.tts_session_id, chunk_id, response.content)
+            logger.info("TTS audio saved successfully.")
+            if cacheable:
+                await asyncio.to_thread(tts_cache.put, self.MODEL, text, response.content,
+                                        time.monotonic() - start_time)
+            return True
         else:
-            print(f"Error: {response.status_code} - {response.text}")
+            logger.error(f"Error: {response.status_code} - {response.text}")
+            return False
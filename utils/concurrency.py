@@ -0,0 +1,29 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: concurrency.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 18:10
+"""
+import asyncio
+import inspect
+from typing import Any
+
+
+async def fan_out(*reads) -> list[Any]:
+    """
+    Run independent reads (e.g. queries on different tables) concurrently, so the caller waits for the slowest
+    one instead of the sum of all of them.
+    If one read fails, the others are cancelled and its exception is raised.
+    :param reads: awaitables, or zero-argument blocking callables which are run in worker threads
+    :return: the results, in the order of the reads
+    """
+    tasks = [asyncio.ensure_future(read if inspect.isawaitable(read) else asyncio.to_thread(read))
+             for read in reads]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
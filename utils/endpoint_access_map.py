@@ -20,6 +20,7 @@ endpoint_access_map = {
     "/threads/get_thread_list": {"student": True, "teacher": True, "admin": True},
     "/stream_chat": {"student": True, "teacher": True, "admin": True},
     "/get_tts_file": {"student": True, "teacher": True, "admin": True},
+    "/stream_tts_session": {"student": True, "teacher": True, "admin": True},
     "/get_temp_stt_auth_code": {"student": True, "teacher": True, "admin": True},
     "/access/get_user_list": {"student": False, "teacher": True, "admin": True},
     "/access/grant_access": {"student": False, "teacher": True, "admin": True},
@@ -28,6 +29,7 @@ endpoint_access_map = {
     # workspace
     "/workspace/create": {"student": False, "teacher": True, "admin": True},
     "/workspace/add_authorized_users": {"student": False, "teacher": True, "admin": True},
+    "/workspace/add_authorized_users_csv": {"student": False, "teacher": True, "admin": True},
     "/workspace/join": {"student": True, "teacher": True, "admin": True},
     "/workspace/list_users": {"student": False, "teacher": True, "admin": True},
     "/workspace/delete_user": {"student": False, "teacher": True, "admin": True},
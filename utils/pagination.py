@@ -0,0 +1,121 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: pagination.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 15:20
+"""
+import json
+import base64
+import binascii
+from datetime import datetime
+from uuid import UUID
+
+from cachetools import TTLCache
+from sqlalchemy import select, func, and_, or_, false
+
+from utils.response import response
+
+# totals returned by the cursor api are cached this many seconds, they are only shown as a hint
+COUNT_CACHE_TTL = 60
+count_cache = TTLCache(maxsize=2048, ttl=COUNT_CACHE_TTL)
+
+
+def encode_cursor(*values) -> str:
+    """
+    Encode the sort key of the last row of a page into an opaque cursor
+    :param values: the sort key values, str, int, datetime, UUID or None
+    """
+    plain = [value.isoformat() if isinstance(value, datetime) else
+             str(value) if isinstance(value, UUID) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(plain).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: tuple) -> tuple | None:
+    """
+    Decode a cursor made by encode_cursor
+    :param cursor: the cursor, an empty string means the first page
+    :param types: the type of each sort key value, str, int, datetime or UUID
+    :return: the sort key values, or None for the first page
+    """
+    if cursor == "":
+        return None
+    try:
+        plain = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(plain) != len(types):
+            raise ValueError("cursor length mismatch")
+        return tuple(None if value is None else
+                     datetime.fromisoformat(value) if value_type is datetime else
+                     value_type(value) for value, value_type in zip(plain, types))
+    except (ValueError, TypeError, binascii.Error):
+        response(False, status_code=400, message="Invalid cursor")
+
+
+def keyset_after(sort_column, tie_column, cursor_values: tuple | None, descending: bool = True):
+    """
+    The filter selecting the rows after the cursor, for a listing ordered by (sort_column, tie_column)
+    with NULL sort values last, see keyset_order.
+    :param sort_column: the sort column, may be nullable
+    :param tie_column: a unique column breaking ties, or None if sort_column is unique
+    :param cursor_values: the decoded cursor, (sort value, tie value), or (sort value,) without a tie column
+    :param descending: whether the listing is in descending order
+    :return: the filter, or None for the first page
+    """
+    if cursor_values is None:
+        return None
+    sort_value = cursor_values[0]
+    tie_value = cursor_values[1] if tie_column is not None else None
+    if sort_value is None:
+        # the cursor is already among the NULL rows at the end
+        if tie_column is None:
+            return false()
+        return and_(sort_column.is_(None), tie_column < tie_value if descending else tie_column > tie_value)
+    past = sort_column < sort_value if descending else sort_column > sort_value
+    if tie_column is not None:
+        tie_past = tie_column < tie_value if descending else tie_column > tie_value
+        past = or_(past, and_(sort_column == sort_value, tie_past))
+    return or_(past, sort_column.is_(None))
+
+
+def keyset_order(sort_column, tie_column, descending: bool = True) -> list:
+    """
+    The ORDER BY matching keyset_after
+    """
+    if descending:
+        order = [sort_column.desc().nulls_last()]
+        if tie_column is not None:
+            order.append(tie_column.desc())
+    else:
+        order = [sort_column.asc().nulls_last()]
+        if tie_column is not None:
+            order.append(tie_column.asc())
+    return order
+
+
+def keyset_page(rows: list, page_size: int, cursor_of) -> tuple[list, str | None]:
+    """
+    Cut a page out of page_size + 1 fetched rows
+    :param rows: the rows fetched with limit(page_size + 1)
+    :param page_size: the page size
+    :param cursor_of: function turning a row into its cursor
+    :return: the rows of the page, and the cursor of the next page or None if this is the last page
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, cursor_of(rows[-1])
+
+
+async def cached_count(db, query, cache_key: tuple) -> int:
+    """
+    The number of rows of a query, cached for COUNT_CACHE_TTL seconds
+    :param db: the async database session
+    :param query: the select statement, without order, offset or limit
+    :param cache_key: identifies the query and its filters
+    """
+    total = count_cache.get(cache_key)
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+        count_cache[cache_key] = total
+    return total
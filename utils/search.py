@@ -0,0 +1,20 @@
+# Copyright (c) 2024.
+# -*-coding:utf-8 -*-
+"""
+@file: search.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 10/18/26 16:05
+"""
+
+LIKE_ESCAPE = "\\"
+
+
+def contains_pattern(term: str) -> str:
+    """
+    The LIKE / ILIKE pattern matching values that contain the term, with the term's own wildcards escaped.
+    Use it with .ilike(pattern, escape=LIKE_ESCAPE), the trigram indexes serve these searches.
+    :param term: the search term typed by the user
+    """
+    escaped = term.replace(LIKE_ESCAPE, LIKE_ESCAPE * 2).replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
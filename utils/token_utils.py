@@ -1,7 +1,12 @@
 import jwt
 import os
+import time
+import hashlib
 import logging
+import threading
 from datetime import datetime, timedelta, timezone
+from cachetools import TLRUCache
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +47,10 @@ private_key = os.getenv("JWT_PRIVATE_KEY")
 private_key = private_key.replace('!', '\n')
 public_key = os.getenv("JWT_PUBLIC_KEY")
 public_key = public_key.replace('!', '\n')
+# parse the keys once, given as PEM strings PyJWT parses (and checks) them again on every encode and decode,
+# about 50ms per signature for the private key
+private_key = load_pem_private_key(private_key.encode(), password=None)
+public_key = load_pem_public_key(public_key.encode())
 algorithm = "RS256"
 
 
@@ -79,3 +88,30 @@ def parse_token(jwt_token: str) -> dict:
         logger.error(f"Invalid Token")
         return {"success": False, "status_code": 401002,
                 "message": "Invalid token"}
+
+
+# verified access token payloads, keyed by token hash, each entry expires at the token's exp
+VERIFIED_TOKEN_CACHE_SIZE = 4096
+verified_token_cache = TLRUCache(maxsize=VERIFIED_TOKEN_CACHE_SIZE, ttu=lambda key, value, now: value['exp'],
+                                 timer=time.time)
+verified_token_cache_lock = threading.Lock()
+
+
+def parse_token_cached(jwt_token: str) -> dict:
+    """
+    Same as parse_token, but a token that has been verified before is served from the cache until it expires,
+    so the RS256 signature is only checked once per token instead of once per request.
+    """
+    if not jwt_token:
+        return parse_token(jwt_token)
+    token_hash = hashlib.sha256(jwt_token.encode()).digest()
+    with verified_token_cache_lock:
+        decoded = verified_token_cache.get(token_hash)
+    if decoded is not None:
+        return {"success": True, "status_code": 200, "message": "",
+                "data": decoded}
+    parse_result = parse_token(jwt_token)
+    if parse_result['success'] and 'exp' in parse_result['data']:
+        with verified_token_cache_lock:
+            verified_token_cache[token_hash] = parse_result['data']
+    return parse_result